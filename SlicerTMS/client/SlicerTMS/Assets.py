@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import vtk
+import slicer
+import sitkUtils
+import SimpleITK as sitk
+
+log = logging.getLogger(__name__)
+
+
+class AssetReader:
+    """
+    Decodes the files of an example on worker threads. The VTK mesh readers
+    and SimpleITK volume reads run off the GUI thread (gzip and parsing are the
+    slow part); MRML nodes are only created on the main thread, from the
+    decoded data, by the add* methods. Readers that need the scene (grid
+    transforms, fiber bundle storage) stay on the main thread.
+    """
+
+    MAX_WORKERS = 4
+
+    # (real path, size, mtime) -> content hash, so a file is only hashed again when it changes
+    hashes = {}
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.executor = ThreadPoolExecutor(max_workers=AssetReader.MAX_WORKERS, thread_name_prefix='TMSAssets')
+        self.futures = {}
+
+    def path(self, fileName):
+        return os.path.join(self.directory, fileName)
+
+    def submit(self, key, function, fileName):
+        """Start decoding fileName in the background unless it is already queued; missing files are skipped"""
+        if key not in self.futures and os.path.isfile(self.path(fileName)):
+            self.futures[key] = self.executor.submit(AssetReader.timed, key, function, self.path(fileName))
+        return self.futures.get(key)
+
+    def result(self, key):
+        """Block until the decoded data for key is ready; None if it was never submitted"""
+        future = self.futures.get(key)
+        return future.result() if future is not None else None
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def timed(key, function, path):
+        st = timeit.default_timer()
+        data = function(path)
+        log.debug("Decoded %s in %.3f s", key, timeit.default_timer() - st)
+        return data
+
+    @staticmethod
+    def fileHash(path, blockSize=1 << 22):
+        """SHA-1 of a file's content, the key of the on-disk caches of derived data"""
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        digest = AssetReader.hashes.get(key)
+        if digest is None:
+            sha = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(blockSize), b''):
+                    sha.update(block)
+            digest = AssetReader.hashes[key] = sha.hexdigest()
+        return digest
+
+    @staticmethod
+    def readPolyData(path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.stl':
+            reader = vtk.vtkSTLReader()
+        elif extension == '.vtp':
+            reader = vtk.vtkXMLPolyDataReader()
+        else:
+            reader = vtk.vtkPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        polyData = vtk.vtkPolyData()
+        polyData.ShallowCopy(reader.GetOutput())
+        return polyData
+
+    @staticmethod
+    def readImage(path):
+        return sitk.ReadImage(path)
+
+    @staticmethod
+    def readIJKToRAS(path):
+        """IJK to RAS matrix of a volume from its header only, no voxel data"""
+        reader = sitk.ImageFileReader()
+        reader.SetFileName(path)
+        reader.ReadImageInformation()
+        direction = np.array(reader.GetDirection()).reshape(3, 3)
+        ijkToLps = np.eye(4)
+        ijkToLps[:3, :3] = direction * np.array(reader.GetSpacing())
+        ijkToLps[:3, 3] = reader.GetOrigin()
+        ijkToRas = np.diag([-1.0, -1.0, 1.0, 1.0]) @ ijkToLps
+        return slicer.util.vtkMatrixFromArray(ijkToRas)
+
+    @staticmethod
+    def addModel(polyData, name):
+        modelNode = slicer.modules.models.logic().AddModel(polyData)
+        modelNode.SetName(name)
+        return modelNode
+
+    @staticmethod
+    def addFiberBundle(polyData, name):
+        fiberNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLFiberBundleNode', name)
+        fiberNode.SetAndObservePolyData(polyData)
+        fiberNode.CreateDefaultDisplayNodes()
+        return fiberNode
+
+    @staticmethod
+    def addVolume(image, name, className='vtkMRMLScalarVolumeNode'):
+        volumeNode = sitkUtils.PushVolumeToSlicer(image, name=name, className=className)
+        volumeNode.CreateDefaultDisplayNodes()
+        return volumeNode
+
+    @staticmethod
+    def updateVolume(image, volumeNode):
+        """Replace the voxels and geometry of an existing volume node"""
+        sitkUtils.PushVolumeToSlicer(image, targetNode=volumeNode)
+        return volumeNode
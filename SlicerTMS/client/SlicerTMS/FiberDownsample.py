@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import tempfile
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
+from Assets import AssetReader
+from Mapper import FiberSampler
+
+log = logging.getLogger(__name__)
+
+
+class FiberDownsampler:
+    """
+    Headless replacement for driving the TractographyDownsample widget.
+    Works on the polyline arrays of a tractography file (points, line
+    offsets, connectivity) with numpy only:
+      - drops lines with fewer than minPoints points or an arc length
+        outside [minLength, maxLength] mm
+      - keeps percentage % of the remaining lines, evenly spread over the
+        file so the result does not depend on a random seed
+      - resamples every line at equal arc length steps of at most stepSize mm,
+        keeping both end points
+    The result is cached on disk as .npz, keyed by the SHA-1 of the input
+    file and the parameters, so loading the same subject again skips both
+    the tractography reader and the downsampling.
+    """
+
+    STEP_SIZE = 5.0  # mm
+    PERCENTAGE = 1.0  # % of the lines kept
+    MIN_POINTS = 3
+    MIN_LENGTH = 10.0  # mm
+    MAX_LENGTH = 180.0  # mm
+    CACHE_VERSION = 1  # bump when the algorithm changes
+
+    def __init__(self, stepSize=STEP_SIZE, percentage=PERCENTAGE, minPoints=MIN_POINTS,
+                 minLength=MIN_LENGTH, maxLength=MAX_LENGTH, cacheDirectory=None):
+        self.stepSize = float(stepSize)
+        self.percentage = float(percentage)
+        self.minPoints = int(minPoints)
+        self.minLength = float(minLength)
+        self.maxLength = float(maxLength)
+        self.cacheDirectory = cacheDirectory or os.environ.get(
+            'TMS_FIBER_CACHE', os.path.join(tempfile.gettempdir(), 'slicertms_fiber_cache'))
+
+    def parameters(self):
+        return (f"v{FiberDownsampler.CACHE_VERSION} step={self.stepSize} pct={self.percentage} "
+                f"minpts={self.minPoints} len={self.minLength}-{self.maxLength}")
+
+    def cachePath(self, path):
+        key = hashlib.sha1((AssetReader.fileHash(path) + self.parameters()).encode()).hexdigest()
+        return os.path.join(self.cacheDirectory, key + '.npz')
+
+    @staticmethod
+    def lineLengths(points, offsets, connectivity):
+        """Arc length of every line, and of every segment (one per point, 0 at each line start)"""
+        segments = np.zeros(len(connectivity))
+        if len(connectivity) > 1:
+            segments[1:] = np.linalg.norm(np.diff(points[connectivity], axis=0), axis=1)
+        counts = np.diff(offsets)
+        segments[offsets[:-1][counts > 0]] = 0.0  # no segment across two lines
+        lengths = np.zeros(len(counts))
+        nonEmpty = np.flatnonzero(counts > 0)
+        if len(nonEmpty):
+            lengths[nonEmpty] = np.add.reduceat(segments, offsets[nonEmpty])
+        return lengths, segments
+
+    def select(self, offsets, lengths):
+        """Indices of the lines that pass the filters and the percentage subsampling"""
+        counts = np.diff(offsets)
+        keep = np.flatnonzero((counts >= max(self.minPoints, 2)) &
+                              (lengths >= self.minLength) & (lengths <= self.maxLength))
+        if self.percentage < 100.0 and len(keep):
+            picks = np.floor(np.arange(0.0, len(keep), 100.0 / self.percentage)).astype(np.int64)
+            keep = keep[np.unique(picks)]
+        return keep
+
+    def resample(self, points, offsets, connectivity, segments, lengths, lines):
+        """
+        Resample the given lines at equal arc length steps, all lines at once
+        Returns the new points (float32) and line offsets.
+        """
+        counts = np.diff(offsets)[lines]
+        firstVertex = np.cumsum(counts) - counts
+        # input vertices of the selected lines, one flat run per line
+        vertex = np.arange(counts.sum()) - np.repeat(firstVertex - offsets[lines], counts)
+        xyz = points[connectivity[vertex]]
+        # arc length along the line, with a gap of 1 mm between lines so one
+        # sorted axis serves every line
+        base = np.cumsum(lengths[lines] + 1.0) - (lengths[lines] + 1.0)
+        position = np.cumsum(segments[vertex])
+        position += np.repeat(base - position[firstVertex], counts)
+
+        outCounts = np.maximum(np.ceil(lengths[lines] / self.stepSize), 1).astype(np.int64) + 1
+        step = lengths[lines] / (outCounts - 1)
+        outLine = np.repeat(np.arange(len(lines)), outCounts)
+        index = np.arange(outCounts.sum()) - np.repeat(np.cumsum(outCounts) - outCounts, outCounts)
+        target = base[outLine] + index * step[outLine]
+
+        lastSegment = firstVertex + counts - 2
+        left = np.searchsorted(position, target, side='right') - 1
+        left = np.clip(left, firstVertex[outLine], lastSegment[outLine])
+        width = position[left + 1] - position[left]
+        fraction = np.divide(target - position[left], width, out=np.zeros_like(width), where=width > 0)
+        fraction = np.clip(fraction, 0.0, 1.0)[:, None]
+        resampled = xyz[left] * (1.0 - fraction) + xyz[left + 1] * fraction
+        return resampled.astype(np.float32), np.concatenate([[0], np.cumsum(outCounts)]).astype(np.int64)
+
+    def downsampleArrays(self, points, offsets, connectivity):
+        """Filter, subsample and resample polylines given as numpy arrays"""
+        points = np.asarray(points, dtype=np.float64)
+        lengths, segments = FiberDownsampler.lineLengths(points, offsets, connectivity)
+        lines = self.select(offsets, lengths)
+        if not len(lines):
+            return np.empty((0, 3), dtype=np.float32), np.zeros(1, dtype=np.int64)
+        return self.resample(points, offsets, connectivity, segments, lengths, lines)
+
+    @staticmethod
+    def toPolyData(points, offsets):
+        polyData = vtk.vtkPolyData()
+        vtkPoints = vtk.vtkPoints()
+        vtkPoints.SetData(numpy_to_vtk(points, deep=True))
+        polyData.SetPoints(vtkPoints)
+        lines = vtk.vtkCellArray()
+        connectivity = np.arange(len(points), dtype=np.int64)
+        if hasattr(lines, 'SetData') and hasattr(lines, 'GetOffsetsArray'):
+            lines.SetData(numpy_to_vtk(offsets, deep=True, array_type=vtk.VTK_ID_TYPE),
+                          numpy_to_vtk(connectivity, deep=True, array_type=vtk.VTK_ID_TYPE))
+        else:
+            # legacy layout: [n, id0, ..., id(n-1), n, ...]
+            counts = np.diff(offsets)
+            legacy = np.insert(connectivity, offsets[:-1], counts)
+            lines.SetCells(len(counts), numpy_to_vtk(legacy, deep=True, array_type=vtk.VTK_ID_TYPE))
+        polyData.SetLines(lines)
+        return polyData
+
+    def downsample(self, path):
+        """Downsampled polydata of a tractography file, from the cache when possible"""
+        cachePath = self.cachePath(path)
+        if os.path.isfile(cachePath):
+            try:
+                with np.load(cachePath) as cached:
+                    points, offsets = cached['points'], cached['offsets']
+                log.info("Fibers from cache %s: %d lines", cachePath, len(offsets) - 1)
+                return FiberDownsampler.toPolyData(points, offsets)
+            except (OSError, KeyError, ValueError) as e:
+                log.warning("Ignoring unreadable fiber cache %s: %s", cachePath, e)
+
+        polyData = AssetReader.readPolyData(path)
+        offsets, connectivity = FiberSampler.lineArrays(polyData)
+        points = vtk_to_numpy(polyData.GetPoints().GetData())
+        points, newOffsets = self.downsampleArrays(points, offsets, connectivity)
+        log.info("Downsampled %d to %d lines (%s)", len(offsets) - 1, len(newOffsets) - 1, self.parameters())
+
+        try:
+            os.makedirs(self.cacheDirectory, exist_ok=True)
+            partial = cachePath + f'.{os.getpid()}.tmp.npz'
+            np.savez(partial, points=points, offsets=newOffsets)
+            os.replace(partial, cachePath)
+        except OSError as e:
+            log.warning("Could not write fiber cache %s: %s", cachePath, e)
+        return FiberDownsampler.toPolyData(points, newOffsets)
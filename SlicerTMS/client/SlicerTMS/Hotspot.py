@@ -0,0 +1,76 @@
+import numpy as np
+import slicer
+import vtk
+
+
+class Hotspot:
+    """
+    Hotspot and dose statistics of an E-field volume, computed on a zero-copy
+    arrayFromVolume view:
+      - top-k peak voxels (argmax, or argpartition for k > 1) mapped to RAS
+        with the volume's own IJK to RAS matrix
+      - percentiles of the field inside the head (nonzero voxels), all from
+        one partition
+      - E50/E90 volumes: tissue volume where E >= 50% / 90% of the maximum
+    """
+
+    TOP_K = 5
+    PERCENTILES = (50, 90, 99)
+    FRACTIONS_OF_MAX = (0.5, 0.9)  # E50, E90
+
+    @staticmethod
+    def topPeaks(flat, k):
+        """Flat indices of the k largest values, largest first"""
+        if k <= 1:
+            return np.array([np.argmax(flat)])
+        k = min(k, flat.size)
+        top = np.argpartition(flat, -k)[-k:]
+        return top[np.argsort(flat[top])[::-1]]
+
+    @staticmethod
+    def analyze(volumeNode, topK=None, percentiles=None, fractionsOfMax=None):
+        topK = topK or Hotspot.TOP_K
+        percentiles = percentiles or Hotspot.PERCENTILES
+        fractionsOfMax = fractionsOfMax or Hotspot.FRACTIONS_OF_MAX
+
+        voxels = slicer.util.arrayFromVolume(volumeNode)  # view, (k, j, i)
+        flat = voxels.reshape(-1)
+
+        ijkToRas = vtk.vtkMatrix4x4()
+        volumeNode.GetIJKToRASMatrix(ijkToRas)
+        ijkToRas = slicer.util.arrayFromVTKMatrix(ijkToRas)
+
+        top = Hotspot.topPeaks(flat, topK)
+        kji = np.array(np.unravel_index(top, voxels.shape))
+        ijk1 = np.vstack([kji[::-1], np.ones(len(top))])
+        ras = (ijkToRas @ ijk1)[:3].T
+        peaks = [{'value': float(flat[idx]), 'ijk': tuple(int(v) for v in kji[::-1, n]), 'ras': ras[n]}
+                 for n, idx in enumerate(top)]
+
+        eMax = peaks[0]['value']
+        tissue = flat[flat > 0]
+        voxelVolume = float(np.prod(volumeNode.GetSpacing()))  # mm^3
+        stats = {
+            'max': eMax,
+            'peaks': peaks,
+            'percentiles': {},
+            'volumes_cm3': {},
+        }
+        if tissue.size:
+            # np.percentile partitions once for all requested percentiles
+            for p, value in zip(percentiles, np.percentile(tissue, percentiles)):
+                stats['percentiles'][p] = float(value)
+            for fraction in fractionsOfMax:
+                count = np.count_nonzero(tissue >= fraction * eMax)
+                stats['volumes_cm3'][int(round(fraction * 100))] = count * voxelVolume / 1000.0
+        return stats
+
+    @staticmethod
+    def summary(stats):
+        peak = stats['peaks'][0]
+        text = f"Emax {stats['max']:.4g} at RAS ({peak['ras'][0]:.1f}, {peak['ras'][1]:.1f}, {peak['ras'][2]:.1f})"
+        if stats['percentiles']:
+            text += ", " + ", ".join(f"P{p} {v:.4g}" for p, v in stats['percentiles'].items())
+        if stats['volumes_cm3']:
+            text += ", " + ", ".join(f"E{f} {v:.2f} cm3" for f, v in stats['volumes_cm3'].items())
+        return text
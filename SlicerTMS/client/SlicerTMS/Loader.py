@@ -1,10 +1,19 @@
+import logging
 import os
+import timeit
 import vtk, qt, ctk, slicer, sitkUtils
 import SimpleITK as sitk
 # from slicer.ScriptedLoadableModule import *
 import numpy as np
 import Rendering as ren
 import Mapper as M
+import Scheduler as S
+from Tracer import LatencyTracer
+from Assets import AssetReader
+from MeshLOD import MeshLOD
+from FiberDownsample import FiberDownsampler
+
+log = logging.getLogger(__name__)
 
 __all__ = ['Loader']
 
@@ -37,6 +46,7 @@ class Loader:
         self._magnorm_file = 'magnorm.nii.gz'
         self._magfield_file = 'magfield.nii.gz'
         self._conductivity_file = 'conductivity.nii.gz'
+        self._labels_file = 'labels.nii.gz'  # optional cortical parcellation for region statistics
         print("File paths initialized")
 
         self.modelNode = None
@@ -46,14 +56,33 @@ class Loader:
         self.markupsPlaneNode = None
 
         self.conductivityNode = None
+        self.labelNode = None
         self.magfieldGTNode = None
         self.magfieldNode = None
         self.magnormNode = None
         self.efieldNode = None
         self.enormNode = None
         self.coilDefaultMatrix = vtk.vtkMatrix4x4()
+        self.resliceEngine = None  # Mapper.ResliceEngine, created on the first map
+        self.meshSampler = None  # Mapper.MeshSampler, gm vertex-to-voxel index built on the first E-field
+        self.meshSamplers = {}  # one per gm level of detail
+        self.meshLOD = MeshLOD()  # coarse gm and skin while the coil is dragged
+        self.regionStats = None  # RegionStats, per-region voxel index built on the first E-field
+        self.traceServer = None  # TraceId and server timestamps of the E-field being displayed
+        self.traceReceived = None
+        self.traceReassembled = None
 
         self.IGTLNode = None
+        self.assets = None  # Assets.AssetReader, decodes the example files in the background
+        self.loadStart = None  # set until the first E-field is shown
+        self.roi = None
+        self.fiberBundleNodes = []  # 'fibers' and 'FiberBundle', sharing the downsampled polydata
+        self.mapScheduler = None
+        self.reusing = False  # set while reuse() swaps the data of pyigtl_data
+
+        # what this example added to the scene, removed again by unload()
+        self.ownedNodes = []
+        self.observations = []  # (observed object, observer tag)
 
         self.showMag = False #switch between magnetic and electric field for visualization
 
@@ -77,12 +106,92 @@ class Loader:
     #     self.pubTransform.Publish(transformMatrix)
 
     def callMapper(self, param1=None, param2=None):
-        print("CallMapper method called")
         M.Mapper.map(self, time=True)
 
+    def coilPose(self):
+        """Current coil plane pose as a 4x4 numpy array, for the update scheduler"""
+        matrixFromFid = vtk.vtkMatrix4x4()
+        self.markupsPlaneNode.GetObjectToWorldMatrix(matrixFromFid)
+        return slicer.util.arrayFromVTKMatrix(matrixFromFid)
+
+    @staticmethod
+    def graymatterFile(data_directory):
+        """File name of the gray matter mesh of an example (.stl or .vtk), None if it has none"""
+        for extension in ('.stl', '.vtk'):
+            if os.path.isfile(os.path.join(str(data_directory), 'gm' + extension)):
+                return 'gm' + extension
+        return None
+
+    def own(self, node):
+        """Remember a node added for this example so unload() removes it"""
+        if node is not None:
+            self.ownedNodes.append(node)
+        return node
+
+    def observe(self, caller, event, callback):
+        """AddObserver, remembered so unload() removes it"""
+        tag = caller.AddObserver(event, callback)
+        self.observations.append((caller, tag))
+        return tag
+
+    @staticmethod
+    def removeNode(node):
+        """Remove a node with its display and storage nodes"""
+        if node is None or node.GetScene() is None:
+            return
+        helpers = []
+        if node.IsA('vtkMRMLDisplayableNode'):
+            helpers += [node.GetNthDisplayNode(i) for i in range(node.GetNumberOfDisplayNodes())]
+        if node.IsA('vtkMRMLStorableNode'):
+            helpers.append(node.GetStorageNode())
+        slicer.mrmlScene.RemoveNode(node)
+        for helper in helpers:
+            if helper is not None and helper.GetScene() is not None:
+                slicer.mrmlScene.RemoveNode(helper)
+
+    def unload(self):
+        """
+        Remove the nodes and observers this example added, stop its connector
+        and timers. Nodes the example only borrowed (e.g. the navigation
+        transform CoilToRefe) stay in the scene.
+        """
+        st = timeit.default_timer()
+        if self.mapScheduler is not None:
+            self.mapScheduler.stop()
+        for caller, tag in self.observations:
+            caller.RemoveObserver(tag)
+        if self.IGTLNode is not None:
+            self.IGTLNode.Stop()
+        if self.assets is not None:
+            self.assets.shutdown()
+        removed = len(self.ownedNodes)
+        for node in reversed(self.ownedNodes):
+            Loader.removeNode(node)
+        if getattr(self, 'pubTransform', None) is not None and hasattr(self.rosNode, 'RemoveAndDeletePublisherNode'):
+            self.rosNode.RemoveAndDeletePublisherNode(self.pubTransform.GetTopic())
+            self.pubTransform = None
+        log.info('Unloaded %s: %d nodes, %d observers in %.2f s', self.data_directory, removed,
+                 len(self.observations), timeit.default_timer() - st)
+        self.ownedNodes = []
+        self.observations = []
+        self.fiberBundleNodes = []
+        self.mapScheduler = None
+        self.IGTLNode = self.pyigtlNode = self.modelNode = self.fiberNode = self.coilNode = None
+        self.skinNode = self.markupsPlaneNode = self.conductivityNode = self.labelNode = None
+        self.magfieldGTNode = self.magfieldNode = self.magnormNode = self.efieldNode = self.enormNode = None
+        self.resliceEngine = self.meshSampler = self.regionStats = None
+        self.meshSamplers = {}
+        self.meshLOD = MeshLOD()
+
     def showFibers(self):
         print(f"showFibers method called with self value: {self}")
-        fiberNode1 = slicer.util.getNode('fibers')
+        # Fibers are only loaded the first time they are shown
+        loader = getattr(slicer.modules.SlicerTMSWidget, 'loader', None)
+        if self == 2 and loader is not None:
+            loader.ensureFibers()
+        fiberNode1 = slicer.mrmlScene.GetFirstNodeByName('fibers')
+        if fiberNode1 is None:
+            return
         print(f"Retrieved fibers node: {fiberNode1}")
         brainTransparentNode = slicer.util.getNode('brainTransparent')
         print(f"Retrieved brainTransparent node: {brainTransparentNode}")
@@ -126,7 +235,9 @@ class Loader:
         print("Set default values for matrix")
 
         # Get the vtkMRMLMarkupsPlaneNode and update its matrix
-        planeNode = slicer.util.getNode("vtkMRMLMarkupsPlaneNode1")
+        # the coil plane of the loaded example, its node ID changes when examples are switched
+        loader = getattr(self, 'loader', None)
+        planeNode = loader.markupsPlaneNode if loader is not None else None
         if planeNode is not None:
             planeNode.ApplyTransformMatrix(matrix)
             print("Applied transform matrix to plane node")
@@ -145,14 +256,15 @@ class Loader:
         print(f"showMesh method called with self value: {self}")
         brainTransparentNode = slicer.util.getNode('brainTransparent')
         print(f"Retrieved brainTransparent node: {brainTransparentNode}")
-        fiberNode1 = slicer.util.getNode('fibers')
+        fiberNode1 = slicer.mrmlScene.GetFirstNodeByName('fibers')
         print(f"Retrieved fibers node: {fiberNode1}")
         modelNode = slicer.util.getNode('gm')
         print(f"Retrieved model node (gm): {modelNode}")
         if self == 2:
             print("Show Brain Surface")
             modelNode.SetDisplayVisibility(1)
-            fiberNode1.SetDisplayVisibility(0)
+            if fiberNode1 is not None:
+                fiberNode1.SetDisplayVisibility(0)
             brainTransparentNode.SetDisplayVisibility(0)
             print("Set brain surface visible, fibers and brain transparent hidden")
         elif self == 0:
@@ -187,34 +299,293 @@ class Loader:
 
 
     def newImage(self, caller, event):
-        print('New CNN Image received via PyIgtl')
+        if self.reusing:
+            return
+        log.debug('New CNN Image received via PyIgtl')
+        self.traceReceived = LatencyTracer.now()
+        self.traceServer = LatencyTracer.serverTimes(caller)
         M.Mapper.modifyIncomingImage(self)
+        self.firstEFieldShown()
+
+    def onInteractionStart(self):
+        """Coil drag started: coarse gm and skin, the shown E-field probed on the coarse gm"""
+        self.meshLOD.setCoarse(True)
+        self.remapMesh()
+
+    def onInteractionSettled(self):
+        """Coil drag over: full meshes, with a full quality mapping of the latest E-field"""
+        self.meshLOD.setCoarse(False)
+        self.remapMesh()
+
+    def remapMesh(self):
+        """Probe the E-field already shown onto the current gm level, no server round trip"""
+        if self.meshSampler is not None and self.modelNode is not None:
+            M.Mapper.mapElectricfieldToMesh(self.pyigtlNode, self.modelNode, self)
+
+    def firstEFieldShown(self):
+        """Report time-to-first-E-field once, then load what was deferred"""
+        if self.loadStart is None:
+            return
+        log.info('Time to first E-field: %.2f s', timeit.default_timer() - self.loadStart)
+        self.loadStart = None
+        # after this event, so the first E-field is drawn before anything else loads
+        qt.QTimer.singleShot(0, self.loadDeferred)
+
+    def loadDeferred(self):
+        """
+        Skin, magnorm, label map and, after reuse(), the fibers: decoded in the
+        background, added (or swapped into the existing nodes) once the first E-field is up
+        """
+        st = timeit.default_timer()
+        skinData = self.assets.result('skin')
+        if skinData is None:
+            Loader.removeNode(self.skinNode)
+            self.skinNode = None
+        elif self.skinNode is not None:
+            self.skinNode.SetAndObservePolyData(skinData)
+        else:
+            self.skinNode = self.own(AssetReader.addModel(skinData, os.path.splitext(self._skin_file)[0]))
+            skinDisplayNode = self.skinNode.GetDisplayNode()
+            skinDisplayNode.SetColor(0.8, 0.8, 0.8)
+            skinDisplayNode.SetOpacity(0.35)
+
+        # coarse levels, shown and probed while the coil is dragged
+        self.meshLOD.clear()
+        for node in (self.modelNode, self.brainTransparentNode):
+            self.meshLOD.add(node, self.assets.result('gmCoarse'))
+        self.meshLOD.add(self.skinNode, self.assets.result('skinCoarse'))
+
+        # magnorm is only used for testing and visualization, the coil default matrix comes from its header
+        magnormImage = self.assets.result('magnorm')
+        if magnormImage is None:
+            Loader.removeNode(self.magnormNode)
+            self.magnormNode = None
+        elif self.magnormNode is not None:
+            AssetReader.updateVolume(magnormImage, self.magnormNode)
+        else:
+            self.magnormNode = self.own(AssetReader.addVolume(magnormImage, 'MagNorm'))
+
+        labelImage = self.assets.result('labels')
+        if labelImage is None:
+            Loader.removeNode(self.labelNode)
+            self.labelNode = None
+        elif self.labelNode is not None:
+            AssetReader.updateVolume(labelImage, self.labelNode)
+        else:
+            self.labelNode = self.own(AssetReader.addVolume(labelImage, 'labels', 'vtkMRMLLabelMapVolumeNode'))
+        self.regionStats = None  # rebuilt with the labels on the next E-field
+
+        # fibers already shown for the previous example keep their nodes and ROI selection
+        if self.fiberBundleNodes:
+            polyData = self.assets.result('fibers')
+            if polyData is None:
+                polyData = vtk.vtkPolyData()
+            for fiberNode in self.fiberBundleNodes:
+                fiberNode.SetAndObservePolyData(polyData)
+            if self.meshSampler is not None:
+                M.Mapper.mapElectricfieldToFibers(self.pyigtlNode, self.fiberNode, self)
+        log.info('Deferred assets loaded in %.2f s', timeit.default_timer() - st)
+
+    def ensureFibers(self):
+        """Load the fibers, downsample them and set up ROI selection on first use"""
+        if self.fiberNode is not None:
+            return
+        fiberModelFile = os.path.join( self.data_directory, self._fiber_file )
+        if not os.path.isfile(fiberModelFile):
+            log.warning('No fibers in this example: %s', fiberModelFile)
+            return
+        log.info('Loading fibers from %s', fiberModelFile)
+
+        ######### Downsampling of the tractography fibers first -- IF THE FILE IS LARGE e.g. full brain tractography #############
+        # headless (FiberDownsample) and cached on disk, usually already done in the background by loadExample
+        polyData = self.assets.result('fibers') if self.assets is not None else None
+        if polyData is None:
+            polyData = FiberDownsampler().downsample(fiberModelFile)
+        log.info('Downsampled fibers: %d lines', polyData.GetNumberOfLines())
+
+        # 'fibers' and the 'FiberBundle' used for ROI selection share the downsampled polydata
+        for name in ('fibers', 'FiberBundle'):
+            fiberNode = self.own(AssetReader.addFiberBundle(polyData, name))
+            fiberNode.GetTubeDisplayNode().SetVisibility(False)
+            fiberNode.SetDisplayVisibility(False)
+            self.fiberBundleNodes.append(fiberNode)
+        log.debug('Configured fiber bundle display settings')
+
+        # setting the downsampled fibers as new fibernode for further processing
+        self.fibers_downsampled = fiberNode
+        self.fiberNode = fiberNode
+        log.debug('Set fiberNode to downsampled fiber bundle %s', self.fiberNode.GetName())
+
+        ## FIBER SELECTION ########### this might need to be updated along with the slicer dmri module
+        slicer.modules.tractographydisplay.widgetRepresentation().activateWindow()
+        log.debug('Activated tractography display widget')
+        w = slicer.modules.tractographydisplay.widgetRepresentation()
+        simpleDisplay = slicer.util.findChildren(w, text='Simple Display')[0]
+        log.debug('Found Simple Display widget')
+        # w.setFiberBundleNode(slicer.util.getNode('fibers'))
+        treeView = slicer.util.findChildren(simpleDisplay, name = "TractographyDisplayTreeView")[0]
+        treeView.setCurrentNode(self.fiberNode)
+        log.debug('Set current node in tractography tree view')
+        # slicer.util.delayDisplay('update')
+        ww = slicer.util.findChildren(w, className= "*ROI*")[0]
+        ww.enabled
+        combo = slicer.util.findChildren(ww, name = "ROIForFib*Selector")[0]
+        combo.setCurrentNode(self.roi)
+        log.debug('Set ROI in ROI selector')
+        wx = slicer.util.findChildren(w, name = "Positive*")[0] # This is the radiobutton for positive ROI
+        if wx.checked == False:
+            wx.click()
+            log.debug('Clicked positive ROI button')
+        # ww.updateBundleFromSelection()
+
+        # slicer.qSlicerTractographyDisplayModuleWidget().setFiberBundleNode(slicer.util.getNode('fibers'))
+        # slicer.qSlicerTractographyDisplayModuleWidget().setPercentageOfFibersShown(0.01)
+        # slicer.qSlicerTractographyEditorROIWidget().setAnnotationMRMLNodeForFiberSelection(slicer.util.getNode('ROI'))
+        # slicer.qSlicerTractographyEditorROIWidget().setFiberBundleNode(slicer.util.getNode('fibers'))
+        # slicer.qSlicerTractographyEditorROIWidget().positiveROISelection(1)
+        # slicer.util.getNode('fibers').SetSelectWithAnnotation(1)
+        ######## ALTERNATIVE FOR ACCESSING:
+        # advancedDisplay = slicer.util.findChildren(text='Advanced Display')[0]
+        # fiberDisplay = slicer.util.findChildren(text='Fiber Bundle Selection')[0]
+        # simpleDisplay = slicer.util.findChildren(text='Simple Display')[0]
+        # ss = slicer.util.findChildren(simpleDisplay, name="FiberBundleTableDisplay")[0]
+
+        for fiberNode in self.fiberBundleNodes:
+            M.Mapper.setupFiberDisplay(fiberNode)
+        # colour them with the E-field that is already shown
+        if self.meshSampler is not None:
+            M.Mapper.mapElectricfieldToFibers(self.pyigtlNode, self.fiberNode, self)
+
+
+    def submitAssets(self):
+        """
+        Decode in the background: the critical path first (conductivity, gm, coil,
+        magnorm header for the coil default matrix), then what loadDeferred adds
+        after the first E-field and the downsampled fibers for ensureFibers.
+        """
+        if self.assets is not None:
+            self.assets.shutdown()
+        self.assets = AssetReader(self.data_directory)
+        self.assets.submit('conductivity', AssetReader.readImage, self._conductivity_file)
+        self.assets.submit('gm', AssetReader.readPolyData, self._graymatter_file)
+        self.assets.submit('coil', AssetReader.readPolyData, self._coil_file)
+        self.assets.submit('magnormGeometry', AssetReader.readIJKToRAS, self._magnorm_file)
+        self.assets.submit('skin', AssetReader.readPolyData, self._skin_file)
+        self.assets.submit('magnorm', AssetReader.readImage, self._magnorm_file)
+        self.assets.submit('labels', AssetReader.readImage, self._labels_file)
+        self.assets.submit('gmCoarse', MeshLOD.readCoarse, self._graymatter_file)
+        self.assets.submit('skinCoarse', MeshLOD.readCoarse, self._skin_file)
+        self.assets.submit('fibers', FiberDownsampler().downsample, self._fiber_file)
+
+    def reuse(self, example_path):
+        """
+        Switch this loaded example to another one in place: the connector, coil
+        plane, ROI, transforms, display settings and observers stay, only the
+        image data, the meshes and the magfield grid transform are swapped.
+        Returns False when this loader has nothing loaded to reuse.
+        """
+        graymatterFile = Loader.graymatterFile(Loader.exampleDirectory(example_path))
+        if self.pyigtlNode is None or self.pyigtlNode.GetScene() is None or graymatterFile is None:
+            return False
+        print('Your selected Example: ' + example_path)
+        self.loadStart = timeit.default_timer()
+        if self.mapScheduler is not None:
+            self.mapScheduler.stop()
+        self.data_directory = Loader.exampleDirectory(example_path)
+        self._graymatter_file = graymatterFile
+        self.submitAssets()
+
+        # the grid transform is read on this thread, it replaces the old one
+        Loader.removeNode(self.magfieldGTNode)
+        self.ownedNodes.remove(self.magfieldGTNode)
+        self.magfieldGTNode = self.own(slicer.util.loadTransform(os.path.join(self.data_directory, self._magfield_file)))
+
+        self.meshLOD.clear()
+        self.modelNode.SetAndObservePolyData(self.assets.result('gm'))
+        self.brainTransparentNode.SetAndObservePolyData(self.modelNode.GetPolyData())
+        self.coilNode.SetAndObservePolyData(self.assets.result('coil'))
+        scale = vtk.vtkTransform()
+        scale.Scale(self._coil_scale, self._coil_scale, self._coil_scale)
+        self.coilNode.ApplyTransformMatrix(scale.GetMatrix())
+        self.coilDefaultMatrix.DeepCopy(self.assets.result('magnormGeometry'))
+
+        AssetReader.updateVolume(self.assets.result('conductivity'), self.conductivityNode)
+        self.magfieldNode.SetSpacing(self.conductivityNode.GetSpacing())
+        self.magfieldNode.SetOrigin(self.conductivityNode.GetOrigin())
+        self.efieldNode.SetSpacing(self.conductivityNode.GetSpacing())
+        self.efieldNode.SetOrigin(self.conductivityNode.GetOrigin())
+        self.enormNode.CopyOrientation(self.conductivityNode)
+        # pyigtl_data starts as a copy of the conductivity, without mapping it as an E-field
+        self.reusing = True
+        try:
+            imageData = vtk.vtkImageData()
+            imageData.DeepCopy(self.conductivityNode.GetImageData())
+            self.pyigtlNode.CopyOrientation(self.conductivityNode)
+            self.pyigtlNode.SetAndObserveImageData(imageData)
+        finally:
+            self.reusing = False
+
+        # per-example caches, rebuilt on the next map and E-field
+        self.resliceEngine = None
+        self.meshSampler = None
+        self.meshSamplers = {}
+        self.regionStats = None
+        self.hotspotStats = None
+        slicer.util.setSliceViewerLayers(background=self.conductivityNode, foreground=self.pyigtlNode)
+
+        self.mapScheduler.lastPose = None
+        self.mapScheduler.updateNow()
+        log.info('Critical path reloaded in place in %.2f s, waiting for the first E-field',
+                 timeit.default_timer() - self.loadStart)
+        return True
+
+    @staticmethod
+    def exampleDirectory(example_path):
+        return os.path.join(os.path.dirname(slicer.modules.slicertms.path), '../', example_path)
+
+    @classmethod
+    def switchExample(cls, example_path, previous=None):
+        """Load an example, in place of the previous one when it can be reused, after unloading it otherwise"""
+        if previous is not None:
+            if previous.reuse(example_path):
+                return previous
+            previous.unload()
+        return cls.loadExample(example_path)
+
 
 #  Factory method to load example
     @classmethod
     def loadExample(cls, example_path):
         print(f"Starting loadExample with path: {example_path}")
         print('Your selected Example: ' + example_path)
-        data_directory = os.path.join(os.path.dirname(slicer.modules.slicertms.path), '../', example_path)
+        data_directory = Loader.exampleDirectory(example_path)
         print(f"Data directory resolved to: {data_directory}")
 
         loader = Loader(data_directory)
+        loader.loadStart = timeit.default_timer()
         print("Loader instance created")
 
         # slicer.mrmlScene.Clear()
 
+        # the example files decode in the background while the magfield grid
+        # transform is read on this thread
+        loader.submitAssets()
+
+        # load magvector as a GridTransformNode
+        # the grid transform node (GTNode) only provides the 4D vtkImageData in the original space
+        magfield_path = os.path.join( loader.data_directory, loader._magfield_file )
+        print(f"Loading magfield transform from: {magfield_path}")
+        loader.magfieldGTNode  = loader.own(slicer.util.loadTransform(magfield_path))
+        print(f"Magfield grid transform loaded: {loader.magfieldGTNode}")
+
         #
         # 1. Brain:
         #
-        brainModelFile = os.path.join( loader.data_directory, loader._graymatter_file )
-        print(f"Loading brain model from: {brainModelFile}")
-        loader.modelNode = slicer.modules.models.logic().AddModel(brainModelFile,
-                                                                slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
+        loader.modelNode = loader.own(AssetReader.addModel(loader.assets.result('gm'), os.path.splitext(loader._graymatter_file)[0]))
         print(f"Brain model loaded: {loader.modelNode}")
 
-        loader.brainTransparentNode = slicer.modules.models.logic().AddModel(brainModelFile,
-                                                                slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        loader.brainTransparentNode.SetName('brainTransparent')
+        # same decoded mesh, not a second read from disk
+        loader.brainTransparentNode = loader.own(AssetReader.addModel(loader.modelNode.GetPolyData(), 'brainTransparent'))
         print("Created transparent brain model node")
         brainTransparentDisplayNode = loader.brainTransparentNode.GetDisplayNode()
         brainTransparentDisplayNode.SetOpacity(0.3)
@@ -224,115 +595,22 @@ class Loader:
         print("Configured transparent brain display settings")
         
         #
-        # 2. Fibers:
+        # 2. ROI, also used to select fibers once they are loaded (ensureFibers):
         #
-
-        fiberModelFile = os.path.join( loader.data_directory, loader._fiber_file )
-        print(f"Loading fiber model from: {fiberModelFile}")
-        # loader.fiberNode = slicer.modules.models.logic().AddModel(fiberModelFile,
-                                                                # slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        # loader.fiberNode.SetDisplayVisibility(0)
-
-        ############### Load fibers for ROI selection ################
-        # fiberNode = slicer.util.getNode('fibers')
-        # fiberBundleNode = slicer.vtkMRMLFiberBundleNode()
-        # fiberBundleNode.SetAndObservePolyData(loader.fiberNode.GetPolyData())
-        loader.fiberNode = slicer.util.loadFiberBundle(fiberModelFile)
-        print(f"Fiber bundle loaded: {loader.fiberNode}")
-        loader.fiberNode.GetTubeDisplayNode().SetVisibility(False)
-        loader.fiberNode.SetDisplayVisibility(False)
-        print("Configured fiber bundle display settings")
-
-
-
-        ######### Downsampling of the tractography fibers first -- IF THE FILE IS LARGE e.g. full brain tractography #############
-        loader.fibers_downsampled = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLFiberBundleNode', 'FiberBundle')
-        print("Created downsampled fiber bundle node")
-        # loader.fibers_downsampled.SetDisplayVisibility(False)
-        loader.fibers_downsampled.GetTubeDisplayNode().SetVisibility(False)
-        print("Configured downsampled fiber bundle display")
-        slicer.modules.tractographydownsample.widgetRepresentation().activateWindow()
-        print("Activated tractography downsampling widget")
-        slicer.modules.TractographyDownsampleWidget.inputSelector.addEnabled = True
-        slicer.modules.TractographyDownsampleWidget.inputSelector.setCurrentNode(slicer.util.getNode('fibers'))
-        print("Set input selector to fibers node")
-        slicer.modules.TractographyDownsampleWidget.outputSelector.addEnabled = True
-        slicer.modules.TractographyDownsampleWidget.outputSelector.setCurrentNode(loader.fibers_downsampled)
-        print("Set output selector to downsampled fibers node")
-        slicer.modules.TractographyDownsampleWidget.fiberStepSizeWidget.setValue(5.00)
-        slicer.modules.TractographyDownsampleWidget.fiberPercentageWidget.setValue(1.00)
-        slicer.modules.TractographyDownsampleWidget.fiberMinimumPointsWidget.setValue(3)
-        slicer.modules.TractographyDownsampleWidget.fiberMinimumLengthWidget.setValue(10.00)
-        slicer.modules.TractographyDownsampleWidget.fiberMaximumLengthWidget.setValue(180.00)
-        print("Set downsampling parameters")
-        slicer.modules.TractographyDownsampleWidget.applyButton.enabled = True
-        slicer.modules.TractographyDownsampleWidget.onApplyButton()
-        print("Applied downsampling")
-
-        # setting the downsampled fibers as new fibernode for further processing
-        loader.fiberNode = slicer.util.getNode('FiberBundle')
-        print(f"Set fiberNode to downsampled fiber bundle: {loader.fiberNode}")
-        loader.fiberNode.GetDisplayNode().SetVisibility(False)
-        print("Set fiber node visibility to False")
-
-        #### Create ROI Node for Fibers ############
-        loader.roi = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode', 'ROI')
+        loader.roi = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode', 'ROI'))
         print("Created ROI node")
         # roi = vtk.vtkSlicerAnnotationsModuleMRML.vtkMRMLAnnotationROINode()
         # Set size of the ROI:
-        slicer.util.getNode('ROI').SetRadiusXYZ(20.0, 20.0, 20.0)
-        slicer.util.getNode('ROI').SetXYZ(0.0, 0.0, 30.0)
+        loader.roi.SetRadiusXYZ(20.0, 20.0, 20.0)
+        loader.roi.SetXYZ(0.0, 0.0, 30.0)
         print("Set ROI position and size")
-        # slicer.util.getNode('ROI').GetDisplayNode().SetVisibility(False)
-        slicer.util.getNode('ROI').SetDisplayVisibility(False)
+        # loader.roi.GetDisplayNode().SetVisibility(False)
+        loader.roi.SetDisplayVisibility(False)
         print("Set ROI visibility to False")
 
-        ## FIBER SELECTION ########### this might need to be updated along with the slicer dmri module
-        slicer.modules.tractographydisplay.widgetRepresentation().activateWindow()
-        print("Activated tractography display widget")
-        w = slicer.modules.tractographydisplay.widgetRepresentation()
-        simpleDisplay = slicer.util.findChildren(w, text='Simple Display')[0]
-        print("Found Simple Display widget")
-        # w.setFiberBundleNode(slicer.util.getNode('fibers'))
-        treeView = slicer.util.findChildren(simpleDisplay, name = "TractographyDisplayTreeView")[0]
-        treeView.setCurrentNode(loader.fiberNode)
-        print("Set current node in tractography tree view")
-        # slicer.util.delayDisplay('update')
-        ww = slicer.util.findChildren(w, className= "*ROI*")[0]
-        ww.enabled
-        combo = slicer.util.findChildren(ww, name = "ROIForFib*Selector")[0]
-        combo.setCurrentNode(slicer.util.getNode('ROI'))
-        print("Set ROI in ROI selector")
-        wx = slicer.util.findChildren(w, name = "Positive*")[0] # This is the radiobutton for positive ROI
-        if wx.checked == False:
-            wx.click()
-            print("Clicked positive ROI button")
-        # ww.updateBundleFromSelection()
-
-        # slicer.qSlicerTractographyDisplayModuleWidget().setFiberBundleNode(slicer.util.getNode('fibers'))
-        # slicer.qSlicerTractographyDisplayModuleWidget().setPercentageOfFibersShown(0.01)
-        # slicer.qSlicerTractographyEditorROIWidget().setAnnotationMRMLNodeForFiberSelection(slicer.util.getNode('ROI'))
-        # slicer.qSlicerTractographyEditorROIWidget().setFiberBundleNode(slicer.util.getNode('fibers'))
-        # slicer.qSlicerTractographyEditorROIWidget().positiveROISelection(1)
-        # slicer.util.getNode('fibers').SetSelectWithAnnotation(1)
-        ######## ALTERNATIVE FOR ACCESSING:
-        # advancedDisplay = slicer.util.findChildren(text='Advanced Display')[0]
-        # fiberDisplay = slicer.util.findChildren(text='Fiber Bundle Selection')[0]
-        # simpleDisplay = slicer.util.findChildren(text='Simple Display')[0]
-        # ss = slicer.util.findChildren(simpleDisplay, name="FiberBundleTableDisplay")[0]
-
         #
-        # 3. Skin model:
+        # 3. Skin model: decoded in the background, added after the first E-field (loadDeferred)
         #
-        skin = os.path.join( loader.data_directory, loader._skin_file )
-        print(f"Loading skin model from: {skin}")
-        loader.skinNode = slicer.modules.models.logic().AddModel(skin, slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        print(f"Skin model loaded: {loader.skinNode}")
-        skinDisplayNode = loader.skinNode.GetDisplayNode()
-        skinDisplayNode.SetColor(0.8, 0.8, 0.8)
-        skinDisplayNode.SetOpacity(0.35)
-        print("Configured skin display settings")
-
 
         #
         # 4. TMS coil:
@@ -340,7 +618,7 @@ class Loader:
         coil = os.path.join( loader.data_directory, loader._coil_file )
         print(f"Loading coil model from: {coil}")
         
-        loader.coilNode = slicer.modules.models.logic().AddModel(coil, slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
+        loader.coilNode = loader.own(AssetReader.addModel(loader.assets.result('coil'), os.path.splitext(loader._coil_file)[0]))
         print(f"Coil model loaded: {loader.coilNode}")
         
         # Set transform on the coil and resize it:
@@ -352,7 +630,7 @@ class Loader:
         print("Applied scaling transform to coil")
 
         # Add a plane to the scene
-        markupsPlaneNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsPlaneNode', 'Coil')
+        markupsPlaneNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsPlaneNode', 'Coil'))
         print("Created markups plane node for coil")
         # markupsPlaneNode.SetOrigin([0, 0, 110])
         # markupsPlaneNode.SetOrigin([0, 0, 0])
@@ -376,14 +654,14 @@ class Loader:
             markupsPlaneNode.SetOrigin([0, 0, 0])
 
         except:
-            loader.transformNavigationNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "NavigationTransform")
+            loader.transformNavigationNode = loader.own(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "NavigationTransform"))
             print("Created new transform navigation node")
             markupsPlaneNode.SetOrigin([0, 0, 110])
         
         loader.markupsPlaneNode = markupsPlaneNode
         print(f"Set markupsPlaneNode: {loader.markupsPlaneNode}")
 
-        loader.transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "HandleTransform")
+        loader.transformNode = loader.own(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "HandleTransform"))
         print("Created handle transform node")
 
         # loader.transformNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
@@ -399,30 +677,18 @@ class Loader:
         # 5. Other stuff
         #
 
-        # load magnorm (used for tesing and visualization, not useful for predicting E-field)
-        magnorm_path = os.path.join( loader.data_directory, loader._magnorm_file )
-        print(f"Loading magnorm from: {magnorm_path}")
-        loader.magnormNode = slicer.util.loadVolume(magnorm_path)
-        loader.magnormNode.SetName('MagNorm')
-        print(f"Magnorm volume loaded: {loader.magnormNode}")
-        loader.magnormNode.GetIJKToRASMatrix(loader.coilDefaultMatrix)
+        # the coil default matrix only needs the magnorm header, the volume itself
+        # (used for tesing and visualization, not useful for predicting E-field) comes in loadDeferred
+        loader.coilDefaultMatrix.DeepCopy(loader.assets.result('magnormGeometry'))
         print("Retrieved IJK to RAS matrix for coil default")
 
-        # load magvector as a GridTransformNode 
-        # the grid transform node (GTNode) only provides the 4D vtkImageData in the original space
-        magfield_path = os.path.join( loader.data_directory, loader._magfield_file )
-        print(f"Loading magfield transform from: {magfield_path}")
-        loader.magfieldGTNode  = slicer.util.loadTransform(magfield_path)
-        print(f"Magfield grid transform loaded: {loader.magfieldGTNode}")
-
         # load conductivity
-        conductivity_path = os.path.join( loader.data_directory, loader._conductivity_file )
-        print(f"Loading conductivity from: {conductivity_path}")
-        loader.conductivityNode = slicer.util.loadVolume(conductivity_path)
+        loader.conductivityNode = loader.own(AssetReader.addVolume(loader.assets.result('conductivity'),
+                                                                   os.path.basename(loader._conductivity_file).split('.')[0]))
         print(f"Conductivity volume loaded: {loader.conductivityNode}")
 
         # creat magfield vector volumeNode for visualizing rotated RBG-coded magnetic vector field
-        loader.magfieldNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+        loader.magfieldNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode'))
         print("Created magnetic field scalar volume node")
         loader.magfieldNode.SetSpacing(loader.conductivityNode.GetSpacing())
         loader.magfieldNode.SetOrigin(loader.conductivityNode.GetOrigin())
@@ -430,13 +696,13 @@ class Loader:
         print("Configured magnetic field node spacing, origin, and name")
 
         # create nodes for received E-field data from pyigtl 
-        loader.efieldNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVectorVolumeNode')
+        loader.efieldNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVectorVolumeNode'))
         print("Created E-field vector volume node")
         loader.efieldNode.Copy(loader.magfieldNode)
         loader.efieldNode.SetName('EVec')
         print("Copied properties from magfield to efield node")
 
-        loader.enormNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+        loader.enormNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode'))
         print("Created E-norm scalar volume node")
         loader.enormNode.Copy(loader.conductivityNode)
         loader.enormNode.SetName('ENorm')
@@ -453,6 +719,7 @@ class Loader:
             print("Creating IGTL connector node since it's None")
             loader.IGTLNode = slicer.vtkMRMLIGTLConnectorNode()
             slicer.mrmlScene.AddNode(loader.IGTLNode)
+            loader.own(loader.IGTLNode)
             loader.IGTLNode.SetName('DataConnector')
             print(f"Created IGTL node: {loader.IGTLNode}")
         else:
@@ -481,9 +748,9 @@ class Loader:
         print('OpenIGTLink Connector created! \n Check IGT > OpenIGTLinkIF and start external pyigtl server.')
 
         # observer for the icoming IGTL image data
-        loader.pyigtlNode = slicer.util.loadVolume( os.path.join( loader.data_directory, loader._conductivity_file ) )
+        # a copy of the conductivity volume already in memory
+        loader.pyigtlNode = loader.own(slicer.modules.volumes.logic().CloneVolume(slicer.mrmlScene, loader.conductivityNode, 'pyigtl_data'))
         # loader.pyigtlNode.Copy(loader.enormNode)
-        loader.pyigtlNode.SetName('pyigtl_data')
         print(f"Created pyigtl data node: {loader.pyigtlNode}")
 
         # Display setting
@@ -506,17 +773,21 @@ class Loader:
         slicer.app.processEvents()  # Dynamic updating scene
         print("Processed application events")
 
-        observationTag = loader.pyigtlNode.AddObserver(slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
+        observationTag = loader.observe(loader.pyigtlNode, slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
         print(f"Added observer for pyigtl node image data modification: tag {observationTag}")
 
         # # call one time
-        loader.callMapper()
+        # coil moves are coalesced and rate limited before they reach the mapper
+        loader.mapScheduler = S.UpdateScheduler(loader.coilPose, loader.callMapper,
+                                                startFunction=loader.onInteractionStart,
+                                                settleFunction=loader.onInteractionSettled)
+        loader.mapScheduler.updateNow()
         print("Called mapper for initial setup")
 
         # # interaction hookup
-        loader.markupsPlaneNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, loader.callMapper)
+        loader.observe(loader.markupsPlaneNode, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, loader.mapScheduler.request)
         print("Added observer for markups plane node point modification")
-        loader.transformNavigationNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, loader.callMapper)
+        loader.observe(loader.transformNavigationNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, loader.mapScheduler.request)
         print("Added observer for transform navigation node modification")
         # loader.transformNavigationNode.AddObserver(
         #     slicer.vtkMRMLTransformableNode.TransformModifiedEvent,
@@ -529,5 +800,6 @@ class Loader:
         print("Added observer for magnetic field node transform modification FOR ROS publishing")
         #slicer.mrmlScene.AddObserver(slicer.vtkMRMLScene.NodeAddedEvent, loader.onNodeRcvd)
 
+        log.info('Critical path loaded in %.2f s, waiting for the first E-field', timeit.default_timer() - loader.loadStart)
         print("loadExample method completed successfully")
         return loader
\ No newline at end of file
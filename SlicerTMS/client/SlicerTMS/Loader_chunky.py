@@ -1,14 +1,24 @@
+import logging
 import os
+import timeit
 import vtk, qt, ctk, slicer, sitkUtils
 import SimpleITK as sitk
 # from slicer.ScriptedLoadableModule import *
 import numpy as np
 import Rendering as ren
 import Mapper as M
+import Scheduler as S
+from Tracer import LatencyTracer
+from Assets import AssetReader
+from MeshLOD import MeshLOD
 from tms_env import get_tms_value
 
 # ADDED: Simple chunker for receiving network data
 from simple_chunker import SimpleReceiver
+# ADDED: Shared-memory frames when the TMS server runs on the same host
+from shm_transport import SharedMemoryRing
+
+log = logging.getLogger(__name__)
 
 
 
@@ -36,6 +46,7 @@ class Loader:
         self._magnorm_file = 'magnorm.nii.gz'
         self._magfield_file = 'magfield.nii.gz'
         self._conductivity_file = 'conductivity.nii.gz'
+        self._labels_file = 'labels.nii.gz'  # optional cortical parcellation for region statistics
 
         self.modelNode = None
         self.fiberNode = None
@@ -44,25 +55,261 @@ class Loader:
         self.markupsPlaneNode = None
 
         self.conductivityNode = None
+        self.labelNode = None
         self.magfieldGTNode = None
         self.magfieldNode = None
         self.magnormNode = None
         self.efieldNode = None
         self.enormNode = None
         self.coilDefaultMatrix = vtk.vtkMatrix4x4()
+        self.resliceEngine = None  # Mapper.ResliceEngine, created on the first map
+        self.meshSampler = None  # Mapper.MeshSampler, gm vertex-to-voxel index built on the first E-field
+        self.meshSamplers = {}  # one per gm level of detail
+        self.meshLOD = MeshLOD()  # coarse gm and skin while the coil is dragged
+        self.regionStats = None  # RegionStats, per-region voxel index built on the first E-field
+        self.traceServer = None  # TraceId and server timestamps of the E-field being displayed
+        self.traceReceived = None
+        self.traceReassembled = None
 
         self.IGTLNode = None
+        self.assets = None  # Assets.AssetReader, decodes the example files in the background
+        self.loadStart = None  # set until the first E-field is shown
+        self.roi = None
+        self.fiberBundleNodes = []
+        self.mapScheduler = None
+        self.reusing = False  # set while reuse() swaps the data of pyigtl_data
+
+        # what this example added to the scene, removed again by unload()
+        self.ownedNodes = []
+        self.observations = []  # (observed object, observer tag)
 
         self.showMag = False #switch between magnetic and electric field for visualization
         
         # ADDED: Initialize chunk receiver
         self.receiver = SimpleReceiver()
+        self.repairTextNode = None
+
+        # Fires when chunks stop arriving before a frame is complete
+        self.repairTimer = qt.QTimer()
+        self.repairTimer.setSingleShot(True)
+        self.repairTimer.setInterval(int(SimpleReceiver.REPAIR_TIMEOUT * 1000))
+        self.repairTimer.connect('timeout()', self.onRepairTimeout)
+
+        # Shared-memory ring, None while frames come over TCP
+        self.shmRing = None
+        self.shmAttempts = 0
+        # Client-owned copies of the frames in the ring, one shown while the other is filled
+        self.shmBuffers = [None, None]
+        self.shmBack = 0
 
     def callMapper(self, param1=None, param2=None):
         M.Mapper.map(self, time=True)
 
+    def coilPose(self):
+        """Current coil plane pose as a 4x4 numpy array, for the update scheduler"""
+        matrixFromFid = vtk.vtkMatrix4x4()
+        self.markupsPlaneNode.GetObjectToWorldMatrix(matrixFromFid)
+        return slicer.util.arrayFromVTKMatrix(matrixFromFid)
+
+    @staticmethod
+    def graymatterFile(data_directory):
+        """File name of the gray matter mesh of an example (.stl or .vtk), None if it has none"""
+        for extension in ('.stl', '.vtk'):
+            if os.path.isfile(os.path.join(str(data_directory), 'gm' + extension)):
+                return 'gm' + extension
+        return None
+
+    def own(self, node):
+        """Remember a node added for this example so unload() removes it"""
+        if node is not None:
+            self.ownedNodes.append(node)
+        return node
+
+    def observe(self, caller, event, callback):
+        """AddObserver, remembered so unload() removes it"""
+        tag = caller.AddObserver(event, callback)
+        self.observations.append((caller, tag))
+        return tag
+
+    @staticmethod
+    def removeNode(node):
+        """Remove a node with its display and storage nodes"""
+        if node is None or node.GetScene() is None:
+            return
+        helpers = []
+        if node.IsA('vtkMRMLDisplayableNode'):
+            helpers += [node.GetNthDisplayNode(i) for i in range(node.GetNumberOfDisplayNodes())]
+        if node.IsA('vtkMRMLStorableNode'):
+            helpers.append(node.GetStorageNode())
+        slicer.mrmlScene.RemoveNode(node)
+        for helper in helpers:
+            if helper is not None and helper.GetScene() is not None:
+                slicer.mrmlScene.RemoveNode(helper)
+
+    def removeFibers(self):
+        """Drop the fiber nodes, ensureFibers loads them again on the next show"""
+        for fiberNode in self.fiberBundleNodes:
+            Loader.removeNode(fiberNode)
+            if fiberNode in self.ownedNodes:
+                self.ownedNodes.remove(fiberNode)
+        self.fiberBundleNodes = []
+        self.fiberNode = None
+
+    def unload(self):
+        """
+        Remove the nodes and observers this example added, stop its connector,
+        timers and shared-memory mapping. Nodes the example only borrowed
+        (e.g. the navigation transform CoilToRefe) stay in the scene.
+        """
+        st = timeit.default_timer()
+        if self.mapScheduler is not None:
+            self.mapScheduler.stop()
+        self.repairTimer.stop()
+        for caller, tag in self.observations:
+            caller.RemoveObserver(tag)
+        if self.IGTLNode is not None:
+            self.IGTLNode.Stop()
+        if self.shmRing is not None:
+            self.shmRing.close()
+            self.shmRing = None
+        self.shmBuffers = [None, None]
+        if self.assets is not None:
+            self.assets.shutdown()
+        removed = len(self.ownedNodes)
+        for node in reversed(self.ownedNodes):
+            Loader.removeNode(node)
+        log.info('Unloaded %s: %d nodes, %d observers in %.2f s', self.data_directory, removed,
+                 len(self.observations), timeit.default_timer() - st)
+        self.ownedNodes = []
+        self.observations = []
+        self.fiberBundleNodes = []
+        self.mapScheduler = None
+        self.repairTextNode = None
+        self.IGTLNode = self.pyigtlNode = self.modelNode = self.fiberNode = self.coilNode = None
+        self.skinNode = self.markupsPlaneNode = self.conductivityNode = self.labelNode = None
+        self.magfieldGTNode = self.magfieldNode = self.magnormNode = self.efieldNode = self.enormNode = None
+        self.resliceEngine = self.meshSampler = self.regionStats = None
+        self.meshSamplers = {}
+        self.meshLOD = MeshLOD()
+
+    def sendToServer(self, text):
+        """Send a text command to the TMS server over the command connector (18945)"""
+        try:
+            widget = slicer.modules.SlicerTMSWidget
+            widget.commandTextNode.SetText(text)
+            widget.IGTLCommandNode.PushNode(widget.commandTextNode)
+        except Exception as e:
+            log.error('Could not send to server: %s', e)
+
+    def requestRepair(self, nack):
+        """Send a repair request on its own text node so it does not replace the latest ack"""
+        try:
+            widget = slicer.modules.SlicerTMSWidget
+            if self.repairTextNode is None:
+                self.repairTextNode = self.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTextNode', 'RepairMessage'))
+                widget.IGTLCommandNode.RegisterOutgoingMRMLNode(self.repairTextNode)
+            self.repairTextNode.SetText(nack)
+            widget.IGTLCommandNode.PushNode(self.repairTextNode)
+        except Exception as e:
+            log.error('Could not send repair request: %s', e)
+
+    def onRepairTimeout(self):
+        nack = self.receiver.repair_request(timed_out=True)
+        if nack:
+            self.requestRepair(nack)
+            self.repairTimer.start()
+
+    def trySharedMemory(self):
+        """Map the server's frame ring and tell the server to switch over; frames keep coming over TCP otherwise"""
+        if self.shmRing is not None or self.shmAttempts >= 3:
+            return
+        self.shmAttempts += 1
+        self.shmRing = SharedMemoryRing.open(get_tms_value('TMS_SHM_PATH', SharedMemoryRing.DEFAULT_PATH))
+        if self.shmRing is not None:
+            log.info('Mapped shared memory ring %s', self.shmRing.path)
+            self.sendToServer(SharedMemoryRing.READY_MESSAGE)
+
+    def newShmNotice(self, caller, event):
+        """A frame is ready in a shared-memory slot, copy it out of the mapping and display it"""
+        notice = SharedMemoryRing.parse_notice(caller.GetText())
+        if notice is None:
+            return
+        self.traceReceived = LatencyTracer.now()
+        self.traceServer = LatencyTracer.serverTimes(caller)
+        frame = self.shmRing.read(*notice) if self.shmRing is not None else None
+        if frame is None:
+            log.warning('Could not read frame %d from shared memory, falling back to TCP', notice[0])
+            self.sendToServer(SharedMemoryRing.FAIL_MESSAGE)
+            if self.shmRing is not None:
+                self.shmRing.close()
+                self.shmRing = None  # retried on the next TCP frame
+            return
+        view, shape = frame
+        # The slot belongs to the server and is rewritten num_slots frames later, and displayResult
+        # normalises in place: copy into the back buffer, the front one stays with pyigtl_data
+        back = self.shmBuffers[self.shmBack]
+        if back is None or back.size != view.size:
+            back = self.shmBuffers[self.shmBack] = np.empty_like(view)
+        np.copyto(back, view)
+        if not self.shmRing.is_current(*notice):
+            log.warning('Frame %d was overwritten in shared memory while it was copied, skipped', notice[0])
+            return
+        self.shmBack ^= 1
+        self.traceReassembled = LatencyTracer.now()
+        self.displayResult(back, shape, deep=False)
+
+    def displayResult(self, result, shape, deep=True):
+        """
+        Clean, normalise and show an E-field frame in the pyigtl_data node
+        result is the flat Fortran ordered volume of the given shape, modified in place.
+        With deep=False the VTK image wraps it without a copy.
+        """
+        # ADDED: Validate and clean the data before display
+        np.nan_to_num(result, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        np.abs(result, out=result)  # Ensure non-negative
+
+        # Check data range
+        data_max = np.max(result)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Data range: [%.6e, %.6e]', np.min(result), data_max)
+
+        # Normalize if needed (avoid division by zero)
+        if data_max > 0:
+            result /= data_max
+        else:
+            log.warning('All data is zero')
+
+        # Update the pyigtl_data node
+        pyigtl_node = slicer.util.getNode('pyigtl_data')
+
+        # Convert numpy to VTK
+        from vtk.util.numpy_support import numpy_to_vtk
+        vtk_data = vtk.vtkImageData()
+        vtk_data.SetDimensions(shape[2], shape[1], shape[0])
+        vtk_array_out = numpy_to_vtk(result, deep=deep)
+        vtk_data.GetPointData().SetScalars(vtk_array_out)
+
+        # Update node
+        pyigtl_node.SetAndObserveImageData(vtk_data)
+        pyigtl_node.Modified()
+
+        log.debug('pyigtl_data node updated successfully')
+
+        # Process with mapper
+        try:
+            M.Mapper.modifyIncomingImage(self)
+        except Exception as e:
+            log.error('Mapper error (this is OK if FiberBundle not created): %s', e)
+        self.firstEFieldShown()
+
     def showFibers(self):
-        fiberNode1 = slicer.util.getNode('fibers')
+        # Fibers are only loaded the first time they are shown
+        loader = getattr(slicer.modules.SlicerTMSWidget, 'loader', None)
+        if self == 2 and loader is not None:
+            loader.ensureFibers()
+        fiberNode1 = slicer.mrmlScene.GetFirstNodeByName('fibers')
+        if fiberNode1 is None:
+            return
         brainTransparentNode = slicer.util.getNode('brainTransparent')
         nodes = slicer.mrmlScene.GetNodesByName('FiberBundle')
         if self == 2:
@@ -96,7 +343,9 @@ class Loader:
 
 
         # Get the vtkMRMLMarkupsPlaneNode and update its matrix
-        planeNode = slicer.util.getNode("vtkMRMLMarkupsPlaneNode1")
+        # the coil plane of the loaded example, its node ID changes when examples are switched
+        loader = getattr(self, 'loader', None)
+        planeNode = loader.markupsPlaneNode if loader is not None else None
         if planeNode is not None:
             planeNode.ApplyTransformMatrix(matrix)
             # planeNode.SetNthControlPointOrientationMatrix(0, matrix)
@@ -109,12 +358,13 @@ class Loader:
 
     def showMesh(self):
         brainTransparentNode = slicer.util.getNode('brainTransparent')
-        fiberNode1 = slicer.util.getNode('fibers')
+        fiberNode1 = slicer.mrmlScene.GetFirstNodeByName('fibers')
         modelNode = slicer.util.getNode('gm')
         if self == 2:
             print("Show Brain Surface")
             modelNode.SetDisplayVisibility(1)
-            fiberNode1.SetDisplayVisibility(0)
+            if fiberNode1 is not None:
+                fiberNode1.SetDisplayVisibility(0)
             brainTransparentNode.SetDisplayVisibility(0)
         elif self == 0:
             print("Hide Brain Surface")
@@ -145,7 +395,9 @@ class Loader:
         
         if node_name == 'pyigtl_meta':
             # Metadata chunk received
-            print('[Loader] Received metadata')
+            log.debug('Received metadata')
+            self.traceReceived = LatencyTracer.now()
+            self.traceServer = LatencyTracer.serverTimes(caller)
             imageData = caller.GetImageData()
             if imageData:
                 from vtk.util.numpy_support import vtk_to_numpy
@@ -154,6 +406,9 @@ class Loader:
                     dims = imageData.GetDimensions()
                     meta_array = vtk_to_numpy(vtk_array).reshape(dims)
                     self.receiver.add_metadata(meta_array)
+                    self.repairTimer.start()
+                    # The server has its ring by now, switch over if we share the host
+                    self.trySharedMemory()
         
         elif node_name == 'pyigtl_chunk':
             # Data chunk received
@@ -166,129 +421,142 @@ class Loader:
                     chunk_array = vtk_to_numpy(vtk_array).reshape(dims)
                     self.receiver.add_chunk(chunk_array)
                     
+                    # Ack received ranges so the server can grow its send window
+                    if self.receiver.should_ack():
+                        self.sendToServer(self.receiver.ack_message())
+                    
+                    # Ask for lost chunks right away instead of waiting for the next frame
+                    nack = self.receiver.repair_request()
+                    if nack:
+                        self.requestRepair(nack)
+                    if self.receiver.pending():
+                        self.repairTimer.start()
+                    else:
+                        self.repairTimer.stop()
+                    
                     # Check if complete
                     if self.receiver.is_complete():
-                        print('[Loader] All chunks received, reassembling...')
+                        log.debug('All chunks received, reassembling...')
                         result = self.receiver.get_result()
+                        self.traceReassembled = LatencyTracer.now()
+                        if log.isEnabledFor(logging.DEBUG):
+                            log.debug('Receiver stats: %s', self.receiver.stats())
                         
                         if result is not None:
-                            print('[Loader] Successfully reassembled, updating display...')
-                            
-                            # ADDED: Validate and clean the data before display
-                            result = np.nan_to_num(result, nan=0.0, posinf=0.0, neginf=0.0)
-                            result = np.abs(result)  # Ensure non-negative
-                            
-                            # Check data range
-                            data_min = np.min(result)
-                            data_max = np.max(result)
-                            print(f'[Loader] Data range: [{data_min:.6e}, {data_max:.6e}]')
-                            
-                            # Normalize if needed (avoid division by zero)
-                            if data_max > 0:
-                                result = result / data_max
-                            else:
-                                print('[Loader] WARNING: All data is zero')
-                            
-                            # Update the pyigtl_data node
-                            pyigtl_node = slicer.util.getNode('pyigtl_data')
-                            
-                            # Convert numpy to VTK
-                            from vtk.util.numpy_support import numpy_to_vtk
-                            vtk_data = vtk.vtkImageData()
-                            vtk_data.SetDimensions(result.shape[2], result.shape[1], result.shape[0])
-                            vtk_array_out = numpy_to_vtk(result.flatten(order='F'), deep=True)
-                            vtk_data.GetPointData().SetScalars(vtk_array_out)
-                            
-                            # Update node
-                            pyigtl_node.SetAndObserveImageData(vtk_data)
-                            pyigtl_node.Modified()
-                            
-                            print('[Loader] pyigtl_data node updated successfully')
-                            
-                            # Process with mapper
-                            try:
-                                M.Mapper.modifyIncomingImage(self)
-                            except Exception as e:
-                                print(f'[Loader] Mapper error (this is OK if FiberBundle not created): {e}')
-        
-        elif node_name == 'pyigtl_data':
+                            log.debug('Successfully reassembled, updating display...')
+                            # flatten already copies into a private array, VTK can wrap it as is
+                            self.displayResult(result.flatten(order='F'), result.shape, deep=False)
+
+        elif node_name == 'pyigtl_data' and not self.reusing:
             # Legacy single-message mode (backward compatible)
-            print('New CNN Image received via PyIgtl (legacy mode)')
+            log.debug('New CNN Image received via PyIgtl (legacy mode)')
+            self.traceReceived = LatencyTracer.now()
+            self.traceServer = LatencyTracer.serverTimes(caller)
             try:
                 M.Mapper.modifyIncomingImage(self)
             except Exception as e:
-                print(f'[Loader] Mapper error: {e}')
-
-#  this was @staticmethod before?
-    @classmethod
-    def loadExample(self, example_path):
-
-        print('Your selected Example: ' + example_path)
-        data_directory = os.path.join(os.path.dirname(slicer.modules.slicertms.path), '../', example_path)
-
-        loader = Loader(data_directory)
-
-        # slicer.mrmlScene.Clear()
-
-        #
-        # 1. Brain:
-        #
-        brainModelFile = os.path.join( loader.data_directory, loader._graymatter_file )
-        loader.modelNode = slicer.modules.models.logic().AddModel(brainModelFile,
-                                                                slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-
-        loader.brainTransparentNode = slicer.modules.models.logic().AddModel(brainModelFile,
-                                                                slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        loader.brainTransparentNode.SetName('brainTransparent')
-        brainTransparentDisplayNode = loader.brainTransparentNode.GetDisplayNode()
-        brainTransparentDisplayNode.SetOpacity(0.3)
-        brainTransparentDisplayNode.SetColor(0.7, 0.7, 0.7)
-        # brainTransparentDisplayNode.SetVisibility(False)
-        loader.brainTransparentNode.SetDisplayVisibility(False)
-        #
-        # 2. Fibers:
-        #
+                log.error('Mapper error: %s', e)
+            self.firstEFieldShown()
+
+    def onInteractionStart(self):
+        """Coil drag started: coarse gm and skin, the shown E-field probed on the coarse gm"""
+        self.meshLOD.setCoarse(True)
+        self.remapMesh()
+
+    def onInteractionSettled(self):
+        """Coil drag over: full meshes, with a full quality mapping of the latest E-field"""
+        self.meshLOD.setCoarse(False)
+        self.remapMesh()
+
+    def remapMesh(self):
+        """Probe the E-field already shown onto the current gm level, no server round trip"""
+        if self.meshSampler is not None and self.modelNode is not None:
+            M.Mapper.mapElectricfieldToMesh(self.pyigtlNode, self.modelNode, self)
+
+    def firstEFieldShown(self):
+        """Report time-to-first-E-field once, then load what was deferred"""
+        if self.loadStart is None:
+            return
+        log.info('Time to first E-field: %.2f s', timeit.default_timer() - self.loadStart)
+        self.loadStart = None
+        # after this event, so the first E-field is drawn before anything else loads
+        qt.QTimer.singleShot(0, self.loadDeferred)
+
+    def loadDeferred(self):
+        """
+        Skin, magnorm and label map: decoded in the background, added (or swapped
+        into the existing nodes after reuse()) once the first E-field is up
+        """
+        st = timeit.default_timer()
+        skinData = self.assets.result('skin')
+        if skinData is None:
+            Loader.removeNode(self.skinNode)
+            self.skinNode = None
+        elif self.skinNode is not None:
+            self.skinNode.SetAndObservePolyData(skinData)
+        else:
+            self.skinNode = self.own(AssetReader.addModel(skinData, os.path.splitext(self._skin_file)[0]))
+            skinDisplayNode = self.skinNode.GetDisplayNode()
+            skinDisplayNode.SetColor(0.8, 0.8, 0.8)
+            skinDisplayNode.SetOpacity(0.35)
+
+        # coarse levels, shown and probed while the coil is dragged
+        self.meshLOD.clear()
+        for node in (self.modelNode, self.brainTransparentNode):
+            self.meshLOD.add(node, self.assets.result('gmCoarse'))
+        self.meshLOD.add(self.skinNode, self.assets.result('skinCoarse'))
+
+        # magnorm is only used for testing and visualization, the coil default matrix comes from its header
+        magnormImage = self.assets.result('magnorm')
+        if magnormImage is None:
+            Loader.removeNode(self.magnormNode)
+            self.magnormNode = None
+        elif self.magnormNode is not None:
+            AssetReader.updateVolume(magnormImage, self.magnormNode)
+        else:
+            self.magnormNode = self.own(AssetReader.addVolume(magnormImage, 'MagNorm'))
+
+        labelImage = self.assets.result('labels')
+        if labelImage is None:
+            Loader.removeNode(self.labelNode)
+            self.labelNode = None
+        elif self.labelNode is not None:
+            AssetReader.updateVolume(labelImage, self.labelNode)
+        else:
+            self.labelNode = self.own(AssetReader.addVolume(labelImage, 'labels', 'vtkMRMLLabelMapVolumeNode'))
+        self.regionStats = None  # rebuilt with the labels on the next E-field
+        log.info('Deferred assets loaded in %.2f s', timeit.default_timer() - st)
 
-        fiberModelFile = os.path.join( loader.data_directory, loader._fiber_file )
-        # loader.fiberNode = slicer.modules.models.logic().AddModel(fiberModelFile,
+    def ensureFibers(self):
+        """Load the fibers and set up ROI selection on first use"""
+        if self.fiberNode is not None:
+            return
+        fiberModelFile = os.path.join( self.data_directory, self._fiber_file )
+        # self.fiberNode = slicer.modules.models.logic().AddModel(fiberModelFile,
                                                                 # slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        # loader.fiberNode.SetDisplayVisibility(0)
+        # self.fiberNode.SetDisplayVisibility(0)
 
 
-        loader.fiberNode = slicer.util.loadFiberBundle(fiberModelFile)
-        loader.fiberNode.SetName('fibers')
+        self.fiberNode = self.own(slicer.util.loadFiberBundle(fiberModelFile))
+        self.fiberBundleNodes.append(self.fiberNode)
+        self.fiberNode.SetName('fibers')
         # set visibilit to hide
-        loader.fiberNode.SetDisplayVisibility(0)
+        self.fiberNode.SetDisplayVisibility(0)
 
-        # create annotation ROI for selecting fibers
-        # MODIFIED: Use MarkupsROI instead of deprecated AnnotationROI for Slicer 5.8.1+
-        try:
-            # Try new API first (Slicer 5.8+)
-            loader.roi = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsROINode', 'ROI')
-            loader.roi.SetCenter(0, 0, 0)
-            loader.roi.SetSize(60, 60, 60)  # Size is diameter, so 60 = radius of 30
-        except:
-            # Fallback to old API
-            loader.roi = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode', 'ROI')
-            loader.roi.SetXYZ(0, 0, 0)
-            loader.roi.SetRadiusXYZ(30, 30, 30)
-        
-        loader.roi.SetDisplayVisibility(0)
-        
         # MODIFIED: Use display node methods instead of deprecated fiber bundle methods
-        fiberDisplayNode = loader.fiberNode.GetDisplayNode()
+        fiberDisplayNode = self.fiberNode.GetDisplayNode()
         if fiberDisplayNode:
             try:
                 # Try setting ROI using display node (newer API)
                 if hasattr(fiberDisplayNode, 'SetAndObserveROINodeID'):
-                    fiberDisplayNode.SetAndObserveROINodeID(loader.roi.GetID())
+                    fiberDisplayNode.SetAndObserveROINodeID(self.roi.GetID())
             except:
                 pass
         
         # Try old API if available
-        if hasattr(loader.fiberNode, 'SelectWithAnnotationNodeOn'):
-            loader.fiberNode.SelectWithAnnotationNodeOn()
-            loader.fiberNode.SetAndObserveAnnotationNodeID(loader.roi.GetID())
+        if hasattr(self.fiberNode, 'SelectWithAnnotationNodeOn'):
+            self.fiberNode.SelectWithAnnotationNodeOn()
+            self.fiberNode.SetAndObserveAnnotationNodeID(self.roi.GetID())
 
 
 
@@ -300,12 +568,12 @@ class Loader:
             simpleDisplay = slicer.util.findChildren(w, text='Simple Display')[0]
             # w.setFiberBundleNode(slicer.util.getNode('fibers'))
             treeView = slicer.util.findChildren(simpleDisplay, name = "TractographyDisplayTreeView")[0]
-            treeView.setCurrentNode(loader.fiberNode)
+            treeView.setCurrentNode(self.fiberNode)
             # slicer.util.delayDisplay('update')
             ww = slicer.util.findChildren(w, className= "*ROI*")[0]
             ww.enabled
             combo = slicer.util.findChildren(ww, name = "ROIForFib*Selector")[0]
-            combo.setCurrentNode(slicer.util.getNode('ROI'))
+            combo.setCurrentNode(self.roi)
             wx = slicer.util.findChildren(w, name = "Positive*")[0] # This is the radiobutton for positive ROI
             if wx.checked == False:
                 wx.click()
@@ -314,6 +582,7 @@ class Loader:
             nodes = slicer.mrmlScene.GetNodesByName('FiberBundle')
             if nodes.GetNumberOfItems() > 0:
                 fiberBundleCreated = True
+                self.fiberBundleNodes.append(self.own(nodes.GetItemAsObject(0)))
                 print("FiberBundle node created successfully via widget")
         except Exception as e:
             print(f"Note: Tractography display widget setup skipped: {e}")
@@ -323,19 +592,20 @@ class Loader:
             print("Creating FiberBundle node manually...")
             try:
                 # Create a copy of the fiber node as FiberBundle for the Mapper
-                loader.fiberBundleNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLFiberBundleNode', 'FiberBundle')
+                self.fiberBundleNode = self.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLFiberBundleNode', 'FiberBundle'))
+                self.fiberBundleNodes.append(self.fiberBundleNode)
                 
                 # Copy the polydata from the original fiber node
-                originalPolyData = loader.fiberNode.GetPolyData()
+                originalPolyData = self.fiberNode.GetPolyData()
                 if originalPolyData:
-                    loader.fiberBundleNode.SetAndObservePolyData(originalPolyData)
-                    loader.fiberBundleNode.SetDisplayVisibility(0)
+                    self.fiberBundleNode.SetAndObservePolyData(originalPolyData)
+                    self.fiberBundleNode.SetDisplayVisibility(0)
                     
                     # Set up display node
-                    displayNode = loader.fiberBundleNode.GetDisplayNode()
+                    displayNode = self.fiberBundleNode.GetDisplayNode()
                     if displayNode:
                         # Copy display properties from original
-                        origDisplayNode = loader.fiberNode.GetDisplayNode()
+                        origDisplayNode = self.fiberNode.GetDisplayNode()
                         if origDisplayNode:
                             displayNode.Copy(origDisplayNode)
                     
@@ -346,7 +616,7 @@ class Loader:
                 print(f"Warning: Could not create FiberBundle manually: {e}")
                 # Create a placeholder so Mapper doesn't crash
                 try:
-                    slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', 'FiberBundle')
+                    self.fiberBundleNodes.append(self.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode', 'FiberBundle')))
                     print("Created placeholder FiberBundle node")
                 except:
                     pass
@@ -365,23 +635,170 @@ class Loader:
         # simpleDisplay = slicer.util.findChildren(text='Simple Display')[0]
         # ss = slicer.util.findChildren(simpleDisplay, name="FiberBundleTableDisplay")[0]
 
+        for fiberNode in (slicer.mrmlScene.GetFirstNodeByName('fibers'), self.fiberNode, slicer.mrmlScene.GetFirstNodeByName('FiberBundle')):
+            if fiberNode is not None and fiberNode.IsA('vtkMRMLFiberBundleNode'):
+                M.Mapper.setupFiberDisplay(fiberNode)
+        # colour them with the E-field that is already shown
+        if self.meshSampler is not None:
+            M.Mapper.mapElectricfieldToFibers(self.pyigtlNode, self.fiberNode, self)
+
+    def submitAssets(self):
+        """
+        Decode in the background: the critical path first (conductivity, gm, coil,
+        magnorm header for the coil default matrix), then what loadDeferred adds
+        after the first E-field.
+        """
+        if self.assets is not None:
+            self.assets.shutdown()
+        self.assets = AssetReader(self.data_directory)
+        self.assets.submit('conductivity', AssetReader.readImage, self._conductivity_file)
+        self.assets.submit('gm', AssetReader.readPolyData, self._graymatter_file)
+        self.assets.submit('coil', AssetReader.readPolyData, self._coil_file)
+        self.assets.submit('magnormGeometry', AssetReader.readIJKToRAS, self._magnorm_file)
+        self.assets.submit('skin', AssetReader.readPolyData, self._skin_file)
+        self.assets.submit('magnorm', AssetReader.readImage, self._magnorm_file)
+        self.assets.submit('labels', AssetReader.readImage, self._labels_file)
+        self.assets.submit('gmCoarse', MeshLOD.readCoarse, self._graymatter_file)
+        self.assets.submit('skinCoarse', MeshLOD.readCoarse, self._skin_file)
+
+    def reuse(self, example_path):
+        """
+        Switch this loaded example to another one in place: the connector, coil
+        plane, ROI, transforms, display settings and observers stay, only the
+        image data, the meshes and the magfield grid transform are swapped.
+        Returns False when this loader has nothing loaded to reuse.
+        """
+        graymatterFile = Loader.graymatterFile(Loader.exampleDirectory(example_path))
+        if self.pyigtlNode is None or self.pyigtlNode.GetScene() is None or graymatterFile is None:
+            return False
+        print('Your selected Example: ' + example_path)
+        self.loadStart = timeit.default_timer()
+        if self.mapScheduler is not None:
+            self.mapScheduler.stop()
+        self.repairTimer.stop()
+        self.receiver = SimpleReceiver()  # frames in flight belong to the old example
+        self.data_directory = Loader.exampleDirectory(example_path)
+        self._graymatter_file = graymatterFile
+        self.submitAssets()
+        self.removeFibers()
+
+        # the grid transform is read on this thread, it replaces the old one
+        Loader.removeNode(self.magfieldGTNode)
+        self.ownedNodes.remove(self.magfieldGTNode)
+        self.magfieldGTNode = self.own(slicer.util.loadTransform(os.path.join(self.data_directory, self._magfield_file)))
+
+        self.meshLOD.clear()
+        self.modelNode.SetAndObservePolyData(self.assets.result('gm'))
+        self.brainTransparentNode.SetAndObservePolyData(self.modelNode.GetPolyData())
+        self.coilNode.SetAndObservePolyData(self.assets.result('coil'))
+        scale = vtk.vtkTransform()
+        scale.Scale(self._coil_scale, self._coil_scale, self._coil_scale)
+        self.coilNode.ApplyTransformMatrix(scale.GetMatrix())
+        self.coilDefaultMatrix.DeepCopy(self.assets.result('magnormGeometry'))
+
+        AssetReader.updateVolume(self.assets.result('conductivity'), self.conductivityNode)
+        self.magfieldNode.SetSpacing(self.conductivityNode.GetSpacing())
+        self.magfieldNode.SetOrigin(self.conductivityNode.GetOrigin())
+        self.efieldNode.SetSpacing(self.conductivityNode.GetSpacing())
+        self.efieldNode.SetOrigin(self.conductivityNode.GetOrigin())
+        self.enormNode.CopyOrientation(self.conductivityNode)
+        # pyigtl_data starts as a copy of the conductivity, without mapping it as an E-field
+        self.reusing = True
+        try:
+            imageData = vtk.vtkImageData()
+            imageData.DeepCopy(self.conductivityNode.GetImageData())
+            self.pyigtlNode.CopyOrientation(self.conductivityNode)
+            self.pyigtlNode.SetAndObserveImageData(imageData)
+        finally:
+            self.reusing = False
+
+        # per-example caches, rebuilt on the next map and E-field
+        self.resliceEngine = None
+        self.meshSampler = None
+        self.meshSamplers = {}
+        self.regionStats = None
+        self.hotspotStats = None
+        slicer.util.setSliceViewerLayers(background=self.conductivityNode, foreground=self.pyigtlNode)
+
+        self.mapScheduler.lastPose = None
+        self.mapScheduler.updateNow()
+        log.info('Critical path reloaded in place in %.2f s, waiting for the first E-field',
+                 timeit.default_timer() - self.loadStart)
+        return True
+
+    @staticmethod
+    def exampleDirectory(example_path):
+        return os.path.join(os.path.dirname(slicer.modules.slicertms.path), '../', example_path)
+
+    @classmethod
+    def switchExample(cls, example_path, previous=None):
+        """Load an example, in place of the previous one when it can be reused, after unloading it otherwise"""
+        if previous is not None:
+            if previous.reuse(example_path):
+                return previous
+            previous.unload()
+        return cls.loadExample(example_path)
+
+#  this was @staticmethod before?
+    @classmethod
+    def loadExample(self, example_path):
+
+        print('Your selected Example: ' + example_path)
+        data_directory = Loader.exampleDirectory(example_path)
+
+        loader = Loader(data_directory)
+        loader.loadStart = timeit.default_timer()
+
+        # slicer.mrmlScene.Clear()
+
+        # the example files decode in the background while the magfield grid
+        # transform is read on this thread
+        loader.submitAssets()
+
+        # load magvector as a GridTransformNode
+        # the grid transform node (GTNode) only provides the 4D vtkImageData in the original space
+        loader.magfieldGTNode  = loader.own(slicer.util.loadTransform(os.path.join( loader.data_directory, loader._magfield_file )))
+
+        #
+        # 1. Brain:
+        #
+        loader.modelNode = loader.own(AssetReader.addModel(loader.assets.result('gm'), os.path.splitext(loader._graymatter_file)[0]))
+
+        # same decoded mesh, not a second read from disk
+        loader.brainTransparentNode = loader.own(AssetReader.addModel(loader.modelNode.GetPolyData(), 'brainTransparent'))
+        brainTransparentDisplayNode = loader.brainTransparentNode.GetDisplayNode()
+        brainTransparentDisplayNode.SetOpacity(0.3)
+        brainTransparentDisplayNode.SetColor(0.7, 0.7, 0.7)
+        # brainTransparentDisplayNode.SetVisibility(False)
+        loader.brainTransparentNode.SetDisplayVisibility(False)
+
+        #
+        # 2. ROI, also used to select fibers once they are loaded (ensureFibers):
+        #
+        # create annotation ROI for selecting fibers
+        # MODIFIED: Use MarkupsROI instead of deprecated AnnotationROI for Slicer 5.8.1+
+        try:
+            # Try new API first (Slicer 5.8+)
+            loader.roi = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsROINode', 'ROI'))
+            loader.roi.SetCenter(0, 0, 0)
+            loader.roi.SetSize(60, 60, 60)  # Size is diameter, so 60 = radius of 30
+        except:
+            # Fallback to old API
+            loader.roi = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode', 'ROI'))
+            loader.roi.SetXYZ(0, 0, 0)
+            loader.roi.SetRadiusXYZ(30, 30, 30)
+        
+        loader.roi.SetDisplayVisibility(0)
 
         #
-        # 3. Skin model:
+        # 3. Skin model: decoded in the background, added after the first E-field (loadDeferred)
         #
-        skin = os.path.join( loader.data_directory, loader._skin_file )
-        loader.skinNode = slicer.modules.models.logic().AddModel(skin, slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
-        skinDisplayNode = loader.skinNode.GetDisplayNode()
-        skinDisplayNode.SetColor(0.8, 0.8, 0.8)
-        skinDisplayNode.SetOpacity(0.35)
 
 
         #
         # 4. TMS coil:
         #
-        coil = os.path.join( loader.data_directory, loader._coil_file )
-        
-        loader.coilNode = slicer.modules.models.logic().AddModel(coil, slicer.vtkMRMLStorageNode.CoordinateSystemRAS)
+        loader.coilNode = loader.own(AssetReader.addModel(loader.assets.result('coil'), os.path.splitext(loader._coil_file)[0]))
         
         # Set transform on the coil and resize it:
         parentTransform = vtk.vtkTransform()
@@ -390,7 +807,7 @@ class Loader:
         loader.coilNode.ApplyTransformMatrix(parentTransform.GetMatrix())
 
         # Add a plane to the scene
-        markupsPlaneNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsPlaneNode', 'Coil')
+        markupsPlaneNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsPlaneNode', 'Coil'))
         # markupsPlaneNode.SetOrigin([0, 0, 110])
         # markupsPlaneNode.SetOrigin([0, 0, 0])
         # markupsPlaneNode.SetNormalWorld([0, 0, -10])
@@ -411,12 +828,12 @@ class Loader:
             markupsPlaneNode.SetOrigin([0, 0, 0])
 
         except:
-            loader.transformNavigationNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "NavigationTransform")
+            loader.transformNavigationNode = loader.own(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "NavigationTransform"))
             markupsPlaneNode.SetOrigin([0, 0, 110])
         
         loader.markupsPlaneNode = markupsPlaneNode
 
-        loader.transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "HandleTransform")
+        loader.transformNode = loader.own(slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode", "HandleTransform"))
 
         # loader.transformNode = slicer.mrmlScene.AddNode(slicer.vtkMRMLLinearTransformNode())
         loader.coilNode.SetAndObserveTransformNodeID(loader.transformNode.GetID())
@@ -428,31 +845,26 @@ class Loader:
         # 5. Other stuff
         #
 
-        # load magnorm (used for tesing and visualization, not useful for predicting E-field)
-        loader.magnormNode = slicer.util.loadVolume( os.path.join( loader.data_directory, loader._magnorm_file ) )
-        loader.magnormNode.SetName('MagNorm')
-        loader.magnormNode.GetIJKToRASMatrix(loader.coilDefaultMatrix)
-
-
-        # load magvector as a GridTransformNode 
-        # the grid transform node (GTNode) only provides the 4D vtkImageData in the original space
-        loader.magfieldGTNode  = slicer.util.loadTransform(os.path.join( loader.data_directory, loader._magfield_file ))
+        # the coil default matrix only needs the magnorm header, the volume itself
+        # (used for tesing and visualization, not useful for predicting E-field) comes in loadDeferred
+        loader.coilDefaultMatrix.DeepCopy(loader.assets.result('magnormGeometry'))
 
         # load conductivity
-        loader.conductivityNode = slicer.util.loadVolume( os.path.join( loader.data_directory, loader._conductivity_file ) )
+        loader.conductivityNode = loader.own(AssetReader.addVolume(loader.assets.result('conductivity'),
+                                                                   os.path.basename(loader._conductivity_file).split('.')[0]))
 
         # creat magfield vector volumeNode for visualizing rotated RBG-coded magnetic vector field
-        loader.magfieldNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+        loader.magfieldNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode'))
         loader.magfieldNode.SetSpacing(loader.conductivityNode.GetSpacing())
         loader.magfieldNode.SetOrigin(loader.conductivityNode.GetOrigin())
         loader.magfieldNode.SetName('MagVec')
 
         # create nodes for received E-field data from pyigtl 
-        loader.efieldNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVectorVolumeNode')
+        loader.efieldNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVectorVolumeNode'))
         loader.efieldNode.Copy(loader.magfieldNode)
         loader.efieldNode.SetName('EVec')
 
-        loader.enormNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+        loader.enormNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode'))
         loader.enormNode.Copy(loader.conductivityNode)
         loader.enormNode.SetName('ENorm')
 
@@ -465,7 +877,7 @@ class Loader:
         loader.IGTLNode = slicer.vtkMRMLIGTLConnectorNode()
         loader.IGTLNode.SetTypeClient(tms_server_host, tms_server_port)
         print(f'Connecting to TMS server at {tms_server_host}:{tms_server_port}')
-        slicer.mrmlScene.AddNode(loader.IGTLNode)
+        loader.own(slicer.mrmlScene.AddNode(loader.IGTLNode))
         # node should be visible in OpenIGTLinkIF module under connectors
         loader.IGTLNode.SetName('Connector1')
         # this will activate the the status of the connection:
@@ -476,17 +888,21 @@ class Loader:
         print('OpenIGTLink Connector created! \n Check IGT > OpenIGTLinkIF and start external pyigtl server.')
 
         # observer for the icoming IGTL image data
-        loader.pyigtlNode = slicer.util.loadVolume( os.path.join( loader.data_directory, loader._conductivity_file ) )
+        # a copy of the conductivity volume already in memory
+        loader.pyigtlNode = loader.own(slicer.modules.volumes.logic().CloneVolume(slicer.mrmlScene, loader.conductivityNode, 'pyigtl_data'))
         # loader.pyigtlNode.Copy(loader.enormNode)
-        loader.pyigtlNode.SetName('pyigtl_data')
         
         # ADDED: Create nodes for chunked data reception
-        loader.metaNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'pyigtl_meta')
+        loader.metaNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'pyigtl_meta'))
         loader.IGTLNode.RegisterIncomingMRMLNode(loader.metaNode)
         
-        loader.chunkNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'pyigtl_chunk')
+        loader.chunkNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', 'pyigtl_chunk'))
         loader.IGTLNode.RegisterIncomingMRMLNode(loader.chunkNode)
 
+        # ADDED: Notices for frames written to the shared-memory ring
+        loader.shmNoticeNode = loader.own(slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTextNode', 'pyigtl_shm'))
+        loader.IGTLNode.RegisterIncomingMRMLNode(loader.shmNoticeNode)
+
         # Display setting
         # conductivityDisplayNode = loader.conductivityNode.GetDisplayNode()
         # conductivityDisplayNode.SetAndObserveColorNodeID('vtkMRMLColorTableNodeGrey')
@@ -505,17 +921,24 @@ class Loader:
         slicer.app.processEvents()  # Dynamic updating scene
 
         # MODIFIED: Add observers for all node types
-        observationTag = loader.pyigtlNode.AddObserver(slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
-        loader.metaNode.AddObserver(slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
-        loader.chunkNode.AddObserver(slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
+        observationTag = loader.observe(loader.pyigtlNode, slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
+        loader.observe(loader.metaNode, slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
+        loader.observe(loader.chunkNode, slicer.vtkMRMLScalarVolumeNode.ImageDataModifiedEvent, loader.newImage)
+        loader.observe(loader.shmNoticeNode, slicer.vtkMRMLTextNode.TextModifiedEvent, loader.newShmNotice)
+        loader.trySharedMemory()
 
 
         # # call one time
-        loader.callMapper()
+        # coil moves are coalesced and rate limited before they reach the mapper
+        loader.mapScheduler = S.UpdateScheduler(loader.coilPose, loader.callMapper,
+                                                startFunction=loader.onInteractionStart,
+                                                settleFunction=loader.onInteractionSettled)
+        loader.mapScheduler.updateNow()
 
         # # interaction hookup
-        loader.markupsPlaneNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, loader.callMapper)
-        loader.transformNavigationNode.AddObserver(slicer.vtkMRMLTransformableNode.TransformModifiedEvent, loader.callMapper)
+        loader.observe(loader.markupsPlaneNode, slicer.vtkMRMLMarkupsNode.PointModifiedEvent, loader.mapScheduler.request)
+        loader.observe(loader.transformNavigationNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, loader.mapScheduler.request)
         #slicer.mrmlScene.AddObserver(slicer.vtkMRMLScene.NodeAddedEvent, loader.onNodeRcvd)
 
+        log.info('Critical path loaded in %.2f s, waiting for the first E-field', timeit.default_timer() - loader.loadStart)
         return loader
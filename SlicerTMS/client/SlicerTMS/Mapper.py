@@ -1,15 +1,17 @@
+import logging
 import os
-import vtk, qt, ctk, slicer, sitkUtils
+import vtk, slicer
 from slicer.ScriptedLoadableModule import *
 import numpy as np
 from vtk.util.numpy_support import vtk_to_numpy
-from vtk.util.numpy_support import numpy_to_vtk
-import SimpleITK as sitk
-import time
 import timeit
-import csv
 from datetime import datetime
-import json
+from event_journal import EventJournal, journal_path_for, new_event_id
+from Hotspot import Hotspot
+from RegionStats import RegionStats
+from Tracer import LatencyTracer
+
+log = logging.getLogger(__name__)
 
 
 def load_env_file(env_file=None):
@@ -41,10 +43,10 @@ def load_env_file(env_file=None):
                     if line and not line.startswith('#') and '=' in line:
                         key, value = line.split('=', 1)
                         os.environ[key.strip()] = value.strip()
-            print(f"Loaded environment from {env_file}")
+            log.info("Loaded environment from %s", env_file)
             return True
         except Exception as e:
-            print(f"Warning: Could not load {env_file}: {e}")
+            log.warning("Could not load %s: %s", env_file, e)
     
     return False
 
@@ -53,175 +55,383 @@ def load_env_file(env_file=None):
 load_env_file()
 
 
+class ResliceEngine:
+    """
+    Persistent reslice pipeline for the magnetic vector field, one per loader.
+    The displacement grid, reference geometry and vtkImageReslice are set up
+    once; a coil move only updates the reslice axes. The rotated field is
+    written into one float32 output image that is reused across moves.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.grid = None
+
+        self.matrix_ref = vtk.vtkMatrix4x4()
+        loader.conductivityNode.GetIJKToRASMatrix(self.matrix_ref)
+        self.resliceAxes = vtk.vtkMatrix4x4()
+
+        self.reslice = vtk.vtkImageReslice()
+        self.reslice.SetInformationInput(loader.conductivityNode.GetImageData())
+        self.reslice.SetInterpolationModeToLinear()
+        self.reslice.SetResliceAxes(self.resliceAxes)
+        self.reslice.TransformInputSamplingOff()
+        # Interpolate straight into float32, half the memory traffic of the double grid
+        self.reslice.SetOutputScalarTypeToFloat()
+        # Split the reslice over all cores (SMP backend where VTK has it)
+        self.reslice.SetNumberOfThreads(os.cpu_count() or 1)
+        if hasattr(self.reslice, 'SetEnableSMP'):
+            self.reslice.SetEnableSMP(True)
+
+        self.output = None  # rotated field, shown in magfieldNode and pushed over IGTL
+        self.output_np = None
+        self.resliceTime = 0.0
+
+    def updateGrid(self):
+        """Fetch the displacement grid once, again only if the transform got a new grid"""
+        grid = self.loader.magfieldGTNode.GetTransformFromParent().GetDisplacementGrid()
+        if grid is not self.grid:
+            grid.SetOrigin(0, 0, 0)
+            grid.SetSpacing(1, 1, 1)
+            self.grid = grid
+            self.reslice.SetInputData(grid)
+            log.debug("Cached displacement grid from magnetic field ground truth node")
+
+    def allocateOutput(self, resliced):
+        """(Re)create the output image when the resliced geometry changes"""
+        dims = resliced.GetDimensions()
+        if self.output is not None and self.output.GetDimensions() == dims:
+            return
+        self.output = vtk.vtkImageData()
+        self.output.CopyStructure(resliced)
+        scalars = vtk.vtkFloatArray()
+        scalars.SetNumberOfComponents(3)
+        scalars.SetNumberOfTuples(resliced.GetNumberOfPoints())
+        self.output.GetPointData().SetScalars(scalars)
+        self.output_np = vtk_to_numpy(scalars)  # view, written in place on every move
+        log.debug("Allocated reslice output buffer: %s", dims)
+
+    def run(self, matrixFromFid, coilDefaultMatrix):
+        """Reslice and rotate the field for the current coil pose, returns the output image"""
+        self.updateGrid()
+
+        matrix_current = vtk.vtkMatrix4x4() # current transform of the magnetic vector field
+        matrix_current.Multiply4x4(matrixFromFid, coilDefaultMatrix, matrix_current)
+        matrix_current.Invert()
+        vtk.vtkMatrix4x4.Multiply4x4(matrix_current, self.matrix_ref, self.resliceAxes)
+        self.resliceAxes.Modified()
+
+        st = timeit.default_timer()
+        self.reslice.Update()
+        self.resliceTime = timeit.default_timer() - st
+        resliced = self.reslice.GetOutput()
+
+        self.allocateOutput(resliced)
+        # # transposed of the rotation matrix
+        RotMat_transp = np.array([[matrixFromFid.GetElement(j, i) for j in range(3)] for i in range(3)],
+                                 dtype=np.float32)
+        # # rotate the vector field into the persistent buffer: (N x 3) @ (3 x 3) in
+        # # float32 on views of the VTK arrays, np.dot hands this to BLAS (sgemm)
+        np.dot(vtk_to_numpy(resliced.GetPointData().GetScalars()), RotMat_transp, out=self.output_np)
+        self.output.Modified()
+        return self.output
+
+
+class MeshSampler:
+    """
+    Precomputed trilinear sampling of a volume at the vertices of a static mesh.
+    For every vertex the 8 surrounding voxel indices (int32) and trilinear
+    weights (float32) are computed once; mapping a new frame is then one
+    gather and weighted sum into a persistent point scalar array on the mesh.
+    Vertices outside the volume get weight 0, like vtkProbeFilter.
+    """
+
+    SCALAR_NAME = 'ImageScalars'  # same name the vtkProbeFilter output used
+
+    def __init__(self, scalarNode, brainNode):
+        self.brainNode = brainNode
+        self.geometryKey = Mapper.volumeGeometryKey(scalarNode)
+        st = timeit.default_timer()
+        points = vtk_to_numpy(brainNode.GetPolyData().GetPoints().GetData())
+        self.indices, self.weights = MeshSampler.buildIndex(scalarNode, points)
+        self.gathered = None
+
+        polyData = brainNode.GetPolyData()
+        self.polyData = polyData  # the level of detail this index is for (MeshLOD swaps the node's polydata)
+        self.scalars = vtk.vtkFloatArray()
+        self.scalars.SetName(MeshSampler.SCALAR_NAME)
+        self.scalars.SetNumberOfComponents(1)
+        self.scalars.SetNumberOfTuples(polyData.GetNumberOfPoints())
+        self.scalars.Fill(0.0)
+        polyData.GetPointData().SetScalars(self.scalars)
+        self.values = vtk_to_numpy(self.scalars)  # view, written in place per frame
+        log.info("Built mesh sampling index for %d vertices in %.3f s",
+                 polyData.GetNumberOfPoints(), timeit.default_timer() - st)
+
+    @staticmethod
+    def buildIndex(scalarNode, points):
+        """Voxel indices (N x 8, int32) and trilinear weights (N x 8, float32) per RAS point"""
+        rasToIjk = vtk.vtkMatrix4x4()
+        scalarNode.GetRASToIJKMatrix(rasToIjk)
+        rasToIjk = slicer.util.arrayFromVTKMatrix(rasToIjk)
+        dims = np.array(scalarNode.GetImageData().GetDimensions())
+
+        ijk = np.asarray(points, dtype=np.float64) @ rasToIjk[:3, :3].T + rasToIjk[:3, 3]
+
+        inside = np.all((ijk >= 0) & (ijk <= dims - 1), axis=1)
+        # lower corner, kept one voxel inside so the upper corner is valid on the border
+        base = np.clip(np.floor(ijk), 0, np.maximum(dims - 2, 0)).astype(np.int64)
+        frac = np.clip(ijk - base, 0.0, 1.0)
+
+        indices = np.empty((len(points), 8), dtype=np.int32)
+        weights = np.empty((len(points), 8), dtype=np.float32)
+        for corner, (di, dj, dk) in enumerate(np.ndindex(2, 2, 2)):
+            i = np.minimum(base[:, 0] + di, dims[0] - 1)
+            j = np.minimum(base[:, 1] + dj, dims[1] - 1)
+            k = np.minimum(base[:, 2] + dk, dims[2] - 1)
+            # vtkImageData point order: i fastest, then j, then k
+            indices[:, corner] = i + dims[0] * (j + dims[1] * k)
+            weights[:, corner] = ((frac[:, 0] if di else 1 - frac[:, 0]) *
+                                  (frac[:, 1] if dj else 1 - frac[:, 1]) *
+                                  (frac[:, 2] if dk else 1 - frac[:, 2]))
+        weights[~inside] = 0.0
+        return indices, weights
+
+    def interpolate(self, scalarNode, out):
+        """Trilinear values of the current frame at the indexed points, written into out"""
+        voxels = vtk_to_numpy(scalarNode.GetImageData().GetPointData().GetScalars()).ravel()
+        if self.gathered is None or self.gathered.dtype != voxels.dtype:
+            self.gathered = np.empty(self.indices.shape, dtype=voxels.dtype)
+        np.take(voxels, self.indices, out=self.gathered, mode='clip')
+        np.einsum('ij,ij->i', self.gathered, self.weights, out=out, casting='same_kind')
+
+    def sample(self, scalarNode):
+        """Sample the current frame into the mesh point scalars, returns the value range"""
+        self.interpolate(scalarNode, self.values)
+        self.scalars.Modified()
+        self.polyData.Modified()
+        return float(self.values.min()), float(self.values.max())
+
+
+class FiberSampler(MeshSampler):
+    """
+    E-field along tractography fibers. Like MeshSampler, the voxel indices and
+    weights of the fiber points are computed once per example. Each frame gives
+    per-point scalars and per-fiber max and mean (np.maximum.reduceat /
+    np.add.reduceat over the line connectivity) as cell data. With ROI bounds,
+    only the fibers passing through the ROI keep their values; the ROI follows
+    the coil, so that selection is a per-line mask redone when the bounds
+    move, not a new index.
+    """
+
+    SCALAR_NAME = 'EField'
+    FIBER_MAX_NAME = 'EFieldMax'
+    FIBER_MEAN_NAME = 'EFieldMean'
+
+    def __init__(self, scalarNode, fiberNode):
+        self.brainNode = fiberNode
+        self.geometryKey = Mapper.volumeGeometryKey(scalarNode)
+        self.gathered = None
+        st = timeit.default_timer()
+
+        polyData = fiberNode.GetPolyData()
+        points = vtk_to_numpy(polyData.GetPoints().GetData())
+        offsets, connectivity = FiberSampler.lineArrays(polyData)
+        lengths = np.diff(offsets)
+        self.lineIds = np.flatnonzero(lengths > 0).astype(np.int32)
+
+        # connectivity of the lines, in line order, and where each line starts
+        self.starts = np.concatenate([[0], np.cumsum(lengths[self.lineIds])[:-1]]).astype(np.int64)
+        self.pointIds, self.linePointPos = np.unique(connectivity, return_inverse=True)
+        self.points = points[self.pointIds]  # for the ROI test
+        self.indices, self.weights = MeshSampler.buildIndex(scalarNode, self.points)
+        self.sampled = np.empty(len(self.pointIds), dtype=np.float32)
+        self.alongLines = np.empty(len(connectivity), dtype=np.float32)
+        self.lineMax = np.empty(len(self.lineIds), dtype=np.float32)
+        self.lineMean = np.empty(len(self.lineIds), dtype=np.float32)
+        self.pointsPerLine = lengths[self.lineIds]
+        self.lineLengths = self.pointsPerLine.astype(np.float32)
+        # ROI selection: bounds it is for, and masks over the lines and over alongLines (None: every line)
+        self.roiBounds = None
+        self.lineMask = self.alongMask = None
+
+        self.scalars = FiberSampler.addArray(polyData.GetPointData(), FiberSampler.SCALAR_NAME, polyData.GetNumberOfPoints())
+        self.values = vtk_to_numpy(self.scalars)
+        # cell data: the lines come after any vertex cells
+        self.firstLineCell = polyData.GetNumberOfVerts()
+        self.maxArray = FiberSampler.addArray(polyData.GetCellData(), FiberSampler.FIBER_MAX_NAME, polyData.GetNumberOfCells())
+        self.meanArray = FiberSampler.addArray(polyData.GetCellData(), FiberSampler.FIBER_MEAN_NAME, polyData.GetNumberOfCells())
+        polyData.GetPointData().SetActiveScalars(FiberSampler.SCALAR_NAME)
+        log.info("Built fiber sampling index for %d fibers / %d points in %.3f s",
+                 len(self.lineIds), len(self.pointIds), timeit.default_timer() - st)
+
+    @staticmethod
+    def addArray(data, name, count):
+        array = vtk.vtkFloatArray()
+        array.SetName(name)
+        array.SetNumberOfTuples(count)
+        array.Fill(0.0)
+        data.RemoveArray(name)
+        data.AddArray(array)
+        return array
+
+    @staticmethod
+    def lineArrays(polyData):
+        """Line offsets (num_lines + 1) and point connectivity as numpy arrays"""
+        lines = polyData.GetLines()
+        if hasattr(lines, 'GetOffsetsArray'):
+            return (vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64),
+                    vtk_to_numpy(lines.GetConnectivityArray()).astype(np.int64))
+        # legacy layout: [n, id0, ..., id(n-1), n, ...]
+        legacy = vtk_to_numpy(lines.GetData()).astype(np.int64)
+        offsets, connectivity, pos = [0], [], 0
+        while pos < len(legacy):
+            n = legacy[pos]
+            connectivity.append(legacy[pos + 1:pos + 1 + n])
+            offsets.append(offsets[-1] + n)
+            pos += n + 1
+        return np.array(offsets), (np.concatenate(connectivity) if connectivity else np.empty(0, dtype=np.int64))
+
+    @staticmethod
+    def roiBounds(roiNode):
+        """RAS bounding box of an ROI as a tuple, None without one"""
+        if roiNode is None:
+            return None
+        bounds = [0.0] * 6
+        roiNode.GetRASBounds(bounds)
+        return tuple(bounds)
+
+    def linesInROI(self, bounds):
+        """Mask over lineIds of the lines with at least one point inside an RAS bounding box"""
+        lo, hi = np.array(bounds[0::2]), np.array(bounds[1::2])
+        inside = np.all((self.points >= lo) & (self.points <= hi), axis=1)
+        return np.logical_or.reduceat(inside[self.linePointPos], self.starts)
+
+    def selectROI(self, bounds):
+        if bounds == self.roiBounds:
+            return
+        self.roiBounds = bounds
+        if bounds is None:
+            self.lineMask = self.alongMask = None
+            return
+        self.lineMask = self.linesInROI(bounds)
+        self.alongMask = np.repeat(self.lineMask, self.pointsPerLine)
+        # fibers that left the ROI lose their colour until they are back in it
+        self.values.fill(0.0)
+        vtk_to_numpy(self.maxArray).fill(0.0)
+        vtk_to_numpy(self.meanArray).fill(0.0)
+
+    def sample(self, scalarNode, roiBounds=None):
+        """Per-point and per-fiber E-field for the current frame, returns the value range of the selected fibers"""
+        if not len(self.lineIds):
+            return 0.0, 0.0
+        self.selectROI(roiBounds)
+        self.interpolate(scalarNode, self.sampled)
+        np.take(self.sampled, self.linePointPos, out=self.alongLines)
+        np.maximum.reduceat(self.alongLines, self.starts, out=self.lineMax)
+        np.add.reduceat(self.alongLines, self.starts, out=self.lineMean)
+        self.lineMean /= self.lineLengths
+        if self.lineMask is None:
+            self.values[self.pointIds] = self.sampled
+            lineIds, selected = self.lineIds, self.alongLines
+            lineMax, lineMean = self.lineMax, self.lineMean
+        else:
+            selected = self.alongLines[self.alongMask]
+            self.values[self.pointIds[self.linePointPos[self.alongMask]]] = selected
+            lineIds = self.lineIds[self.lineMask]
+            lineMax, lineMean = self.lineMax[self.lineMask], self.lineMean[self.lineMask]
+        vtk_to_numpy(self.maxArray)[self.firstLineCell + lineIds] = lineMax
+        vtk_to_numpy(self.meanArray)[self.firstLineCell + lineIds] = lineMean
+
+        for array in (self.scalars, self.maxArray, self.meanArray):
+            array.Modified()
+        self.brainNode.GetPolyData().Modified()
+        if not len(selected):
+            return 0.0, 0.0
+        return float(selected.min()), float(selected.max())
+
+
 class Mapper:
+    # called as listener(brainNode, per-vertex values, min, max) after every E-field mapped onto a mesh,
+    # e.g. FieldBroadcaster.onFieldMapped while the web server runs
+    fieldListeners = []
+
     def __init__(self, config=None):
         self.config = config
-        print("Mapper class initialized")
+        log.debug("Mapper class initialized")
 
     @staticmethod
-    def record_simulation_event(matrix_4x4, event_type, csv_path=None):
+    def record_simulation_event(matrix_4x4, event_type, csv_path=None, event_id=None):
         """
-        Record simulation start/end events.
-        Uses file locking and atomic operations to prevent race conditions.
+        Record simulation start/end events in the append-only event journal.
+        Start and end share a correlation id; the journal writes on its own
+        thread, so this never blocks the GUI. results.csv is materialised from
+        the journal on demand (evaluations/event_journal.py export).
+        Returns the event id.
         """
-        import fcntl  # For file locking (Unix only)
-        
         try:
             if csv_path is None:
                 csv_path = os.environ.get('RESULTS_CSV_PATH', '/app/evaluations/results.csv')
-            
-            csv_dir = os.path.dirname(csv_path)
-            if csv_dir and not os.path.exists(csv_dir):
-                os.makedirs(csv_dir, mode=0o777, exist_ok=True)
-            
+            journal = EventJournal.get(journal_path_for(csv_path))
+
+            if event_type == "start":
+                event_id = event_id or new_event_id()
+            elif event_id is None:
+                # No id handed through, close the most recent start like the old CSV code did
+                event_id = journal.last_start_id
+                if event_id is None:
+                    log.warning("No start event recorded for end event")
+                    return None
+
             timestamp = datetime.now().isoformat()
             matrix_values = [matrix_4x4.GetElement(i, j) for i in range(4) for j in range(4)]
             matrix_str = ";".join(f"{v:.10f}" for v in matrix_values)
-            
-            file_exists = os.path.exists(csv_path) and os.path.getsize(csv_path) > 0
-            
-            if event_type == "start":
-                # Use append mode with locking
-                row_data = {
-                    'timestamp': timestamp,
-                    'start_time': timestamp,
-                    'end_time': '',
-                    'start_matrix': matrix_str,
-                    'end_matrix': '',
-                    'execution_time_sec': ''
-                }
-                
-                with open(csv_path, 'a', newline='', encoding='utf-8') as f:
-                    # Get exclusive lock
-                    try:
-                        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-                    except:
-                        pass  # Continue without lock if not available
-                    
-                    # Detect fieldnames from existing file
-                    if file_exists:
-                        with open(csv_path, 'r', encoding='utf-8') as rf:
-                            reader = csv.DictReader(rf)
-                            fieldnames = reader.fieldnames or list(row_data.keys())
-                    else:
-                        fieldnames = list(row_data.keys())
-                    
-                    writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-                    if not file_exists:
-                        writer.writeheader()
-                    writer.writerow(row_data)
-                    
-                    try:
-                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-                    except:
-                        pass
-                
-                print(f"✓ Recorded START at {timestamp}")
-                
-            elif event_type == "end":
-                if not file_exists:
-                    print("Warning: CSV doesn't exist for end event")
-                    return
-                
-                # Use a lock file to coordinate with update.py
-                lock_path = csv_path + '.mapper.lock'
-                max_retries = 10
-                retry_delay = 0.1
-                
-                for attempt in range(max_retries):
-                    try:
-                        # Try to acquire lock
-                        with open(lock_path, 'x') as lock_f:
-                            lock_f.write('mapper')
-                            
-                            # Read current state
-                            with open(csv_path, 'r', newline='', encoding='utf-8') as f:
-                                reader = csv.DictReader(f)
-                                fieldnames = reader.fieldnames or []
-                                rows = list(reader)
-                            
-                            if not rows:
-                                os.remove(lock_path)
-                                return
-                            
-                            # Find most recent incomplete row
-                            target_idx = None
-                            for idx, row in enumerate(reversed(rows)):
-                                if not row.get('end_time'):
-                                    target_idx = len(rows) - 1 - idx
-                                    break
-                            
-                            if target_idx is None:
-                                os.remove(lock_path)
-                                return
-                            
-                            # Update the row - preserve ALL existing fields
-                            rows[target_idx]['end_time'] = timestamp
-                            rows[target_idx]['end_matrix'] = matrix_str
-                            
-                            try:
-                                start_dt = datetime.fromisoformat(rows[target_idx]['start_time'])
-                                end_dt = datetime.fromisoformat(timestamp)
-                                rows[target_idx]['execution_time_sec'] = f"{(end_dt - start_dt).total_seconds():.3f}"
-                            except:
-                                rows[target_idx]['execution_time_sec'] = "0.000"
-                            
-                            # Ensure all fieldnames are preserved
-                            for row in rows:
-                                for fn in fieldnames:
-                                    if fn not in row:
-                                        row[fn] = ''
-                            
-                            # Write back with ALL fieldnames
-                            with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                                writer.writeheader()
-                                writer.writerows(rows)
-                            
-                            os.remove(lock_path)
-                            print(f"✓ Recorded END at {timestamp}, duration: {rows[target_idx]['execution_time_sec']}s")
-                            break  # Success!
-                            
-                    except FileExistsError:
-                        # Lock held by update.py, wait and retry
-                        time.sleep(retry_delay)
-                        continue
-                    except Exception as e:
-                        print(f"  Attempt {attempt+1} failed: {e}")
-                        time.sleep(retry_delay)
-                        try:
-                            os.remove(lock_path)
-                        except:
-                            pass
-            
-            try:
-                os.chmod(csv_path, 0o666)
-                if csv_dir:
-                    os.chmod(csv_dir, 0o777)
-            except:
-                pass
-                
+
+            journal.append({'event': event_type, 'id': event_id, 'time': timestamp, 'matrix': matrix_str})
+            log.debug("Recorded %s %s at %s", event_type.upper(), event_id[:8], timestamp)
+            return event_id
+
         except Exception as e:
-            print(f"✗ Error recording {event_type} event: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error("Error recording %s event: %s", event_type, e)
+            if log.isEnabledFor(logging.DEBUG):
+                import traceback
+                log.debug("%s", traceback.format_exc())
+            return None
+
+    @staticmethod
+    def record_region_statistics(rows, event_id, csv_path=None):
+        """Append the per-region statistics of one E-field to the event journal"""
+        try:
+            if csv_path is None:
+                csv_path = os.environ.get('RESULTS_CSV_PATH', '/app/evaluations/results.csv')
+            EventJournal.get(journal_path_for(csv_path)).append({
+                'event': 'regions',
+                'id': event_id,
+                'time': datetime.now().isoformat(),
+                'regions': rows,
+            })
+        except Exception as e:
+            log.error("Error recording region statistics: %s", e)
 
     @classmethod
     def map(cls, loader, time=True):
-        print("Starting map method")
+        log.debug("Starting map method")
+        traceStart = LatencyTracer.now()
         
         matrixFromFid = vtk.vtkMatrix4x4()
         loader.markupsPlaneNode.GetObjectToWorldMatrix(matrixFromFid)
-        print("Retrieved object-to-world matrix from markups plane node")
+        log.debug("Retrieved object-to-world matrix from markups plane node")
         
-        # Record simulation start event
-        cls.record_simulation_event(matrixFromFid, "start")
+        # Record simulation start event, the id pairs it with the end event
+        loader.simulationId = cls.record_simulation_event(matrixFromFid, "start")
+        tracer = LatencyTracer.get()
+        tracer.begin(loader.simulationId, traceStart)
         
         loader.transformNode.SetMatrixTransformToParent(matrixFromFid)
-        print("Set matrix transform to parent")
+        log.debug("Set matrix transform to parent")
         
         loader.transformNode.UpdateScene(slicer.mrmlScene)
-        print("Updated scene with transform node")
+        log.debug("Updated scene with transform node")
 
         # Update matrix text label in Widget:
         matrixText = ""
@@ -231,11 +441,11 @@ class Mapper:
                 matrixText += "{:.3f} ".format(value)
             matrixText += "\n"
         slicer.modules.SlicerTMSWidget.matrixTextLabel.setText(matrixText)
-        print("Updated matrix text label in widget")
+        log.debug("Updated matrix text label in widget")
 
         if time:
             start = timeit.default_timer()
-            print("Started timer for performance measurement")
+            log.debug("Started timer for performance measurement")
 
         # the update transform based on the old transfrom
         # rotate the scalar magnetic field (magnorm)
@@ -255,81 +465,19 @@ class Mapper:
 
         # else:  #predict the E-field and show the scalar E-field
 
-        DataVec = loader.magfieldGTNode.GetTransformFromParent().GetDisplacementGrid()
-        print("Retrieved displacement grid from magnetic field ground truth node")
-        
-        DataVec.SetOrigin(0, 0, 0)
-        DataVec.SetSpacing(1, 1, 1)
-        print("Set origin and spacing for displacement grid")
-
-
-        matrix_current = vtk.vtkMatrix4x4() # current transform of the magnetic vector field
-        matrix_current.Multiply4x4(matrixFromFid, loader.coilDefaultMatrix, matrix_current)
-        print("Computed current transform matrix")
-
-        matrix_current_inv = vtk.vtkMatrix4x4()
-        matrix_current_inv.Invert(matrix_current,matrix_current_inv)
-        print("Computed inverse of current transform matrix")
-        
-        combined_tfm = vtk.vtkMatrix4x4()
-
-        matrix_ref = vtk.vtkMatrix4x4()
-        loader.conductivityNode.GetIJKToRASMatrix(matrix_ref)
-        print("Retrieved IJK to RAS matrix from conductivity node")
-        
-        img_ref = loader.conductivityNode.GetImageData()
-        print("Retrieved image data from conductivity node")
-
-        matrix_ref.Multiply4x4(matrix_current_inv, matrix_ref, combined_tfm)
-        print("Computed combined transformation matrix")
-
-
-        reslice = vtk.vtkImageReslice()
-        reslice.SetInputData(DataVec)
-        reslice.SetInformationInput(img_ref)
-        reslice.SetInterpolationModeToLinear()
-        reslice.SetResliceAxes(combined_tfm)
-        reslice.TransformInputSamplingOff()
-        reslice.Update()
-        DataOut = reslice.GetOutput()
-        print("Completed image reslicing operation")
-
-        xyz = DataOut.GetDimensions()
-        print(f"Resliced data dimensions: {xyz}")
-        
-        # # rotate DataOut vectors
-        DataOut_np = vtk_to_numpy(DataOut.GetPointData().GetScalars())
-        print("Converted VTK data to numpy array")
-        
-        # # transposed of the rotation matrix
-        RotMat_transp = np.array([[matrixFromFid.GetElement(0,0), matrixFromFid.GetElement(1,0),  matrixFromFid.GetElement(2,0)],
-                                   [matrixFromFid.GetElement(0,1), matrixFromFid.GetElement(1,1),  matrixFromFid.GetElement(2,1)],
-                                   [matrixFromFid.GetElement(0,2), matrixFromFid.GetElement(1,2),  matrixFromFid.GetElement(2,2)]])  # FIXED: Changed [0,1] to [0,2] in last row
-        
-        print("Created rotation matrix transpose")
-        
-        # # rotate the vector field
-        DataOut_np_rot = np.matmul(DataOut_np, RotMat_transp)
-        print("Applied rotation to vector field data")
-        
-        # # reshape the numpy array
-        DataOut_np_rot = np.reshape(DataOut_np_rot,(xyz[0], xyz[1], xyz[2], 3))
-        print(f"Reshaped numpy array to shape: {DataOut_np_rot.shape}")
-
-        VTK_array = numpy_to_vtk(DataOut_np_rot.ravel(), deep=True, array_type=vtk.VTK_DOUBLE)
-        print("Converted numpy array back to VTK array")
-        
-        DataOut.GetPointData().SetScalars(VTK_array)
-        DataOut.GetPointData().GetScalars().SetNumberOfComponents(3)
-        print("Set scalar data on output data")
-
-        loader.magfieldNode.SetAndObserveImageData(DataOut)
-        print("Set image data on magnetic field node")
-    
-        ## pub here
-        # Get the transform node that the magfieldNode is nested under
-        loader.magfieldNode.SetAndObserveImageData(DataOut)
-        print("Set image data on magnetic field node")
+        # Persistent reslice pipeline: only the reslice axes change per move
+        if getattr(loader, 'resliceEngine', None) is None:
+            loader.resliceEngine = ResliceEngine(loader)
+        resliceStart = LatencyTracer.now()
+        DataOut = loader.resliceEngine.run(matrixFromFid, loader.coilDefaultMatrix)
+        tracer.span(loader.simulationId, 'reslice', resliceStart, LatencyTracer.now())
+        log.debug("Resliced and rotated vector field, dimensions: %s", DataOut.GetDimensions())
+
+        if loader.magfieldNode.GetImageData() is not DataOut:
+            loader.magfieldNode.SetAndObserveImageData(DataOut)
+            log.debug("Set image data on magnetic field node")
+        else:
+            loader.magfieldNode.Modified()
 
         ## ROS publish
         if loader.pubTransform is not None:
@@ -345,13 +493,18 @@ class Mapper:
                         msg.SetElement(i, j, transformMatrix.GetElement(i, j))
                 
                 loader.pubTransform.Publish(msg)
-                print("Published transform to ROS")
+                log.debug("Published transform to ROS")
             except Exception as e:
-                print(f"Error publishing transform: {e}") 
+                log.error("Error publishing transform: %s", e)
 
         ## IGTL push
+        # The correlation id goes out as IGTL metadata, the server echoes it on the E-field
+        if loader.simulationId:
+            loader.magfieldNode.SetAttribute(LatencyTracer.TRACE_ID, loader.simulationId)
+        pushStart = LatencyTracer.now()
         loader.IGTLNode.PushNode(loader.magfieldNode)
-        print("Pushed magnetic field node to IGTL")
+        tracer.span(loader.simulationId, 'push', pushStart, LatencyTracer.now())
+        log.debug("Pushed magnetic field node to IGTL")
         # transformNodeID = loader.magfieldNode.GetTransformNodeID()
 
         # if not transformNodeID:
@@ -375,113 +528,175 @@ class Mapper:
             stop = timeit.default_timer()
             execution_time = stop - start
             # print("Resampling + Mapping Executed in " + str(execution_time) + " seconds.")
-            print(f"Resampling + Mapping executed in {execution_time} seconds")
+            reslice_time = loader.resliceEngine.resliceTime
+            log.debug("Resampling + Mapping executed in %.4f s (reslice %.4f s, rest %.4f s)",
+                     execution_time, reslice_time, execution_time - reslice_time)
         
         # # Record simulation end event
         # finalMatrix = vtk.vtkMatrix4x4()
         # loader.transformNode.GetMatrixTransformToParent(finalMatrix)
         # cls.record_simulation_event(finalMatrix, "end")
             
-        print("Completed map method")
+        log.debug("Completed map method")
+
+    @staticmethod
+    def volumeGeometryKey(scalarNode):
+        """Dimensions and RAS to IJK matrix; the sampling index is rebuilt when these change"""
+        m = vtk.vtkMatrix4x4()
+        scalarNode.GetRASToIJKMatrix(m)
+        return (scalarNode.GetImageData().GetDimensions(),
+                tuple(round(m.GetElement(i, j), 6) for i in range(3) for j in range(4)))
 
     @staticmethod
-    def mapElectricfieldToMesh(scalarNode, brainNode):
-        print(f"Starting mapElectricfieldToMesh for {brainNode.GetName() if brainNode else 'unknown node'}")
-        print(f"Node type: {brainNode.GetClassName()}")
+    def mapElectricfieldToMesh(scalarNode, brainNode, loader=None):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Starting mapElectricfieldToMesh for %s (%s)", brainNode.GetName(), brainNode.GetClassName())
         
         # Check if this is a fiber bundle node
         if brainNode.GetClassName() == 'vtkMRMLFiberBundleNode':
-            print("Skipping electric field mapping for fiber bundle node - not supported")
+            log.debug("Fiber bundles are mapped by mapElectricfieldToFibers, skipping")
             return
-            
-        # get the scalar range from image scalars
-        rng = scalarNode.GetImageData().GetScalarRange()
-        fMin = rng[0]
-        fMax = rng[1]
-        print(f"Scalar range: [{fMin}, {fMax}]")
-
-        # Transform the model into the volume's IJK space
-        modelTransformerRasToIjk = vtk.vtkTransformFilter()
-        transformRasToIjk = vtk.vtkTransform()
-        m = vtk.vtkMatrix4x4()
-        scalarNode.GetRASToIJKMatrix(m)
-        transformRasToIjk.SetMatrix(m)
-        modelTransformerRasToIjk.SetTransform(transformRasToIjk)
-        
-        # Check if node has GetMeshConnection method (for ModelNodes)
-        if hasattr(brainNode, 'GetMeshConnection'):
-            modelTransformerRasToIjk.SetInputConnection(brainNode.GetMeshConnection())
-        else:
-            print(f"Node {brainNode.GetName()} doesn't have GetMeshConnection method, skipping")
+        if brainNode.GetPolyData() is None:
+            log.warning("Node %s has no mesh, skipping", brainNode.GetName())
             return
-            
-        print("Set up RAS to IJK transformation")
 
-        probe = vtk.vtkProbeFilter()
-        probe.SetSourceData(scalarNode.GetImageData())
-        probe.SetInputConnection(modelTransformerRasToIjk.GetOutputPort())
-        print("Set up probe filter")
-        
-        # transform model back to ras
-        modelTransformerIjkToRas = vtk.vtkTransformFilter()
-        modelTransformerIjkToRas.SetTransform(transformRasToIjk.GetInverse())
-        modelTransformerIjkToRas.SetInputConnection(probe.GetOutputPort())
-        modelTransformerIjkToRas.Update()
-        print("Set up IJK to RAS transformation")
+        # The mesh is static: build the vertex-to-voxel index once per example
+        # and level of detail (and again only if the volume geometry changes),
+        # then gather per frame
+        samplers = getattr(loader, 'meshSamplers', None)
+        if samplers is None:
+            samplers = {}
+            if loader is not None:
+                loader.meshSamplers = samplers
+        polyData = brainNode.GetPolyData()
+        sampler = samplers.get(id(polyData))
+        if (sampler is None or sampler.polyData is not polyData or sampler.brainNode is not brainNode or
+                sampler.geometryKey != Mapper.volumeGeometryKey(scalarNode)):
+            sampler = MeshSampler(scalarNode, brainNode)
+            Mapper.setupScalarDisplay(brainNode)
+            samplers[id(polyData)] = sampler
+        if loader is not None:
+            loader.meshSampler = sampler
+
+        st = timeit.default_timer()
+        sampler.sample(scalarNode)
+        log.debug("Sampled E-field at mesh vertices in %.4f s", timeit.default_timer() - st)
 
-        brainNode.SetAndObserveMesh(modelTransformerIjkToRas.GetOutput())
-        print("Set mesh on brain node")
+        # get the scalar range from image scalars
+        fMin, fMax = scalarNode.GetImageData().GetScalarRange()
+        log.debug("Scalar range: [%g, %g]", fMin, fMax)
+        if brainNode.GetDisplayNode():
+            brainNode.GetDisplayNode().SetScalarRange(fMin, fMax)
+        for listener in Mapper.fieldListeners:
+            listener(brainNode, sampler.values, fMin, fMax)
+
+        log.debug("Completed mapElectricfieldToMesh")
+
+    @staticmethod
+    def mapElectricfieldToFibers(scalarNode, fiberNode, loader=None, roiNode=None):
+        """
+        Colour a fiber bundle by the E-field along its fibers. The loader's own
+        fiber node is ROI-selected (ensureFibers), so only its fibers through
+        loader.roi keep their values unless roiNode says otherwise. The sampling
+        index is kept while the volume geometry and polydata stay, the ROI
+        only changes a per-line mask.
+        """
+        if fiberNode is None or fiberNode.GetPolyData() is None or fiberNode.GetPolyData().GetNumberOfLines() == 0:
+            log.debug("No fibers to map the electric field to")
+            return
+
+        if roiNode is None and loader is not None and fiberNode is getattr(loader, 'fiberNode', None):
+            roiNode = getattr(loader, 'roi', None)
+
+        samplers = getattr(loader, 'fiberSamplers', None)
+        if samplers is None:
+            samplers = {}
+            if loader is not None:
+                loader.fiberSamplers = samplers
+        sampler = samplers.get(fiberNode.GetID())
+        if (sampler is None or sampler.brainNode.GetPolyData() is not fiberNode.GetPolyData() or
+                sampler.geometryKey != Mapper.volumeGeometryKey(scalarNode)):
+            sampler = FiberSampler(scalarNode, fiberNode)
+            samplers[fiberNode.GetID()] = sampler
+            for i in range(fiberNode.GetNumberOfDisplayNodes()):
+                displayNode = fiberNode.GetNthDisplayNode(i)
+                if displayNode:
+                    displayNode.SetActiveScalarName(FiberSampler.SCALAR_NAME)
+                    displayNode.SetColorMode(displayNode.colorModeScalarData)
+                    displayNode.ScalarVisibilityOn()
+
+        st = timeit.default_timer()
+        fMin, fMax = sampler.sample(scalarNode, FiberSampler.roiBounds(roiNode))
+        log.debug("Sampled E-field along %d fibers in %.4f s", len(sampler.lineIds), timeit.default_timer() - st)
+        for i in range(fiberNode.GetNumberOfDisplayNodes()):
+            displayNode = fiberNode.GetNthDisplayNode(i)
+            if displayNode:
+                displayNode.SetScalarRange(fMin, fMax)
 
-        probedPointScalars = probe.GetOutput().GetPointData().GetScalars()
-        print("Retrieved probed point scalars")
+    @staticmethod
+    def computeRegionStatistics(scalarNode, loader):
+        """Per-region E-field statistics into the EFieldRegionStats table and the journal"""
+        labelNode = getattr(loader, 'labelNode', None)
+        roiNode = getattr(loader, 'roi', None)
+        if labelNode is None and roiNode is None:
+            return None
+
+        key = Mapper.volumeGeometryKey(scalarNode)
+        regionStats = getattr(loader, 'regionStats', None)
+        if regionStats is None or regionStats.geometryKey != key:
+            st = timeit.default_timer()
+            regionStats = RegionStats(scalarNode, labelNode, roiNode, loader.conductivityNode, key)
+            loader.regionStats = regionStats
+            log.info("Built region index in %.3f s", timeit.default_timer() - st)
+
+        st = timeit.default_timer()
+        rows = regionStats.compute(scalarNode)
+        regionStats.updateTable(rows)
+        log.debug("Region statistics for %d regions in %.4f s", len(rows), timeit.default_timer() - st)
+        Mapper.record_region_statistics(rows, getattr(loader, 'simulationId', None))
+        return rows
 
-        normals = vtk.vtkPolyDataNormals()
-        normals.SetInputConnection(probe.GetOutputPort())
-        print("Set up poly data normals")
+    @staticmethod
+    def setupFiberDisplay(fiberNode):
+        """Scalar colouring of a fiber bundle, lines only"""
+        if fiberNode is None or not fiberNode.IsA('vtkMRMLFiberBundleNode') or fiberNode.GetDisplayNode() is None:
+            return
+        fiberNode.GetDisplayNode().SetColorMode(fiberNode.GetDisplayNode().colorModeScalarData)
+        colorNode = slicer.mrmlScene.GetFirstNodeByName('ColdToHotRainbow')
+        if colorNode:
+            fiberNode.GetDisplayNode().SetAndObserveColorNodeID(colorNode.GetID())
+        # We only want to see the lines of the fibers first, not the tubes:
+        if fiberNode.GetTubeDisplayNode():
+            fiberNode.GetTubeDisplayNode().SetVisibility(False)
+        log.debug("Configured %s node display settings", fiberNode.GetName())
 
+    @staticmethod
+    def setupScalarDisplay(brainNode):
+        """Scalar colouring of the mesh and fibers, done once when the sampler is built"""
         # activate scalars - only if node has a display node
         if brainNode.GetDisplayNode():
-            brainNode.GetDisplayNode().SetActiveScalarName('ImageScalars')
-            print("Activated scalars on brain display node")
+            brainNode.GetDisplayNode().SetActiveScalarName(MeshSampler.SCALAR_NAME)
+            log.debug("Activated scalars on brain display node")
         else:
-            print("No display node found for brain node")
+            log.warning("No display node found for brain node")
         
-        ### if fiber bundle, then scalars need to be set different:
-        fibers = slicer.util.getNode('fibers')
-        if fibers:
-            fibers.GetDisplayNode().SetColorMode(fibers.GetDisplayNode().colorModeScalarData)
-            fibers.GetDisplayNode().SetAndObserveColorNodeID(slicer.util.getNode('ColdToHotRainbow').GetID())
-            # We only want to see the lines of the fibers first, not the tubes:
-            fibers.GetTubeDisplayNode().SetVisibility(False)
-            print("Configured fibers node display settings")
-        else:
-            print("Fibers node 'fibers' not found")
-
-        ### Same for the downsampled fibers:
-        fibers1 = slicer.util.getNode('FiberBundle')
-        if fibers1:
-            fibers1.GetDisplayNode().SetColorMode(fibers1.GetDisplayNode().colorModeScalarData)
-            fibers1.GetDisplayNode().SetAndObserveColorNodeID(slicer.util.getNode('ColdToHotRainbow').GetID())
-            # We only want to see the lines of the fibers first, not the tubes:
-            fibers1.GetTubeDisplayNode().SetVisibility(False)
-            print("Configured FiberBundle node display settings")
-        else:
-            print("FiberBundle node not found")
+        ### if fiber bundle, then scalars need to be set different (fibers are loaded lazily, maybe not yet):
+        for name in ('fibers', 'FiberBundle'):
+            Mapper.setupFiberDisplay(slicer.mrmlScene.GetFirstNodeByName(name))
 
         # select color scheme for scalars
         colorNode = slicer.util.getNode('ColdToHotRainbow')
         if colorNode and brainNode.GetDisplayNode():
             brainNode.GetDisplayNode().SetAndObserveColorNodeID(colorNode.GetID())
-            print("Set color node for brain scalars")
+            log.debug("Set color node for brain scalars")
         else:
-            print("ColdToHotRainbow color node not found or no display node")
+            log.warning("ColdToHotRainbow color node not found or no display node")
             
         if brainNode.GetDisplayNode():
             brainNode.GetDisplayNode().ScalarVisibilityOn()
-            brainNode.GetDisplayNode().SetScalarRange(fMin, fMax)
-            print("Enabled scalar visibility and set scalar range")
+            log.debug("Enabled scalar visibility")
         else:
-            print("No display node to set scalar properties")
+            log.debug("No display node to set scalar properties")
 
         # color legend for brain scalars:
         if brainNode.GetDisplayNode():
@@ -489,70 +704,72 @@ class Mapper:
                 colorLegendDisplayNode = slicer.modules.colors.logic().AddDefaultColorLegendDisplayNode(brainNode)
                 colorLegendDisplayNode.SetTitleText("EVec")
                 colorLegendDisplayNode.SetLabelFormat("%7.8f")
-                print("Added color legend display node")
+                log.debug("Added color legend display node")
             except Exception as e:
-                print(f"Could not add color legend: {e}")
+                log.warning("Could not add color legend: %s", e)
         else:
-            print("No display node for color legend")
-
-        print(f"Completed mapElectricfieldToMesh for {brainNode.GetName() if brainNode else 'unknown node'}")
-
-
+            log.debug("No display node for color legend")
 
     @staticmethod
     def modifyIncomingImage(loader):
-        print("Starting modifyIncomingImage method")
+        log.debug("Starting modifyIncomingImage method")
         
         matrix_ref = vtk.vtkMatrix4x4()
         loader.conductivityNode.GetIJKToRASMatrix(matrix_ref)
-        print("Retrieved IJK to RAS matrix from conductivity node")
+        log.debug("Retrieved IJK to RAS matrix from conductivity node")
         
         loader.pyigtlNode.ApplyTransformMatrix(matrix_ref)
-        print("Applied transform matrix to pyigtl node")
+        log.debug("Applied transform matrix to pyigtl node")
+
+        # The server echoes the id of the coil pose it computed, without it the latest map is assumed
+        server = getattr(loader, 'traceServer', None)
+        traceId = server['id'] if server else getattr(loader, 'simulationId', None)
+        tracer = LatencyTracer.get()
 
         # this part will need to be done with the resampling (it only maps the incoming pyigtl image to the brain):
-        Mapper.mapElectricfieldToMesh(loader.pyigtlNode, loader.modelNode)
-        print("Mapped electric field to model node")
+        meshStart = LatencyTracer.now()
+        Mapper.mapElectricfieldToMesh(loader.pyigtlNode, loader.modelNode, loader)
+        log.debug("Mapped electric field to model node")
         
-        # Skip mapping to fiber node or handle differently
-        # Mapper.mapElectricfieldToMesh(loader.pyigtlNode, loader.fiberNode)
-        print("Skipping electric field mapping to fiber node - not supported for fiber bundle nodes")
+        # E-field along the fibers: the full bundle and, if it has its own
+        # polydata, the downsampled/ROI-selected FiberBundle
+        mapped = set()
+        for fiberNode in (loader.fiberNode, slicer.mrmlScene.GetFirstNodeByName('FiberBundle')):
+            if (fiberNode is None or not fiberNode.IsA('vtkMRMLFiberBundleNode') or
+                    fiberNode.GetPolyData() is None or id(fiberNode.GetPolyData()) in mapped):
+                continue
+            mapped.add(id(fiberNode.GetPolyData()))
+            Mapper.mapElectricfieldToFibers(loader.pyigtlNode, fiberNode, loader)
+        tracer.span(traceId, 'mesh mapping', meshStart, LatencyTracer.now())
 
         # Jump to maximum point of E field
         try:
-            pyigtl_data_image = sitkUtils.PullVolumeFromSlicer(loader.pyigtlNode)
-            print("Pulled volume from Slicer to SimpleITK image")
-            
-            pyigtl_data_array = sitk.GetArrayFromImage(pyigtl_data_image)
-            print("Converted SimpleITK image to numpy array")
-
-            max_idx = np.squeeze(np.where(pyigtl_data_array==pyigtl_data_array.max()))
-            print(f"Found maximum value at index: {max_idx}")
-            
-            max_point = pyigtl_data_image.TransformIndexToPhysicalPoint([int(max_idx[2]), int(max_idx[1]), int(max_idx[0])])
-            print(f"Maximum point in physical coordinates: {max_point}")
-            
-            max_point = np.array([-max_point[0], -max_point[1], max_point[2]]) #IJK to RAS
-            print(f"Maximum point converted to RAS: {max_point}")
+            loader.hotspotStats = Hotspot.analyze(loader.pyigtlNode)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Hotspot: %s", Hotspot.summary(loader.hotspotStats))
 
+            max_point = loader.hotspotStats['peaks'][0]['ras']
             slicer.vtkMRMLSliceNode.JumpAllSlices(slicer.mrmlScene, *max_point[0:3])
-            print("Jumped all slices to maximum point")
+            log.debug("Jumped all slices to maximum point")
         except Exception as e:
-            print(f"Error jumping to max point: {e}")
+            log.error("Error jumping to max point: %s", e)
         
-        # print("Completed modifyIncomingImage method")
         try:
-            pyigtl_data_image = sitkUtils.PullVolumeFromSlicer(loader.pyigtlNode)
-            # ... existing code ...
-            
-            slicer.vtkMRMLSliceNode.JumpAllSlices(slicer.mrmlScene, *max_point[0:3])
-            print("Jumped all slices to maximum point")
+            Mapper.computeRegionStatistics(loader.pyigtlNode, loader)
         except Exception as e:
-            print(f"Error jumping to max point: {e}")
-        
+            log.error("Error computing region statistics: %s", e)
+
         # Record simulation end event HERE - after full processing is complete
         finalMatrix = vtk.vtkMatrix4x4()
         loader.transformNode.GetMatrixTransformToParent(finalMatrix)
-        Mapper.record_simulation_event(finalMatrix, "end")
+        Mapper.record_simulation_event(finalMatrix, "end", event_id=traceId)
+
+        tracer.end(traceId, received=getattr(loader, 'traceReceived', None),
+                   reassembled=getattr(loader, 'traceReassembled', None), server=server)
+        loader.traceServer = loader.traceReceived = loader.traceReassembled = None
+        try:
+            slicer.modules.SlicerTMSWidget.latencyTextLabel.setText(tracer.summary())
+        except AttributeError:
+            pass
         
-        print("Completed modifyIncomingImage method")
\ No newline at end of file
+        log.debug("Completed modifyIncomingImage method")
\ No newline at end of file
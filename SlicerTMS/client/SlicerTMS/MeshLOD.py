@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import tempfile
+import vtk
+from Assets import AssetReader
+
+log = logging.getLogger(__name__)
+
+
+class MeshLOD:
+    """
+    Coarse stand-ins for the gm and skin surfaces while the coil is dragged.
+    The decimated meshes are made on the asset threads (vtkQuadricDecimation)
+    and cached on disk as .vtp, keyed by the SHA-1 of the source mesh and the
+    reduction, so only the first load of a subject pays for them. While the
+    coarse level is active the model nodes show, and Mapper probes, the
+    decimated polydata; switching back restores the full polydata, which
+    keeps its own sampling index and scalars.
+    """
+
+    REDUCTION = 0.9  # fraction of the triangles removed for the coarse level
+    CACHE_VERSION = 1  # bump when the decimation changes
+
+    def __init__(self):
+        self.levels = []  # (model node, full polydata, coarse polydata)
+        self.coarse = False
+
+    @staticmethod
+    def cachePath(path, reduction=REDUCTION):
+        directory = os.environ.get('TMS_MESH_CACHE', os.path.join(tempfile.gettempdir(), 'slicertms_mesh_cache'))
+        key = hashlib.sha1(f"{AssetReader.fileHash(path)} v{MeshLOD.CACHE_VERSION} r={reduction}".encode()).hexdigest()
+        return os.path.join(directory, key + '.vtp')
+
+    @staticmethod
+    def decimate(polyData, reduction=REDUCTION):
+        triangles = vtk.vtkTriangleFilter()
+        triangles.SetInputData(polyData)
+        decimation = vtk.vtkQuadricDecimation()
+        decimation.SetInputConnection(triangles.GetOutputPort())
+        decimation.SetTargetReduction(reduction)
+        decimation.VolumePreservationOn()
+        decimation.Update()
+        coarse = vtk.vtkPolyData()
+        coarse.ShallowCopy(decimation.GetOutput())
+        return coarse
+
+    @staticmethod
+    def readCoarse(path, reduction=REDUCTION):
+        """Decimated mesh of a surface file, from the cache when possible (asset thread)"""
+        cachePath = MeshLOD.cachePath(path, reduction)
+        if os.path.isfile(cachePath):
+            coarse = AssetReader.readPolyData(cachePath)
+            if coarse.GetNumberOfPoints():
+                return coarse
+            log.warning("Ignoring empty mesh cache %s", cachePath)
+
+        full = AssetReader.readPolyData(path)
+        coarse = MeshLOD.decimate(full, reduction)
+        log.info("Decimated %s from %d to %d triangles", os.path.basename(path),
+                 full.GetNumberOfPolys(), coarse.GetNumberOfPolys())
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            partial = cachePath + f'.{os.getpid()}.tmp'
+            writer = vtk.vtkXMLPolyDataWriter()
+            writer.SetFileName(partial)
+            writer.SetInputData(coarse)
+            writer.SetDataModeToAppended()
+            writer.SetCompressorTypeToZLib()
+            if writer.Write():
+                os.replace(partial, cachePath)
+        except OSError as e:
+            log.warning("Could not write mesh cache %s: %s", cachePath, e)
+        return coarse
+
+    def add(self, node, coarse):
+        """Give a model node a coarse level; its current polydata is the full one"""
+        if node is None or coarse is None or node.GetPolyData() is None:
+            return
+        self.levels.append((node, node.GetPolyData(), coarse))
+        if self.coarse:
+            node.SetAndObservePolyData(coarse)
+
+    def clear(self):
+        """Back to the full meshes and forget the levels, e.g. before swapping in another example"""
+        self.setCoarse(False)
+        self.levels = []
+
+    def setCoarse(self, coarse):
+        if coarse == self.coarse:
+            return
+        self.coarse = coarse
+        for node, full, decimated in self.levels:
+            if node.GetScene() is not None:
+                node.SetAndObservePolyData(decimated if coarse else full)
+        log.debug("Meshes at %s resolution", 'coarse' if coarse else 'full')
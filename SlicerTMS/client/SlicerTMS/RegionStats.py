@@ -0,0 +1,201 @@
+import logging
+import numpy as np
+import slicer
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+from Hotspot import Hotspot
+
+log = logging.getLogger(__name__)
+
+
+class RegionStats:
+    """
+    Per-region E-field statistics (voxels, mean, max, percentiles).
+    The voxel index lists are built once per example, sorted by region so each
+    region is one contiguous segment:
+      - one region per label of a label map (resampled nearest-neighbour onto
+        the E-field grid if the geometry differs)
+      - the ROI node's box, restricted to head tissue; rebuilt only when the
+        ROI moves
+    Every new E-field is gathered once with np.take and reduced per segment
+    with np.add.reduceat / np.maximum.reduceat; all percentiles come from a
+    single sort with the segment id as the major key.
+    """
+
+    PERCENTILES = Hotspot.PERCENTILES
+    TABLE_NAME = 'EFieldRegionStats'
+    COLUMNS = ['Region', 'Label', 'Voxels', 'Mean', 'Max'] + [f'P{p}' for p in PERCENTILES]
+    ROI_LABEL = -1
+
+    def __init__(self, scalarNode, labelNode=None, roiNode=None, maskNode=None, geometryKey=None):
+        self.geometryKey = geometryKey
+        self.roiNode = roiNode
+        self.tableNode = None
+
+        dims = scalarNode.GetImageData().GetDimensions()
+        self.shape = (dims[2], dims[1], dims[0])  # kji, the flat order of the voxel array
+        rasToIjk = vtk.vtkMatrix4x4()
+        scalarNode.GetRASToIJKMatrix(rasToIjk)
+        self.rasToIjk = slicer.util.arrayFromVTKMatrix(rasToIjk)
+        ijkToRas = vtk.vtkMatrix4x4()
+        scalarNode.GetIJKToRASMatrix(ijkToRas)
+        self.ijkToRas = slicer.util.arrayFromVTKMatrix(ijkToRas)
+
+        self.tissue = None
+        if maskNode is not None:
+            mask = slicer.util.arrayFromVolume(maskNode)
+            if mask.shape == self.shape:
+                self.tissue = mask.reshape(-1) != 0
+
+        self.labelSegments = None
+        if labelNode is not None:
+            self.labelSegments = self.buildLabelSegments(labelNode)
+        self.roiBounds = None
+        self.roiSegments = None
+        self.updateROI()
+
+    @staticmethod
+    def segments(order, labels, names):
+        """Index list sorted by region plus per-region starts/counts"""
+        unique, counts = np.unique(labels, return_counts=True)
+        return {
+            'order': order,
+            'labels': unique,
+            'names': names,
+            'counts': counts,
+            'starts': np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64),
+            'segmentIds': np.repeat(np.arange(len(counts)), counts),
+        }
+
+    def labelsOnGrid(self, labelNode):
+        """Label of every E-field voxel, flat in kji order"""
+        labels = slicer.util.arrayFromVolume(labelNode)
+        labelToRas = vtk.vtkMatrix4x4()
+        labelNode.GetIJKToRASMatrix(labelToRas)
+        labelToRas = slicer.util.arrayFromVTKMatrix(labelToRas)
+        if labels.shape == self.shape and np.allclose(labelToRas, self.ijkToRas):
+            return labels.reshape(-1)
+
+        # nearest neighbour, one k slice at a time to bound the memory
+        log.info("Label map geometry differs from the E-field, resampling nearest neighbour")
+        rasToLabel = np.linalg.inv(labelToRas)
+        gridToLabel = rasToLabel @ self.ijkToRas
+        out = np.zeros(self.shape, dtype=labels.dtype)
+        jj, ii = np.meshgrid(np.arange(self.shape[1]), np.arange(self.shape[2]), indexing='ij')
+        for k in range(self.shape[0]):
+            ijk = np.stack([ii.ravel(), jj.ravel(), np.full(ii.size, k), np.ones(ii.size)])
+            lijk = np.rint(gridToLabel @ ijk)[:3].astype(np.int64)
+            inside = np.all((lijk >= 0) & (lijk < np.array(labels.shape[::-1])[:, None]), axis=0)
+            slab = out[k].reshape(-1)
+            slab[inside] = labels[lijk[2, inside], lijk[1, inside], lijk[0, inside]]
+        return out.reshape(-1)
+
+    def buildLabelSegments(self, labelNode):
+        labels = self.labelsOnGrid(labelNode)
+        voxels = np.flatnonzero(labels)
+        if self.tissue is not None:
+            voxels = voxels[self.tissue[voxels]]
+        order = voxels[np.argsort(labels[voxels], kind='stable')]
+        regionLabels = labels[order]
+
+        colorNode = labelNode.GetDisplayNode().GetColorNode() if labelNode.GetDisplayNode() else None
+        names = []
+        for label in np.unique(regionLabels):
+            name = colorNode.GetColorName(int(label)) if colorNode else ''
+            names.append(name if name and name != '(none)' else f'Label {label}')
+        log.info("Region statistics: %d labels, %d voxels", len(names), len(order))
+        return RegionStats.segments(order, regionLabels, names)
+
+    def updateROI(self):
+        """Rebuild the ROI's voxel list if the ROI has moved; cheap when it has not"""
+        if self.roiNode is None:
+            return
+        bounds = [0.0] * 6
+        self.roiNode.GetRASBounds(bounds)
+        if self.roiBounds == bounds:
+            return
+        self.roiBounds = bounds
+
+        lo, hi = np.array(bounds[0::2]), np.array(bounds[1::2])
+        corners = np.array([[x, y, z, 1.0] for x in bounds[0:2] for y in bounds[2:4] for z in bounds[4:6]]).T
+        cornersIjk = (self.rasToIjk @ corners)[:3]
+        size = np.array(self.shape[::-1])
+        ijkMin = np.clip(np.floor(cornersIjk.min(axis=1)).astype(int), 0, size - 1)
+        ijkMax = np.clip(np.ceil(cornersIjk.max(axis=1)).astype(int), 0, size - 1)
+        kk, jj, ii = np.meshgrid(*[np.arange(ijkMin[a], ijkMax[a] + 1) for a in (2, 1, 0)], indexing='ij')
+        ijk = np.stack([ii.ravel(), jj.ravel(), kk.ravel(), np.ones(ii.size)])
+        ras = (self.ijkToRas @ ijk)[:3]
+        inside = np.all((ras >= lo[:, None]) & (ras <= hi[:, None]), axis=0)
+        voxels = np.ravel_multi_index((kk.ravel()[inside], jj.ravel()[inside], ii.ravel()[inside]), self.shape)
+        if self.tissue is not None:
+            voxels = voxels[self.tissue[voxels]]
+        self.roiSegments = RegionStats.segments(voxels, np.full(len(voxels), RegionStats.ROI_LABEL), ['ROI'])
+
+    @staticmethod
+    def reduce(flat, segments, percentiles):
+        """Voxels, mean, max and percentiles of every segment, vectorised"""
+        counts = segments['counts']
+        if not len(counts) or not counts.sum():
+            return None
+        starts = segments['starts']
+        values = np.take(flat, segments['order']).astype(np.float64)
+        stats = {
+            'voxels': counts,
+            'mean': np.add.reduceat(values, starts) / counts,
+            'max': np.maximum.reduceat(values, starts),
+        }
+        # one sort for all regions: shift each segment above the previous one
+        low = values.min()
+        span = values.max() - low + 1.0
+        offset = segments['segmentIds'] * span
+        ranked = np.sort(values - low + offset) - offset + low
+        for p in percentiles:
+            position = starts + (p / 100.0) * (counts - 1)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, starts + counts - 1)
+            fraction = position - below
+            stats[f'p{p}'] = ranked[below] * (1.0 - fraction) + ranked[above] * fraction
+        return stats
+
+    def compute(self, scalarNode):
+        """Statistics of the current frame as a list of dicts, one per region"""
+        self.updateROI()
+        flat = vtk_to_numpy(scalarNode.GetImageData().GetPointData().GetScalars()).reshape(-1)
+        rows = []
+        for segments in (self.labelSegments, self.roiSegments):
+            if segments is None:
+                continue
+            stats = RegionStats.reduce(flat, segments, self.PERCENTILES)
+            if stats is None:
+                continue
+            for n, label in enumerate(segments['labels']):
+                row = {'name': segments['names'][n], 'label': int(label)}
+                for key, values in stats.items():
+                    row[key] = int(values[n]) if key == 'voxels' else float(values[n])
+                rows.append(row)
+        return rows
+
+    def updateTable(self, rows):
+        """Show the rows in the EFieldRegionStats table node, created on first use"""
+        if self.tableNode is None or slicer.mrmlScene.GetNodeByID(self.tableNode.GetID()) is None:
+            self.tableNode = slicer.mrmlScene.GetFirstNodeByName(RegionStats.TABLE_NAME)
+            if self.tableNode is None:
+                self.tableNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTableNode', RegionStats.TABLE_NAME)
+        table = self.tableNode.GetTable()
+        if table.GetNumberOfColumns() != len(RegionStats.COLUMNS):
+            table.Initialize()
+            for name in RegionStats.COLUMNS:
+                column = vtk.vtkStringArray() if name == 'Region' else vtk.vtkDoubleArray()
+                column.SetName(name)
+                table.AddColumn(column)
+        table.SetNumberOfRows(len(rows))
+
+        names = table.GetColumnByName('Region')
+        for r, row in enumerate(rows):
+            names.SetValue(r, row['name'])
+        keys = {'Label': 'label', 'Voxels': 'voxels', 'Mean': 'mean', 'Max': 'max'}
+        keys.update({f'P{p}': f'p{p}' for p in self.PERCENTILES})
+        for column, key in keys.items():
+            vtk_to_numpy(table.GetColumnByName(column))[:] = [row[key] for row in rows]
+        table.Modified()
+        self.tableNode.Modified()
@@ -0,0 +1,119 @@
+import logging
+import timeit
+import numpy as np
+import qt
+
+log = logging.getLogger(__name__)
+
+
+class UpdateScheduler:
+    """
+    Coalesces coil-move events before they reach Mapper.map.
+    Dragging the coil fires PointModifiedEvent/TransformModifiedEvent many
+    times per second; each request only (re)arms a single-shot timer, and
+    when it fires the latest pose is mapped once. Updates are limited to
+    maxRate per second and skipped while the pose stays inside the
+    translation/rotation deadband of the last mapped pose.
+    The first request of a drag calls startFunction; settleFunction is
+    called once no request has come for SETTLE_TIME (the drag is over).
+    """
+
+    MAX_RATE = 15.0  # mapped updates per second
+    TRANSLATION_DEADBAND = 0.5  # mm
+    ROTATION_DEADBAND = 0.5  # degrees
+    SETTLE_TIME = 0.3  # s without coil events before the interaction counts as over
+
+    def __init__(self, poseFunction, updateFunction, maxRate=None, translationDeadband=None, rotationDeadband=None,
+                 startFunction=None, settleFunction=None):
+        self.poseFunction = poseFunction  # returns the current pose as a 4x4 numpy array
+        self.updateFunction = updateFunction
+        self.maxRate = maxRate or UpdateScheduler.MAX_RATE
+        self.translationDeadband = UpdateScheduler.TRANSLATION_DEADBAND if translationDeadband is None else translationDeadband
+        self.rotationDeadband = UpdateScheduler.ROTATION_DEADBAND if rotationDeadband is None else rotationDeadband
+
+        self.timer = qt.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.connect('timeout()', self.flush)
+
+        self.startFunction = startFunction
+        self.settleFunction = settleFunction
+        self.interacting = False
+        self.settleTimer = qt.QTimer()
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(int(UpdateScheduler.SETTLE_TIME * 1000))
+        self.settleTimer.connect('timeout()', self.settle)
+
+        self.lastPose = None
+        self.lastUpdate = None
+        self.resetStats()
+
+    def resetStats(self):
+        self.requested = 0  # events received from the observers
+        self.coalesced = 0  # events folded into an already scheduled update
+        self.skipped = 0  # scheduled updates dropped by the deadband
+        self.processed = 0  # updates that reached Mapper.map
+
+    def request(self, caller=None, event=None):
+        """Observer callback: schedule an update, or fold into the pending one"""
+        self.requested += 1
+        self.settleTimer.start()
+        if not self.interacting:
+            self.interacting = True
+            if self.startFunction is not None:
+                self.startFunction()
+        if self.timer.isActive():
+            self.coalesced += 1
+            return
+        wait = 0.0
+        if self.lastUpdate is not None:
+            wait = max(0.0, 1.0 / self.maxRate - (timeit.default_timer() - self.lastUpdate))
+        # Even with no wait the timer fires from the event loop, after the rest of the burst
+        self.timer.start(int(wait * 1000))
+
+    def settle(self):
+        """Settle timer callback: the coil has stopped moving"""
+        self.interacting = False
+        if self.settleFunction is not None:
+            self.settleFunction()
+
+    def stop(self):
+        self.timer.stop()
+        self.settleTimer.stop()
+        self.interacting = False
+
+    def withinDeadband(self, pose):
+        if self.lastPose is None:
+            return False
+        translation = np.linalg.norm(pose[:3, 3] - self.lastPose[:3, 3])
+        # Plane axes may be scaled, compare the normalised rotations
+        rot = pose[:3, :3] / np.linalg.norm(pose[:3, :3], axis=0)
+        lastRot = self.lastPose[:3, :3] / np.linalg.norm(self.lastPose[:3, :3], axis=0)
+        cosAngle = np.clip((np.trace(lastRot.T @ rot) - 1.0) / 2.0, -1.0, 1.0)
+        angle = np.degrees(np.arccos(cosAngle))
+        return translation < self.translationDeadband and angle < self.rotationDeadband
+
+    def flush(self):
+        """Timer callback: map the latest pose unless it is inside the deadband"""
+        pose = self.poseFunction()
+        if self.withinDeadband(pose):
+            self.skipped += 1
+            return
+        self.updateNow(pose)
+
+    def updateNow(self, pose=None):
+        """Map immediately, e.g. for the first update after loading"""
+        self.timer.stop()
+        self.lastPose = self.poseFunction() if pose is None else pose
+        self.lastUpdate = timeit.default_timer()
+        self.processed += 1
+        self.updateFunction()
+        if log.isEnabledFor(logging.DEBUG) and (self.coalesced or self.skipped):
+            log.debug("Coil updates: %s", self.stats())
+
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'processed': self.processed,
+        }
@@ -3,9 +3,19 @@ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import sys
 import Loader as L
+import Mapper as M
 import SlicerWebServer as W
 from tms_env import get_tms_value
+from tms_log import setup_logging
 import traceback
+import asyncio
+import threading
+import time
+import numpy as np
+from tornado.websocket import websocket_connect
+from slicerserver.server import Server
+
+setup_logging()
 
 DEBUG = True
 
@@ -210,7 +220,8 @@ class SlicerTMSWidget(ScriptedLoadableModuleWidget):
             if hasattr(L, 'Loader'):
                 debug_print(f"✓ Loader class found in module")
                 debug_print(f"  Loader class type: {type(L.Loader)}")
-                self.loader = L.Loader.loadExample(example_path)
+                # the previous example is reused in place, or unloaded first
+                self.loader = L.Loader.switchExample(example_path, getattr(self, 'loader', None))
             else:
                 debug_print(f"✗ ERROR: Loader class NOT found in module!")
                 debug_print(f"  Available attributes: {[x for x in dir(L) if not x.startswith('_')]}")
@@ -321,6 +332,11 @@ class SlicerTMSWidget(ScriptedLoadableModuleWidget):
             self.matrixTextLabel = qt.QLabel("", self.collapsibleButton3)
             self.layout.addWidget(self.matrixTextLabel)
             debug_print("  Matrix display labels created")
+            # Rolling coil-move to E-field latency per hop (Tracer.LatencyTracer)
+            self.latencyLabel = qt.QLabel("Latency: ", self.collapsibleButton3)
+            self.layout.addWidget(self.latencyLabel)
+            self.latencyTextLabel = qt.QLabel("", self.collapsibleButton3)
+            self.layout.addWidget(self.latencyTextLabel)
 
             self.initialScalarArray = None
             self.layout.addStretch(1)
@@ -390,4 +406,218 @@ class SlicerTMSWidget(ScriptedLoadableModuleWidget):
             self.log.insertPlainText('\n')
             self.log.ensureCursorVisible()
             self.log.repaint()
-            debug_print("  Log updated in GUI")
\ No newline at end of file
+            debug_print("  Log updated in GUI")
+
+
+class SlicerTMSTest(ScriptedLoadableModuleTest):
+    """
+    Scene growth across example switches: after 20 switches, alternately in
+    place (Loader.reuse) and through unload + loadExample, the scene must
+    hold as many nodes as after the first two, the markups plane, pyigtl_data
+    and navigation transform as many observers, every coil event must reach
+    one scheduler only, and the resident memory must not grow by anything
+    like a loaded example. Needs an example with a gm mesh under TMS_DATA_DIR.
+
+    Web server loops: for both loop modes of slicerserver.Server, the CPU
+    used while idle and the latency from a websocket pose being sent to the
+    tracker transform changing in the scene.
+
+    Mapper logging: Mapper.map timed with the TMS loggers at DEBUG (every
+    per-step line goes to the console) and at WARNING.
+    """
+
+    SWITCHES = 20
+    IDLE_TIME = 3.0  # s
+    POSES = 300
+    POSE_RATE = 60.0  # poses per second from the websocket client
+    MAPS = 50
+
+    def setUp(self):
+        slicer.mrmlScene.Clear()
+
+    def runTest(self):
+        self.setUp()
+        self.test_ExampleSwitching()
+        self.setUp()
+        self.test_WebServerLoop()
+        self.setUp()
+        self.test_MapperLogging()
+
+    @staticmethod
+    def residentMemory():
+        """Resident set size in bytes, None without /proc"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def examples():
+        data_dir = get_tms_value('TMS_DATA_DIR', '../data')
+        if not os.path.isdir(L.Loader.exampleDirectory(data_dir)):
+            return []
+        names = sorted(os.listdir(L.Loader.exampleDirectory(data_dir)))
+        paths = [os.path.join(data_dir, name) for name in names]
+        return [path for path in paths if L.Loader.graymatterFile(L.Loader.exampleDirectory(path))]
+
+    @staticmethod
+    def observerCount(node):
+        """Observers on a VTK object now: probe the next tag, then look up every tag below it"""
+        if node is None:
+            return 0
+        probe = node.AddObserver(vtk.vtkCommand.UserEvent, lambda caller, event: None)
+        node.RemoveObserver(probe)
+        return sum(1 for tag in range(probe) if node.GetCommand(tag) is not None)
+
+    def observerCounts(self, loader):
+        """Observers on the nodes the loader listens to: markups plane, pyigtl_data, navigation transform"""
+        return {name: self.observerCount(getattr(loader, name, None))
+                for name in ('markupsPlaneNode', 'pyigtlNode', 'transformNavigationNode')}
+
+    def switch(self, loader, example, inPlace):
+        if inPlace:
+            loader = L.Loader.switchExample(example, loader)
+        else:
+            if loader is not None:
+                loader.unload()
+            loader = L.Loader.loadExample(example)
+        loader.loadDeferred()  # no server here, so no first E-field to trigger it
+        slicer.app.processEvents()
+        return loader
+
+    def test_ExampleSwitching(self):
+        examples = self.examples()
+        if not examples:
+            self.delayDisplay("No example with a gm mesh under TMS_DATA_DIR, test skipped")
+            return
+        self.delayDisplay(f"Switching {self.SWITCHES} times between {len(examples)} example(s)")
+
+        start = self.residentMemory()
+        loader = self.switch(None, examples[0], inPlace=False)
+        exampleMemory = self.residentMemory() - start if start is not None else None
+        loader = self.switch(loader, examples[1 % len(examples)], inPlace=True)
+        nodes = slicer.mrmlScene.GetNumberOfNodes()
+        observers = self.observerCounts(loader)
+        baseline = self.residentMemory()
+
+        schedulers = [loader.mapScheduler]
+        for i in range(2, self.SWITCHES):
+            loader = self.switch(loader, examples[i % len(examples)], inPlace=i % 2 == 1)
+            self.assertEqual(slicer.mrmlScene.GetNumberOfNodes(), nodes, f"scene grew at switch {i + 1}")
+            self.assertEqual(self.observerCounts(loader), observers, f"observers piled up at switch {i + 1}")
+            if loader.mapScheduler not in schedulers:
+                schedulers.append(loader.mapScheduler)
+
+        # one coil event reaches the current scheduler once and no unloaded one
+        requested = [scheduler.requested for scheduler in schedulers]
+        loader.markupsPlaneNode.InvokeEvent(slicer.vtkMRMLMarkupsNode.PointModifiedEvent)
+        for scheduler, before in zip(schedulers, requested):
+            self.assertEqual(scheduler.requested - before, 1 if scheduler is loader.mapScheduler else 0)
+
+        if baseline is not None:
+            growth = self.residentMemory() - baseline
+            self.delayDisplay(f"Memory: {exampleMemory / 2**20:.0f} MB per example, "
+                              f"{growth / 2**20:.0f} MB growth over {self.SWITCHES - 2} switches")
+            self.assertLess(growth, max(exampleMemory, 64 * 2**20))
+
+        loader.unload()
+        self.delayDisplay("Example switching test passed")
+
+    @staticmethod
+    def wait(seconds):
+        """Run the Qt event loop for a while without spinning"""
+        eventLoop = qt.QEventLoop()
+        qt.QTimer.singleShot(int(seconds * 1000), eventLoop.quit)
+        eventLoop.exec_()
+
+    def idleCPU(self):
+        """Share of a core used by the process while the event loop idles"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.wait(self.IDLE_TIME)
+        return (time.process_time() - cpu) / (time.perf_counter() - wall)
+
+    def sendPoses(self, port, sent):
+        """Client thread: POSES poses at POSE_RATE, pose i with x = i, send times in sent"""
+        async def run():
+            connection = await websocket_connect(f"ws://127.0.0.1:{port}/websocket")
+            for i in range(self.POSES):
+                sent[i] = time.perf_counter()
+                # binary pose: position, quaternion (w, x, y, z), sequence number
+                pose = np.array([i, 0, 0, 1, 0, 0, 0, i], dtype='<f4')
+                await connection.write_message(pose.tobytes(), binary=True)
+                await asyncio.sleep(1.0 / self.POSE_RATE)
+            connection.close()
+        asyncio.new_event_loop().run_until_complete(run())
+
+    def test_WebServerLoop(self):
+        examples = self.examples()
+        if not examples:
+            self.delayDisplay("No example with a gm mesh under TMS_DATA_DIR, test skipped")
+            return
+        loader = L.Loader.loadExample(examples[0])
+        # the handler moves the plane and coil with the 'tracker' transform, observe it from the start
+        tracker = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode', 'tracker')
+        applied = {}
+
+        def onTrackerModified(caller, event):
+            m = vtk.vtkMatrix4x4()
+            caller.GetMatrixTransformToParent(m)
+            applied.setdefault(int(round(m.GetElement(0, 3))), time.perf_counter())
+        tag = tracker.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent, onTrackerModified)
+
+        baseline = self.idleCPU()
+        results = {}
+        for loopMode in Server.LOOP_MODES:
+            applied.clear()
+            server = Server(server_address=("127.0.0.1", Server.findFreePort(2016)), loopMode=loopMode,
+                            docroot=os.path.join(os.path.dirname(slicer.modules.slicertms.path), 'docroot'))
+            server.start()
+            try:
+                idle = self.idleCPU()
+                sent = [None] * self.POSES
+                client = threading.Thread(target=self.sendPoses, args=(server.port, sent))
+                client.start()
+                while client.is_alive():
+                    self.wait(0.05)
+                self.wait(0.2)
+            finally:
+                server.stop()
+            latencies = np.array([applied[i] - sent[i] for i in applied if 0 < i < self.POSES and sent[i]]) * 1000.0
+            self.assertGreater(len(latencies), 0, f"no pose reached the scene with the {loopMode} loop")
+            self.assertIn(self.POSES - 1, applied, f"the last pose was not applied with the {loopMode} loop")
+            results[loopMode] = (idle, latencies)
+            self.delayDisplay(f"{loopMode} loop: idle CPU {100 * (idle - baseline):+.1f}% of a core over Slicer's own, "
+                              f"pose to scene p50 {np.percentile(latencies, 50):.1f} ms "
+                              f"p95 {np.percentile(latencies, 95):.1f} ms, "
+                              f"{len(latencies)}/{self.POSES - 1} poses applied, {server.stats()}")
+            # the old stop/start spin loop kept a whole core busy
+            self.assertLess(idle - baseline, 0.2)
+
+        tracker.RemoveObserver(tag)
+        slicer.mrmlScene.RemoveNode(tracker)
+        loader.unload()
+        self.delayDisplay("Web server loop test passed")
+
+    def test_MapperLogging(self):
+        examples = self.examples()
+        if not examples:
+            self.delayDisplay("No example with a gm mesh under TMS_DATA_DIR, test skipped")
+            return
+        loader = self.switch(None, examples[0], inPlace=False)
+        times = {}
+        try:
+            for level in ('DEBUG', 'WARNING', 'DEBUG', 'WARNING'):
+                setup_logging(level)
+                for _ in range(self.MAPS):
+                    start = time.perf_counter()
+                    M.Mapper.map(loader)
+                    times.setdefault(level, []).append(time.perf_counter() - start)
+        finally:
+            setup_logging()
+        debug, warning = (np.array(times[level]) * 1000.0 for level in ('DEBUG', 'WARNING'))
+        self.delayDisplay(f"Mapper.map p50 {np.percentile(debug, 50):.2f} ms p95 {np.percentile(debug, 95):.2f} ms "
+                          f"with console output, p50 {np.percentile(warning, 50):.2f} ms "
+                          f"p95 {np.percentile(warning, 95):.2f} ms without")
+        loader.unload()
+        self.delayDisplay("Mapper logging test passed")
@@ -5,6 +5,8 @@ from slicer.ScriptedLoadableModule import *
 import numpy as np
 from requesthandlers import *
 from slicerserver.server import Server
+from requesthandlers.field_push import FieldBroadcaster
+import Mapper as M
 # from tms_env import get_tms_value
 
 
@@ -50,6 +52,9 @@ class SlicerWebServer:
             keyfile = None
         self.server = Server(docroot=self.docroot, server_address=("", self.port), logFile=self.logFile, logMessage=self.logMessage, certfile=certfile, keyfile=keyfile)
         self.server.start()
+        # push every E-field mapped onto the brain mesh to the subscribed clients
+        if FieldBroadcaster.get().onFieldMapped not in M.Mapper.fieldListeners:
+            M.Mapper.fieldListeners.append(FieldBroadcaster.get().onFieldMapped)
         # return webserver
 
     def logMessage(self, *args):
@@ -57,6 +62,9 @@ class SlicerWebServer:
             print("Logic: " + arg)
 
     def stop(self):
+        if FieldBroadcaster.get().onFieldMapped in M.Mapper.fieldListeners:
+            M.Mapper.fieldListeners.remove(FieldBroadcaster.get().onFieldMapped)
+        FieldBroadcaster.get().clear()
         if self.server:
             self.server.stop()
 
@@ -0,0 +1,162 @@
+import atexit
+import collections
+import json
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class LatencyTracer:
+    """
+    End-to-end latency of a coil move, keyed by the simulation id that
+    Mapper.map creates. The id travels to the server as IGTL metadata
+    (TraceId) and comes back with the server's timestamps on the response.
+    All times are wall clock (time.time()) so the server's hops line up.
+    Spans are appended to a Chrome trace file (open in chrome://tracing or
+    Perfetto) and kept in rolling windows for p50/p95/p99.
+    """
+
+    WINDOW = 200  # traces per rolling window
+    PERCENTILES = (50, 95, 99)
+    MAX_OPEN = 32  # maps without a response yet, older ones are dropped
+    FLUSH_EVERY = 10  # traces per write to the trace file
+
+    SLICER_PID = 1
+    SERVER_PID = 2
+
+    # metadata keys the server sets on its response
+    TRACE_ID = 'TraceId'
+    SERVER_KEYS = ('ServerReceive', 'InferStart', 'InferEnd', 'SendStart')
+
+    HOPS = ('reslice', 'push', 'uplink', 'preprocess', 'infer', 'postprocess',
+            'downlink', 'reassembly', 'mesh mapping', 'total')
+
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get('TMS_TRACE_PATH', os.path.join(tempfile.gettempdir(), 'slicertms_trace.json'))
+        self.open = collections.OrderedDict()  # trace id -> {'begin': t, 'spans': [...]}
+        self.windows = {hop: collections.deque(maxlen=self.WINDOW) for hop in self.HOPS}
+        self.events = []  # Chrome trace events not written yet
+        self.fileStarted = False
+        self.completed = 0
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    @staticmethod
+    def now():
+        return time.time()
+
+    def begin(self, traceId, t=None):
+        if traceId is None:
+            return
+        self.open[traceId] = {'begin': time.time() if t is None else t, 'spans': []}
+        while len(self.open) > self.MAX_OPEN:
+            self.open.popitem(last=False)
+            self.dropped += 1
+
+    def span(self, traceId, name, start, end, pid=None):
+        trace = self.open.get(traceId)
+        if trace is None or start is None or end is None:
+            return
+        trace['spans'].append((name, start, end, pid or self.SLICER_PID))
+
+    @staticmethod
+    def serverTimes(node):
+        """TraceId and server timestamps from the IGTL metadata of a received node, or None"""
+        traceId = node.GetAttribute(LatencyTracer.TRACE_ID) if node else None
+        if not traceId:
+            return None
+        times = {'id': traceId}
+        for key in LatencyTracer.SERVER_KEYS:
+            value = node.GetAttribute(key)
+            times[key] = float(value) if value else None
+        return times
+
+    def end(self, traceId, received=None, reassembled=None, server=None, t=None):
+        """
+        Close a trace once the E-field is on the mesh
+        received/reassembled: client times of the first and the complete
+        frame; server: serverTimes() of the response
+        """
+        trace = self.open.pop(traceId, None)
+        if trace is None:
+            return
+        # anything mapped before this one will not get its own response
+        for older in [k for k, v in self.open.items() if v['begin'] < trace['begin']]:
+            del self.open[older]
+            self.dropped += 1
+
+        end = time.time() if t is None else t
+        spans = trace['spans']
+        pushEnd = next((e for n, s, e, p in spans if n == 'push'), trace['begin'])
+        if server:
+            rx, inferStart, inferEnd, sendStart = (server.get(k) for k in self.SERVER_KEYS)
+            for name, start, stop in (('uplink', pushEnd, rx), ('preprocess', rx, inferStart),
+                                      ('infer', inferStart, inferEnd), ('postprocess', inferEnd, sendStart)):
+                if start is not None and stop is not None:
+                    spans.append((name, start, stop, self.SLICER_PID if name == 'uplink' else self.SERVER_PID))
+            if sendStart is not None and received is not None:
+                spans.append(('downlink', sendStart, received, self.SLICER_PID))
+        if received is not None and reassembled is not None:
+            spans.append(('reassembly', received, reassembled, self.SLICER_PID))
+        spans.append(('total', trace['begin'], end, self.SLICER_PID))
+
+        for name, start, stop, pid in spans:
+            if name in self.windows:
+                self.windows[name].append(stop - start)
+            self.events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': 1,
+                                'ts': round(start * 1e6), 'dur': round(max(stop - start, 0.0) * 1e6),
+                                'args': {'id': traceId}})
+        self.completed += 1
+        if self.completed % self.FLUSH_EVERY == 0:
+            self.flush()
+
+    def flush(self):
+        """Append pending events; the JSON array is left open, which the trace viewers accept"""
+        if not self.events:
+            return
+        try:
+            mode = 'a' if self.fileStarted else 'w'
+            with open(self.path, mode, encoding='utf-8') as f:
+                if not self.fileStarted:
+                    f.write('[\n')
+                    for pid, name in ((self.SLICER_PID, 'Slicer'), (self.SERVER_PID, 'TMS server')):
+                        f.write(json.dumps({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}}) + ',\n')
+                f.write(''.join(json.dumps(e, separators=(',', ':')) + ',\n' for e in self.events))
+            self.fileStarted = True
+            self.events = []
+        except OSError as e:
+            log.error("Could not write trace file %s: %s", self.path, e)
+
+    def percentiles(self):
+        """{hop: (p50, p95, p99)} in seconds, for hops with samples"""
+        stats = {}
+        for hop, window in self.windows.items():
+            if window:
+                stats[hop] = tuple(np.percentile(np.fromiter(window, dtype=np.float64), self.PERCENTILES))
+        return stats
+
+    def summary(self):
+        """Widget text: one line per hop, milliseconds"""
+        stats = self.percentiles()
+        if not stats:
+            return ""
+        header = "p" + " / p".join(str(p) for p in self.PERCENTILES) + f" ms ({len(self.windows['total'])} moves)"
+        lines = [header]
+        for hop in self.HOPS:
+            if hop in stats:
+                lines.append(f"{hop}: " + " / ".join(f"{v * 1000:.1f}" for v in stats[hop]))
+        if self.dropped:
+            lines.append(f"superseded: {self.dropped}")
+        return "\n".join(lines)
@@ -0,0 +1,188 @@
+import {
+	BufferAttribute,
+	Color
+} from 'three';
+
+/**
+ * Description: Colours a mesh loaded with TMSMeshLoader by the E-field Slicer
+ * pushes after every mapping (requesthandlers/field_push.py), updating the
+ * vertex colour buffer in place.
+ *
+ * Layout, little-endian: a 28 byte header
+ *  magic "TMSF", version uint8, flags uint8, reserved uint16, mesh version uint32,
+ *  point count uint32, value count uint32, colour range min, max float32
+ * then, when flags & DIFF, the uint32 ids of the vertices that changed, and the
+ * values: uint8 colour indices over the range, or float16 values when flags & FLOAT16.
+ * A message for another mesh version (e.g. the coarse mesh shown in Slicer while
+ * the coil is dragged, or the mesh of another example) is ignored; the page
+ * fetches that mesh with "get_node", gives it a new updater and subscribes again.
+ *
+ * Usage:
+ *  const updater = new TMSFieldUpdater( mesh );
+ *  socket.send( 'subscribe_field?format=uint8&diff=0.02' );
+ *  socket.addEventListener( 'message', ( event ) => {
+ *    if ( ! TMSFieldUpdater.isField( event.data ) ) return;
+ *    if ( TMSFieldUpdater.meshVersion( event.data ) === mesh.geometry.userData.meshVersion ) {
+ *      updater.update( event.data );
+ *    } else {
+ *      // another mesh: "get_node" again, then a new TMSFieldUpdater and "subscribe_field" again
+ *    }
+ *  } );
+ */
+
+const MAGIC = 0x46534d54; // "TMSF" read as a little-endian uint32
+const VERSION = 1;
+const HEADER_SIZE = 28;
+const FLOAT16 = 1;
+const DIFF = 2;
+const COLOUR_STEPS = 255;
+
+// jet colour table, like the E-field colours in Slicer
+const JET = new Uint8Array( ( COLOUR_STEPS + 1 ) * 3 );
+for ( let i = 0; i <= COLOUR_STEPS; i ++ ) {
+
+	const x = 4 * i / COLOUR_STEPS;
+	JET[ 3 * i ] = 255 * Math.min( Math.max( 1.5 - Math.abs( x - 3 ), 0 ), 1 );
+	JET[ 3 * i + 1 ] = 255 * Math.min( Math.max( 1.5 - Math.abs( x - 2 ), 0 ), 1 );
+	JET[ 3 * i + 2 ] = 255 * Math.min( Math.max( 1.5 - Math.abs( x - 1 ), 0 ), 1 );
+
+}
+
+// float16 bit pattern to number, built on first use
+let HALF = null;
+
+function halfTable() {
+
+	if ( HALF === null ) {
+
+		HALF = new Float32Array( 65536 );
+		for ( let h = 0; h < 65536; h ++ ) {
+
+			const sign = h & 0x8000 ? - 1 : 1;
+			const exponent = ( h >> 10 ) & 0x1f;
+			const fraction = h & 0x3ff;
+			if ( exponent === 0 ) HALF[ h ] = sign * Math.pow( 2, - 14 ) * ( fraction / 1024 );
+			else if ( exponent === 31 ) HALF[ h ] = fraction ? NaN : sign * Infinity;
+			else HALF[ h ] = sign * Math.pow( 2, exponent - 15 ) * ( 1 + fraction / 1024 );
+
+		}
+
+	}
+
+	return HALF;
+
+}
+
+class TMSFieldUpdater {
+
+	constructor( mesh ) {
+
+		this.mesh = mesh;
+		this.values = null; // float16 mode: the values, recoloured when the range changes
+		this.min = 0;
+		this.max = 0;
+
+	}
+
+	static isField( data ) {
+
+		return data instanceof ArrayBuffer && data.byteLength >= HEADER_SIZE &&
+			new DataView( data ).getUint32( 0, true ) === MAGIC;
+
+	}
+
+	// version of the mesh the values in a field message are for, see TMSMeshLoader
+	static meshVersion( data ) {
+
+		return new DataView( data ).getUint32( 8, true );
+
+	}
+
+	colours( pointCount ) {
+
+		const geometry = this.mesh.geometry;
+		let colour = geometry.getAttribute( 'color' );
+		if ( colour === undefined || colour.count !== pointCount ) {
+
+			colour = new BufferAttribute( new Uint8Array( pointCount * 3 ), 3, true );
+			geometry.setAttribute( 'color', colour );
+			this.mesh.material.vertexColors = true;
+			this.mesh.material.color = new Color( 0xffffff );
+			this.mesh.material.needsUpdate = true;
+
+		}
+
+		return colour;
+
+	}
+
+	// returns false when the message is not for this mesh
+	update( data ) {
+
+		const header = new DataView( data, 0, HEADER_SIZE );
+		if ( header.getUint8( 4 ) !== VERSION ||
+			header.getUint32( 8, true ) !== this.mesh.geometry.userData.meshVersion ) {
+
+			return false;
+
+		}
+
+		const flags = header.getUint8( 5 );
+		const pointCount = header.getUint32( 12, true );
+		const count = header.getUint32( 16, true );
+		const min = header.getFloat32( 20, true );
+		const max = header.getFloat32( 24, true );
+		const diff = ( flags & DIFF ) !== 0;
+		if ( pointCount !== this.mesh.geometry.getAttribute( 'position' ).count ) return false;
+		if ( diff && this.values === null && ( flags & FLOAT16 ) ) return false; // no full frame yet
+
+		const ids = diff ? new Uint32Array( data, HEADER_SIZE, count ) : null;
+		const offset = HEADER_SIZE + ( diff ? 4 * count : 0 );
+		const colour = this.colours( pointCount );
+		const rgb = colour.array;
+
+		if ( flags & FLOAT16 ) {
+
+			const half = halfTable();
+			const bits = new Uint16Array( data.slice( offset, offset + 2 * count ) );
+			if ( this.values === null || this.values.length !== pointCount ) this.values = new Float32Array( pointCount );
+			for ( let i = 0; i < count; i ++ ) this.values[ diff ? ids[ i ] : i ] = half[ bits[ i ] ];
+
+			const scale = max > min ? COLOUR_STEPS / ( max - min ) : 0;
+			const recolourAll = ! diff || min !== this.min || max !== this.max;
+			const n = recolourAll ? pointCount : count;
+			for ( let i = 0; i < n; i ++ ) {
+
+				const v = recolourAll ? i : ids[ i ];
+				const index = 3 * Math.min( Math.max( Math.round( ( this.values[ v ] - min ) * scale ), 0 ), COLOUR_STEPS );
+				rgb[ 3 * v ] = JET[ index ];
+				rgb[ 3 * v + 1 ] = JET[ index + 1 ];
+				rgb[ 3 * v + 2 ] = JET[ index + 2 ];
+
+			}
+
+		} else {
+
+			const indices = new Uint8Array( data, offset, count );
+			for ( let i = 0; i < count; i ++ ) {
+
+				const v = diff ? ids[ i ] : i;
+				const index = 3 * indices[ i ];
+				rgb[ 3 * v ] = JET[ index ];
+				rgb[ 3 * v + 1 ] = JET[ index + 1 ];
+				rgb[ 3 * v + 2 ] = JET[ index + 2 ];
+
+			}
+
+		}
+
+		this.min = min;
+		this.max = max;
+		colour.needsUpdate = true;
+		return true;
+
+	}
+
+}
+
+export { TMSFieldUpdater };
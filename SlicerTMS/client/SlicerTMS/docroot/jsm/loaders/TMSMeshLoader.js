@@ -0,0 +1,111 @@
+import {
+	BufferAttribute,
+	BufferGeometry,
+	Float32BufferAttribute
+} from 'three';
+
+/**
+ * Description: Decodes the binary meshes Slicer sends in reply to "get_node"
+ * (requesthandlers/mesh_encoder.py) into an indexed buffer geometry, with typed
+ * arrays only, no text parsing.
+ *
+ * Layout, little-endian: a 44 byte header
+ *  magic "TMSM", version uint8, flags uint8, reserved uint16, mesh version uint32,
+ *  point count uint32, triangle count uint32, bounding box float32 x 6
+ * then the payload, zlib-deflated when flags & DEFLATE:
+ *  points float32 x 3, or uint16 x 3 scaled to the bounding box when flags & QUANTIZED (padded to 4 bytes)
+ *  triangles int32 x 3, each index the difference to the previous one when flags & DELTA
+ *
+ * Usage:
+ *  socket.binaryType = 'arraybuffer';
+ *  socket.send( 'get_node' );
+ *  socket.onmessage = async ( event ) => {
+ *    if ( TMSMeshLoader.isMesh( event.data ) ) {
+ *      scene.add( new THREE.Mesh( await new TMSMeshLoader().parse( event.data ) ) );
+ *    }
+ *  };
+ */
+
+const MAGIC = 0x4d534d54; // "TMSM" read as a little-endian uint32
+const VERSION = 2;
+const HEADER_SIZE = 44;
+const QUANTIZED = 1;
+const DELTA = 2;
+const DEFLATE = 4;
+const QUANTIZATION_STEPS = 65535;
+
+class TMSMeshLoader {
+
+	static isMesh( data ) {
+
+		return data instanceof ArrayBuffer && data.byteLength >= HEADER_SIZE &&
+			new DataView( data ).getUint32( 0, true ) === MAGIC;
+
+	}
+
+	async parse( data ) {
+
+		const header = new DataView( data, 0, HEADER_SIZE );
+		if ( header.getUint32( 0, true ) !== MAGIC || header.getUint8( 4 ) !== VERSION ) {
+
+			throw new Error( 'TMSMeshLoader: not a version ' + VERSION + ' mesh message' );
+
+		}
+
+		const flags = header.getUint8( 5 );
+		const meshVersion = header.getUint32( 8, true );
+		const pointCount = header.getUint32( 12, true );
+		const triangleCount = header.getUint32( 16, true );
+		const min = [ 0, 1, 2 ].map( ( i ) => header.getFloat32( 20 + 4 * i, true ) );
+		const max = [ 0, 1, 2 ].map( ( i ) => header.getFloat32( 32 + 4 * i, true ) );
+
+		let payload = data.slice( HEADER_SIZE );
+		if ( flags & DEFLATE ) {
+
+			const stream = new Blob( [ payload ] ).stream().pipeThrough( new DecompressionStream( 'deflate' ) );
+			payload = await new Response( stream ).arrayBuffer();
+
+		}
+
+		let positions, offset;
+		if ( flags & QUANTIZED ) {
+
+			const scaled = new Uint16Array( payload, 0, pointCount * 3 );
+			const step = [ 0, 1, 2 ].map( ( i ) => ( max[ i ] > min[ i ] ? max[ i ] - min[ i ] : 1 ) / QUANTIZATION_STEPS );
+			positions = new Float32Array( pointCount * 3 );
+			for ( let i = 0; i < positions.length; i += 3 ) {
+
+				positions[ i ] = min[ 0 ] + scaled[ i ] * step[ 0 ];
+				positions[ i + 1 ] = min[ 1 ] + scaled[ i + 1 ] * step[ 1 ];
+				positions[ i + 2 ] = min[ 2 ] + scaled[ i + 2 ] * step[ 2 ];
+
+			}
+
+			offset = Math.ceil( pointCount * 6 / 4 ) * 4;
+
+		} else {
+
+			positions = new Float32Array( payload, 0, pointCount * 3 );
+			offset = pointCount * 12;
+
+		}
+
+		const indices = new Uint32Array( new Int32Array( payload, offset, triangleCount * 3 ) );
+		if ( flags & DELTA ) {
+
+			for ( let i = 1; i < indices.length; i ++ ) indices[ i ] += indices[ i - 1 ];
+
+		}
+
+		const geometry = new BufferGeometry();
+		geometry.setAttribute( 'position', new Float32BufferAttribute( positions, 3 ) );
+		geometry.setIndex( new BufferAttribute( indices, 1 ) );
+		// E-field pushes (TMSFieldUpdater) carry the version of the mesh they are for
+		geometry.userData.meshVersion = meshVersion;
+		return geometry;
+
+	}
+
+}
+
+export { TMSMeshLoader };
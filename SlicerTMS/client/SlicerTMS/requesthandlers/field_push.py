@@ -0,0 +1,151 @@
+import logging
+import struct
+import numpy as np
+from requesthandlers.mesh_encoder import MeshEncoder
+
+log = logging.getLogger(__name__)
+
+
+class FieldChannel:
+    """Subscribers of one node with the same format and diff threshold, and what they were last sent"""
+
+    def __init__(self, nodeName, float16, threshold):
+        self.nodeName = nodeName
+        self.float16 = float16
+        self.threshold = threshold  # fraction of the colour range, 0 sends every frame in full
+        self.subscribers = set()
+        self.fresh = set()  # subscribed since the last frame, they get the next one in full
+        self.meshVersion = None
+        self.sent = None  # per-vertex values as the up to date subscribers hold them
+
+
+class FieldBroadcaster:
+    """
+    Pushes the E-field at the mesh vertices to the websocket clients that
+    sent "subscribe_field?name=gm&format=uint8|float16&diff=0.02", after
+    every mapping of the E-field onto that mesh (Mapper.fieldListeners).
+    Runs on the main thread; subscribe/unsubscribe come through
+    Server.dispatch.
+
+    Message, little-endian: a HEADER_FORMAT header
+        magic b'TMSF', version uint8, flags uint8, reserved uint16,
+        mesh version uint32 (MeshEncoder.meshVersion of the mesh the values are for),
+        point count uint32, value count uint32, colour range min, max float32
+    then, with FLAG_DIFF, the uint32 ids of the vertices that changed, and
+    the values: uint8 colour indices over the range, or with FLAG_FLOAT16
+    the float16 values. A diff only holds the vertices whose value moved by
+    more than the threshold (a fraction of the range) from what the client
+    was last sent, so the client never drifts further than that; a diff
+    that would be bigger than the whole frame is sent as the whole frame.
+    """
+
+    MAGIC = b'TMSF'
+    VERSION = 1
+    HEADER_FORMAT = '<4sBBHIIIff'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    FLAG_FLOAT16 = 1
+    FLAG_DIFF = 2
+
+    COLOUR_STEPS = 255
+    DEFAULT_THRESHOLD = 0.02
+
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.channels = {}  # (node name, float16, threshold) -> FieldChannel
+        self.sentBytes = 0
+        self.frames = 0
+
+    def subscribe(self, client, query):
+        """client is a SlicerWebSocketHandler, query its parse_qs options"""
+        self.unsubscribe(client)
+        nodeName = query.get('name', ['gm'])[0]
+        float16 = query.get('format', ['uint8'])[0] == 'float16'
+        threshold = max(0.0, float(query.get('diff', [FieldBroadcaster.DEFAULT_THRESHOLD])[0]))
+        key = (nodeName, float16, threshold)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = FieldChannel(nodeName, float16, threshold)
+        channel.subscribers.add(client)
+        channel.fresh.add(client)
+        log.info("Field push to %s: %s, diff %g", nodeName, 'float16' if float16 else 'uint8', threshold)
+
+    def unsubscribe(self, client):
+        for key, channel in list(self.channels.items()):
+            channel.subscribers.discard(client)
+            channel.fresh.discard(client)
+            if not channel.subscribers:
+                del self.channels[key]
+
+    def clear(self):
+        self.channels = {}
+
+    @staticmethod
+    def encodeValues(values, fMin, fMax, float16):
+        if float16:
+            return values.astype('<f2')
+        scale = FieldBroadcaster.COLOUR_STEPS / (fMax - fMin) if fMax > fMin else 0.0
+        return np.clip(np.rint((values - fMin) * scale), 0, FieldBroadcaster.COLOUR_STEPS).astype(np.uint8)
+
+    @staticmethod
+    def changed(encoded, sent, channel, fMin, fMax):
+        """Ids of the vertices that moved by more than the threshold since they were sent"""
+        if channel.float16:
+            tolerance = channel.threshold * (fMax - fMin)
+            delta = np.abs(encoded.astype(np.float32) - sent.astype(np.float32))
+        else:
+            tolerance = channel.threshold * FieldBroadcaster.COLOUR_STEPS
+            delta = np.abs(encoded.astype(np.int16) - sent.astype(np.int16))
+        return np.flatnonzero(delta > tolerance).astype('<u4')
+
+    @staticmethod
+    def message(channel, pointCount, fMin, fMax, values, ids=None):
+        flags = ((FieldBroadcaster.FLAG_FLOAT16 if channel.float16 else 0) |
+                 (FieldBroadcaster.FLAG_DIFF if ids is not None else 0))
+        header = struct.pack(FieldBroadcaster.HEADER_FORMAT, FieldBroadcaster.MAGIC, FieldBroadcaster.VERSION, flags, 0,
+                             channel.meshVersion, pointCount, len(values), fMin, fMax)
+        return header + (ids.tobytes() if ids is not None else b'') + values.tobytes()
+
+    def send(self, clients, message):
+        for client in clients:
+            client.reply(message, binary=True)
+            self.sentBytes += len(message)
+
+    def onFieldMapped(self, node, values, fMin, fMax):
+        """Mapper.fieldListeners callback: the per-vertex E-field of node was just updated"""
+        if not self.channels:
+            return
+        meshVersion = None
+        for channel in list(self.channels.values()):
+            if channel.nodeName != node.GetName():
+                continue
+            if meshVersion is None:
+                meshVersion = MeshEncoder.meshVersion(node.GetPolyData())
+            encoded = FieldBroadcaster.encodeValues(values, fMin, fMax, channel.float16)
+            ids = None
+            if channel.sent is not None and channel.meshVersion == meshVersion and channel.threshold > 0.0:
+                ids = FieldBroadcaster.changed(encoded, channel.sent, channel, fMin, fMax)
+                if len(ids) * (ids.itemsize + encoded.itemsize) >= encoded.nbytes:
+                    ids = None  # e.g. the colour range moved, the whole frame is smaller
+            if ids is None:
+                # new mesh (or level of detail), no diff mode or a big change: everyone gets the whole frame
+                channel.meshVersion = meshVersion
+                channel.sent = encoded
+                channel.fresh.clear()
+                self.send(channel.subscribers, FieldBroadcaster.message(channel, len(values), fMin, fMax, encoded))
+            else:
+                channel.sent[ids] = encoded[ids]
+                upToDate = channel.subscribers - channel.fresh
+                self.send(upToDate, FieldBroadcaster.message(channel, len(values), fMin, fMax, encoded[ids], ids))
+                self.send(channel.fresh, FieldBroadcaster.message(channel, len(values), fMin, fMax, channel.sent))
+                channel.fresh.clear()
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Field diff: %d of %d vertices", len(ids), len(values))
+            self.frames += 1
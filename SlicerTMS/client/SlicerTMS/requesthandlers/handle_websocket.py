@@ -1,4 +1,5 @@
 import json
+import logging
 import sys
 import time
 import numpy
@@ -26,11 +27,38 @@ except ImportError:
 from typing import Union, Optional, Awaitable
 from tornado.websocket import WebSocketHandler
 from requesthandlers import header_builder
+from requesthandlers.mesh_encoder import MeshEncoder
+from requesthandlers.field_push import FieldBroadcaster
 import sys
 sys.path.append('..')
 
+log = logging.getLogger(__name__)
+
 
 class SlicerWebSocketHandler(WebSocketHandler):
+    """
+    Poses from the AR client, as text ("?p=x,y,z&q=w,x,y,z" or "m=...") or
+    as a binary message of POSE_VALUES little-endian float32: position (mm),
+    quaternion (w, x, y, z) and a sequence number. Poses are applied on the
+    main thread, only the latest one per connection and scene update tick;
+    a pose older than the last applied one is dropped.
+    "get_node" replies with a binary mesh (MeshEncoder), "subscribe_field"
+    starts the E-field pushes for that mesh (FieldBroadcaster).
+    """
+
+    meshCache = {}  # node ID -> (geometry key, encoded mesh), shared by all connections
+
+    POSE_VALUES = 8
+    POSE_DTYPE = np.dtype('<f4')
+    SEQUENCE_WRAP = 1 << 24  # the client wraps where float32 stops holding every integer
+
+    def initialize(self):
+        self.tracker = None  # 'tracker' transform, looked up once per connection
+        self.coilfid = None  # coil plane and model of the loaded example that the tracker moves
+        self.coil = None
+        self.lastSequence = -1
+        self.stalePoses = 0
+
     def logMessage(self, message):
         print(message)
 
@@ -41,20 +69,57 @@ class SlicerWebSocketHandler(WebSocketHandler):
         return super().open(*args, **kwargs)
 
     def on_close(self) -> None:
+        server = self.settings.get('server')
+        if server is not None:
+            server.dispatch(FieldBroadcaster.get().unsubscribe, self)
         super().on_close()
 
     def on_message(self, message):
         # print("Coil Position Matrix:")
         # self.logMessage(message)
         # self.on_pose(message)
-        if message == "get_node":
-            self.on_get_node(message)
+        if isinstance(message, bytes):
+            function = self.on_binary_pose
+        elif message.startswith("get_node"):
+            function = self.on_get_node
+        elif message.startswith("subscribe_field"):
+            function = self.on_subscribe_field
+        else:
+            function = self.on_pose
+        # the scene is only touched from the main thread, the Tornado loop may run on its own
+        server = self.settings.get('server')
+        if server is None:
+            function(message)
+        elif function != self.on_pose and function != self.on_binary_pose:
+            server.dispatch(function, message)
         else:
-            self.on_pose(message)
+            # only the latest pose of a burst is applied
+            server.dispatch(function, message, key=(id(self), 'pose'))
         # if message == 'get_coil_position':
         #     # you can access slicer code here
         #     self.write_message('1.2323 3.34324 5.34324')
 
+    def reply(self, message, binary=False):
+        """write_message for code running on the main thread"""
+        server = self.settings.get('server')
+        if server is None:
+            self.write_message(message, binary)
+        else:
+            server.reply(self, message, binary)
+
+    def on_binary_pose(self, message):
+        values = np.frombuffer(message, dtype=self.POSE_DTYPE)
+        if len(values) != self.POSE_VALUES:
+            self.logMessage(f"Ignoring binary message of {len(message)} bytes, "
+                            f"a pose is {self.POSE_VALUES * self.POSE_DTYPE.itemsize}")
+            return
+        sequence = int(values[7])
+        if 0 < self.lastSequence - sequence < self.SEQUENCE_WRAP // 2:
+            self.stalePoses += 1
+            return
+        self.lastSequence = sequence
+        self.applyPose(position=values[0:3].tolist(), quaternion=values[3:7].tolist())
+
     def on_pose(self, message):
         p = urlparse.urlparse(message)
         q = urlparse.parse_qs(p.query)
@@ -70,28 +135,43 @@ class SlicerWebSocketHandler(WebSocketHandler):
             position = list(map(float, q['p'][0].split(',')))
         except KeyError:
             position = None
-
-        print('accessing markupsplane node now')
-        # slicer.util.getNode('vtkMRMLMarkupsPlaneNode1').SetDisplayVisibility(0)
-        nodes = slicer.mrmlScene.GetNodesByName('tracker')
-        if nodes.GetNumberOfItems() > 0:
-            self.coilfid = slicer.util.getNode('vtkMRMLMarkupsPlaneNode1')
-            self.coilfid.SetOrigin([0, 0, 0]) # need to reset the position because in the loader with set the coil to [0, 0, 110] as default
-            self.tracker = nodes.GetItemAsObject(0)
-        else:
-            self.tracker = slicer.vtkMRMLLinearTransformNode()
-            self.tracker.SetName('tracker')
-            slicer.mrmlScene.AddNode(self.tracker)
-            self.coilfid = slicer.util.getNode('vtkMRMLMarkupsPlaneNode1')
-            self.coilfid.SetOrigin([0, 0, 0]) # need to reset the position because in the loader with set the coil to [0, 0, 110] as default
-            self.coilfid.SetAndObserveTransformNodeID(self.tracker.GetID())
-            # self.coil = slicer.modules.models.logic().GetMRMLScene().GetNodesByName('coil') # this is the 3d coil model
-            self.coil = slicer.util.getNode('coil')
-            self.coil.SetAndObserveTransformNodeID(self.tracker.GetID())
-            print('tracking the coil!')
-
+        self.applyPose(transformMatrix, quaternion, position)
+
+    def trackingNodes(self):
+        """
+        The 'tracker' transform that moves the coil plane and model, created on
+        the first pose. The plane and model are the loader's, parented again
+        when an example switch or reload replaced them.
+        """
+        loader = getattr(slicer.modules.SlicerTMSWidget, 'loader', None)
+        coilfid = getattr(loader, 'markupsPlaneNode', None)
+        coil = getattr(loader, 'coilNode', None)
+        if (self.tracker is not None and self.tracker.GetScene() is not None and
+                coilfid is self.coilfid and coil is self.coil):
+            return self.tracker
+
+        newTracker = self.tracker is None or self.tracker.GetScene() is None
+        if newTracker:
+            nodes = slicer.mrmlScene.GetNodesByName('tracker')
+            if nodes.GetNumberOfItems() > 0:
+                self.tracker = nodes.GetItemAsObject(0)
+            else:
+                self.tracker = slicer.vtkMRMLLinearTransformNode()
+                self.tracker.SetName('tracker')
+                slicer.mrmlScene.AddNode(self.tracker)
+        if coilfid is not None and (newTracker or coilfid is not self.coilfid):
+            coilfid.SetOrigin([0, 0, 0]) # need to reset the position because in the loader with set the coil to [0, 0, 110] as default
+            coilfid.SetAndObserveTransformNodeID(self.tracker.GetID())
+        if coil is not None and (newTracker or coil is not self.coil):
+            coil.SetAndObserveTransformNodeID(self.tracker.GetID())
+        self.coilfid, self.coil = coilfid, coil
+        self.logMessage(f"Tracking the coil of {getattr(loader, 'data_directory', 'no example')}")
+        return self.tracker
+
+    def applyPose(self, transformMatrix=None, quaternion=None, position=None):
+        tracker = self.trackingNodes()
         m = vtk.vtkMatrix4x4()
-        self.tracker.GetMatrixTransformToParent(m)
+        tracker.GetMatrixTransformToParent(m)
         # self.markup.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onHandlesModified)
         # every time the transform changes execute show evec
 
@@ -133,99 +213,64 @@ class SlicerWebSocketHandler(WebSocketHandler):
 
 
 
-        self.tracker.SetMatrixTransformToParent(m)
+        tracker.SetMatrixTransformToParent(m)
         # this method needs to be called to update the efield on the brain:
         # slicer.modules.SlicerTMSWidget.onHandlesModified()
         # slicer.modules.slicertms.onHandlesModified()
 
 
     def on_get_node(self, message: Union[str, bytes]) -> Optional[Awaitable[None]]:
-        print('CALLED GETNODE!')
-        self.gm = slicer.util.getNode('gm')
-        polyData = self.gm.GetPolyData()
-
-        # Create a vtkPolyDataWriter object
-        writer = vtk.vtkPolyDataWriter()
-
-        # Set the input data to the polydata
-        writer.SetInputData(polyData)
-
-        # Write the binary data directly to a string
-        writer.WriteToOutputStringOn()
-
-        # Write the binary data
-        writer.Write()
-
-        # Get the binary data as a string
-        binary_data = writer.GetOutputString()
-        
-        # Convert binary_data to bytes
-        binary_data = bytes(binary_data, 'utf-8')
-
-        self.write_message(binary_data)
-
-        # # Compress the binary data using zlib
-        # compressed_data = zlib.compress(binary_data)
-
-        # # Encode the compressed data to a string
-        # encoded_data = base64.b64encode(compressed_data)
-
-        # # Send the encoded data through the websocket
-        # self.write_message(encoded_data)
-
-
-
-        ### APPROACH 1:
-        # # Create a vtkJSONWriter object
-        # writer = vtk.vtkJSONDataSetWriter()
-        # # Set the input data to the polydata
-        # writer.SetInputData(polyData)
-        # # Update the writer
-        # writer.Update() # this makes slicer crash
-        # # Get the output data
-        # output = writer.GetOutput()
-        # # Convert the vtkDataObject to a python dictionary
-        # data = json.loads(output.toJSON())
-        # # Print the JSON data
-        # print(json.dumps(data))
-
-
-        ######## APPROACH 2:
-        # # Convert vtkPolyData to vtkTable
-        # polyDataToTable = vtk.vtkPolyDataToTable()
-        # polyDataToTable.SetInputData(polyData)
-        # polyDataToTable.Update()
-
-        # table = polyDataToTable.GetOutput()
-
-        # # Write vtkTable to JSON file with compression
-        # jsonWriter = vtk.vtkJSONDataSetWriter()
-        # jsonWriter.SetInputData(table)
-        # jsonWriter.SetCompression(True)
-        # jsonWriter.WriteToOutputStringOn()
-        # jsonWriter.Update()
-        # json_string = jsonWriter.GetOutputString()
-        # json_data = json.loads(json_string)
-        # print(json_data)
-        # self.write_message(json_data)
-
-        #### APPROACH 3 with downsampling:
-
-        # self.gm = slicer.util.getNode('gm')
-        # mesh_data = self.gm.GetPolyData() # Get the mesh data from the mesh node
-        # # downsample the mesh before sending it
-        # decimate = vtk.vtkDecimatePro()
-        # decimate.SetInputData(mesh_data)
-        # decimate.SetTargetReduction(0.9) # set the target reduction factor to 0.9
-        # decimate.Update()
-        # decimated_mesh = decimate.GetOutput()
-        # points = decimated_mesh.GetPoints().GetData()
-        # points_np = vtk_to_numpy(points)
-        # cells = decimated_mesh.GetPolys().GetData()
-        # cells_np = vtk_to_numpy(cells)
-        # json_mesh = json.dumps({"points":points_np.tolist(),"cells":cells_np.tolist()})
-        # print(json_mesh)
-        # self.write_message(json_mesh)
-
-
-
+        """
+        Binary mesh of a model node (gm unless ?name= is given), see MeshEncoder
+        for the format and the points/connectivity/deflate query options.
+        The encoded mesh is cached until the node's geometry changes. When there
+        is no such mesh (no example loaded, wrong name) the reply is the text
+        {"error": "get_node", "name": ..., "message": ...} so the client does
+        not wait for a mesh that never comes.
+        """
+        query = urlparse.parse_qs(urlparse.urlparse(message).query)
+        name = query.get('name', ['gm'])[0]
+        try:
+            encoded = self.encodedMesh(name, MeshEncoder.fromQuery(query))
+        except Exception as e:
+            log.warning("get_node %s failed: %s", name, e)
+            self.reply(json.dumps({'error': 'get_node', 'name': name, 'message': str(e)}))
+            return
+        self.reply(encoded, binary=True)
+
+    @staticmethod
+    def encodedMesh(name, encoder):
+        node = slicer.util.getNode(name)
+        polyData = node.GetPolyData() if node.IsA('vtkMRMLModelNode') else None
+        if polyData is None or polyData.GetPoints() is None:
+            raise ValueError(f"{name} has no mesh")
+        # scalars change with every E-field, only the points and triangles invalidate the mesh
+        key = (MeshEncoder.meshVersion(polyData), encoder.flags)
+        cached = SlicerWebSocketHandler.meshCache.get(node.GetID())
+        if cached is None or cached[0] != key:
+            st = time.perf_counter()
+            points = vtk_to_numpy(polyData.GetPoints().GetData())
+            encoded = encoder.encode(points, SlicerWebSocketHandler.triangles(polyData), key[0])
+            log.info("Encoded %s: %d points, %d bytes in %.3f s",
+                     node.GetName(), len(points), len(encoded), time.perf_counter() - st)
+            cached = SlicerWebSocketHandler.meshCache[node.GetID()] = (key, encoded)
+        return cached[1]
+
+    def on_subscribe_field(self, message):
+        """Push the E-field at the vertices of a mesh to this client, see FieldBroadcaster"""
+        FieldBroadcaster.get().subscribe(self, urlparse.parse_qs(urlparse.urlparse(message).query))
+
+    @staticmethod
+    def triangles(polyData):
+        """Triangle point ids (m, 3), triangulating first if the mesh has other polygons"""
+        polys = polyData.GetPolys()
+        if hasattr(polys, 'GetOffsetsArray'):
+            if np.all(np.diff(vtk_to_numpy(polys.GetOffsetsArray())) == 3):
+                return vtk_to_numpy(polys.GetConnectivityArray()).reshape(-1, 3)
+        triangulate = vtk.vtkTriangleFilter()
+        triangulate.SetInputData(polyData)
+        triangulate.PassVertsOff()
+        triangulate.PassLinesOff()
+        triangulate.Update()
+        # legacy layout: [3, id0, id1, id2, 3, ...]
+        return vtk_to_numpy(triangulate.GetOutput().GetPolys().GetData()).reshape(-1, 4)[:, 1:]
@@ -0,0 +1,104 @@
+import struct
+import zlib
+import numpy as np
+
+
+class MeshEncoder:
+    """
+    Binary triangle mesh for the three.js client (docroot/jsm/loaders/TMSMeshLoader.js).
+
+    Little-endian, a HEADER_FORMAT header then the payload:
+        magic b'TMSM', version uint8, flags uint8, reserved uint16,
+        mesh version uint32 (see meshVersion), point count uint32, triangle count uint32,
+        bounding box float32 x 6 (min xyz, max xyz)
+    payload, zlib-deflated as a whole when FLAG_DEFLATE is set:
+        points, float32 x 3 per point, or with FLAG_QUANTIZED uint16 x 3
+        scaled to the bounding box (padded to 4 bytes)
+        triangles, int32 x 3 per triangle, with FLAG_DELTA each index stored
+        as the difference to the previous one (deflates much better)
+    """
+
+    MAGIC = b'TMSM'
+    VERSION = 2
+    HEADER_FORMAT = '<4sBBHIII6f'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    FLAG_QUANTIZED = 1
+    FLAG_DELTA = 2
+    FLAG_DEFLATE = 4
+
+    QUANTIZATION_STEPS = 65535
+    DEFLATE_LEVEL = 6
+
+    def __init__(self, quantize=True, delta=True, deflate=True):
+        self.flags = ((MeshEncoder.FLAG_QUANTIZED if quantize else 0) |
+                      (MeshEncoder.FLAG_DELTA if delta else 0) |
+                      (MeshEncoder.FLAG_DEFLATE if deflate else 0))
+
+    @classmethod
+    def fromQuery(cls, query):
+        """Options from a parse_qs dict: points=float32|uint16, connectivity=int32|delta, deflate=0|1"""
+        def option(name, default):
+            return query.get(name, [default])[0]
+        return cls(quantize=option('points', 'uint16') == 'uint16',
+                   delta=option('connectivity', 'delta') == 'delta',
+                   deflate=option('deflate', '1') not in ('0', 'false'))
+
+    @staticmethod
+    def meshVersion(polyData):
+        """
+        Tag of a polydata's geometry, changes when its points or triangles do
+        (or another polydata, e.g. a coarser level of detail, is swapped in)
+        but not with its scalars. Field pushes carry it so a client only
+        colours the mesh the values are for.
+        """
+        key = (polyData.GetAddressAsString('vtkPolyData'), polyData.GetPoints().GetMTime(), polyData.GetPolys().GetMTime())
+        return zlib.crc32(repr(key).encode())
+
+    def encode(self, points, triangles, meshVersion=0):
+        """points (n, 3) and triangles (m, 3) to one binary message"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        indices = np.ascontiguousarray(triangles, dtype=np.int32).ravel()
+        lo = points.min(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+        hi = points.max(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+
+        if self.flags & MeshEncoder.FLAG_QUANTIZED:
+            extent = np.where(hi > lo, hi - lo, 1.0).astype(np.float32)
+            scaled = np.rint((points - lo) / extent * MeshEncoder.QUANTIZATION_STEPS)
+            pointBytes = scaled.astype('<u2').tobytes()
+            pointBytes += b'\0' * (-len(pointBytes) % 4)
+        else:
+            pointBytes = points.astype('<f4').tobytes()
+
+        if self.flags & MeshEncoder.FLAG_DELTA and len(indices):
+            indices = np.diff(indices, prepend=np.int32(0))
+        payload = pointBytes + indices.astype('<i4').tobytes()
+        if self.flags & MeshEncoder.FLAG_DEFLATE:
+            payload = zlib.compress(payload, MeshEncoder.DEFLATE_LEVEL)
+
+        header = struct.pack(MeshEncoder.HEADER_FORMAT, MeshEncoder.MAGIC, MeshEncoder.VERSION, self.flags, 0,
+                             meshVersion, len(points), len(indices) // 3, *lo.tolist(), *hi.tolist())
+        return header + payload
+
+    @staticmethod
+    def decode(message):
+        """Inverse of encode, returns the points (float32) and triangles (int32)"""
+        magic, version, flags, _, _, nPoints, nTriangles, *box = struct.unpack_from(MeshEncoder.HEADER_FORMAT, message)
+        if magic != MeshEncoder.MAGIC or version != MeshEncoder.VERSION:
+            raise ValueError(f"Not a version {MeshEncoder.VERSION} mesh message")
+        payload = message[MeshEncoder.HEADER_SIZE:]
+        if flags & MeshEncoder.FLAG_DEFLATE:
+            payload = zlib.decompress(payload)
+        lo, hi = np.array(box[:3], dtype=np.float32), np.array(box[3:], dtype=np.float32)
+        if flags & MeshEncoder.FLAG_QUANTIZED:
+            scaled = np.frombuffer(payload, dtype='<u2', count=nPoints * 3).reshape(-1, 3)
+            extent = np.where(hi > lo, hi - lo, 1.0).astype(np.float32)
+            points = lo + scaled.astype(np.float32) * (extent / MeshEncoder.QUANTIZATION_STEPS)
+            offset = nPoints * 6 + (-nPoints * 6 % 4)
+        else:
+            points = np.frombuffer(payload, dtype='<f4', count=nPoints * 3).reshape(-1, 3)
+            offset = nPoints * 12
+        indices = np.frombuffer(payload, dtype='<i4', count=nTriangles * 3, offset=offset)
+        if flags & MeshEncoder.FLAG_DELTA:
+            indices = np.cumsum(indices, dtype=np.int32)
+        return points, indices.reshape(-1, 3)
@@ -0,0 +1,183 @@
+"""
+Shared-memory transport for E-field frames when Slicer and the TMS server share a host
+Both sides map the same file on a /dev/shm volume. The file holds a ring of
+fixed-size slots; the server copies a frame into the next slot and only sends a
+short "frame N ready in slot k" notice over IGTL. The client copies the slot
+straight out of the mapping, with no IGTL transfer or chunk reassembly.
+
+Layout (all header values are little-endian int64):
+    file header  [magic, version, num_slots, slot_bytes, slot_stride, data_offset, 0, 0]
+    slot headers num_slots x [seq, frame_id, nbytes, shape0, shape1, shape2, 0, 0]
+    slot data    num_slots x slot_stride bytes, page aligned
+
+seq is odd while the server is writing a slot and even once the frame is ready,
+so a reader can tell a half-written or recycled slot from a good one.
+"""
+
+import os
+import mmap
+import numpy as np
+
+
+class SharedMemoryRing:
+    """Ring of fixed-size float32 frame slots in a memory mapped file"""
+
+    DEFAULT_PATH = '/dev/shm/slicertms/efield_ring'
+    NUM_SLOTS = 4
+
+    MAGIC = 0x524D5354  # 'TSMR'
+    VERSION = 1
+    HEADER_WORDS = 8
+    SLOT_HEADER_WORDS = 8
+    PAGE = 4096
+
+    NOTICE_PREFIX = 'SHM:'
+    READY_MESSAGE = 'SHM_READY'
+    FAIL_MESSAGE = 'SHM_FAIL'
+
+    def __init__(self, path, mapping, owner):
+        self.path = path
+        self._map = mapping
+        self.owner = owner  # the server creates and writes the ring
+        self.header = np.frombuffer(mapping, dtype='<i8', count=self.HEADER_WORDS)
+        self.num_slots = int(self.header[2])
+        self.slot_bytes = int(self.header[3])
+        self.slot_stride = int(self.header[4])
+        self.data_offset = int(self.header[5])
+        self.slots = np.frombuffer(mapping, dtype='<i8', count=self.num_slots * self.SLOT_HEADER_WORDS,
+                                   offset=self.HEADER_WORDS * 8).reshape(self.num_slots, self.SLOT_HEADER_WORDS)
+
+    @staticmethod
+    def _layout(slot_bytes, num_slots):
+        page = SharedMemoryRing.PAGE
+        slot_stride = -(-slot_bytes // page) * page
+        headers = (SharedMemoryRing.HEADER_WORDS + num_slots * SharedMemoryRing.SLOT_HEADER_WORDS) * 8
+        data_offset = -(-headers // page) * page
+        return slot_stride, data_offset, data_offset + num_slots * slot_stride
+
+    @classmethod
+    def create(cls, slot_bytes, path=None, num_slots=None):
+        """
+        Server side: create a fresh ring file sized for frames of up to slot_bytes
+        Returns None if the shared volume is not available
+        """
+        path = path or os.environ.get('TMS_SHM_PATH', cls.DEFAULT_PATH)
+        num_slots = num_slots or cls.NUM_SLOTS
+        slot_stride, data_offset, size = cls._layout(int(slot_bytes), num_slots)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Unlink instead of truncating, a client may still map the previous file
+            if os.path.exists(path):
+                os.unlink(path)
+            with open(path, 'w+b') as f:
+                f.truncate(size)
+                mapping = mmap.mmap(f.fileno(), size)
+        except (OSError, ValueError) as e:
+            print(f"Shared memory ring unavailable at {path}: {e}")
+            return None
+
+        header = np.frombuffer(mapping, dtype='<i8', count=cls.HEADER_WORDS)
+        header[1:6] = [cls.VERSION, num_slots, slot_bytes, slot_stride, data_offset]
+        header[0] = cls.MAGIC  # written last, marks the file as ready
+        print(f"Shared memory ring at {path}: {num_slots} slots x {slot_bytes / 1e6:.1f} MB")
+        return cls(path, mapping, owner=True)
+
+    @classmethod
+    def open(cls, path=None):
+        """
+        Client side: map an existing ring file
+        Returns None if it does not exist or is not a valid ring
+        """
+        path = path or os.environ.get('TMS_SHM_PATH', cls.DEFAULT_PATH)
+        try:
+            with open(path, 'r+b') as f:
+                mapping = mmap.mmap(f.fileno(), 0)
+        except (OSError, ValueError) as e:
+            print(f"Shared memory ring not available at {path}: {e}")
+            return None
+
+        header = np.frombuffer(mapping, dtype='<i8', count=cls.HEADER_WORDS)
+        if mapping.size() < cls.HEADER_WORDS * 8 or header[0] != cls.MAGIC or header[1] != cls.VERSION:
+            print(f"Shared memory ring at {path} is not initialised")
+            del header
+            mapping.close()
+            return None
+        _, _, size = cls._layout(int(header[3]), int(header[2]))
+        if mapping.size() < size:
+            print(f"Shared memory ring at {path} is truncated")
+            del header
+            mapping.close()
+            return None
+        del header
+        return cls(path, mapping, owner=False)
+
+    def _slot_view(self, slot, count):
+        return np.frombuffer(self._map, dtype='<f4', count=count,
+                             offset=self.data_offset + slot * self.slot_stride)
+
+    def write(self, frame_id, data):
+        """
+        Copy a float32 volume into the slot for frame_id
+        Data is stored Fortran ordered, the order Slicer expects for vtkImageData
+        Returns the slot index, or None if the frame does not fit
+        """
+        if data.nbytes > self.slot_bytes or data.ndim != 3:
+            return None
+        slot = frame_id % self.num_slots
+        header = self.slots[slot]
+        header[0] += 1  # odd: being written
+        np.copyto(self._slot_view(slot, data.size).reshape(data.shape, order='F'), data, casting='same_kind')
+        header[1] = frame_id
+        header[2] = data.nbytes
+        header[3:6] = data.shape
+        header[0] += 1  # even: ready
+        return slot
+
+    def read(self, frame_id, slot):
+        """
+        Wrap the frame in a slot without copying
+        Returns (flat float32 view in Fortran order, shape) or None if the slot
+        is being written or already holds another frame. The server rewrites
+        the slot num_slots frames later: copy the view out, then check
+        is_current to know the copy is not torn.
+        """
+        if not 0 <= slot < self.num_slots:
+            return None
+        header = self.slots[slot]
+        seq = int(header[0])
+        if seq % 2 or int(header[1]) != frame_id:
+            return None
+        shape = tuple(int(s) for s in header[3:6])
+        view = self._slot_view(slot, int(header[2]) // 4)
+        if int(header[0]) != seq:
+            return None
+        return view, shape
+
+    def is_current(self, frame_id, slot):
+        """True while the slot still holds frame_id, i.e. the server has not recycled it"""
+        header = self.slots[slot]
+        return int(header[0]) % 2 == 0 and int(header[1]) == frame_id
+
+    def close(self):
+        self.header = None
+        self.slots = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Views handed out by read() are still alive, the mapping goes with them
+            pass
+
+    @staticmethod
+    def format_notice(frame_id, slot):
+        return f"{SharedMemoryRing.NOTICE_PREFIX}{frame_id}:{slot}"
+
+    @staticmethod
+    def parse_notice(message):
+        """Parse 'SHM:<frame_id>:<slot>', returns (frame_id, slot) or None"""
+        if not message or not message.startswith(SharedMemoryRing.NOTICE_PREFIX):
+            return None
+        try:
+            frame_id, slot = message[len(SharedMemoryRing.NOTICE_PREFIX):].split(':')
+            return int(frame_id), int(slot)
+        except ValueError:
+            return None
@@ -3,8 +3,13 @@ Simplified chunked transmission for PyIGTL - minimal implementation
 Works with Slicer 5.8.1 and newer versions
 """
 
+import logging
 import numpy as np
 import struct
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
 
 class SimpleChunker:
     """
@@ -14,11 +19,15 @@ class SimpleChunker:
     
     CHUNK_SIZE = 51200  # 50KB - safe for most networks
     MAGIC_NUMBER = 3735928559  # 0xDEADBEEF in little-endian - platform independent
+    ACK_PREFIX = "ACK"
+    NACK_PREFIX = "NACK"
     
     @staticmethod
-    def create_chunks(data):
+    def create_chunks(data, frame_id=0):
         """
         Split array into chunks with simple headers
+        frame_id: monotonically increasing sender frame counter, carried in the
+                  metadata and every chunk header and echoed back in acks
         Returns: list of (is_metadata, data_array) tuples
         """
         # CRITICAL: Ensure consistent data format across platforms
@@ -33,7 +42,7 @@ class SimpleChunker:
         total_elements = data_flat.size
         num_chunks = int(np.ceil(total_elements / elements_per_chunk))
         
-        print(f"[Chunker] Splitting {original_shape} into {num_chunks} chunks")
+        log.debug("Splitting %s into %d chunks", original_shape, num_chunks)
         
         chunks = []
         
@@ -46,6 +55,8 @@ class SimpleChunker:
         metadata[3] = original_shape[1]
         metadata[4] = original_shape[2]
         metadata[5] = total_elements
+        metadata[6] = frame_id
+        metadata[7] = elements_per_chunk
         
         # Reshape to 3D for PyIGTL (minimum size)
         meta_3d = metadata.reshape(10, 10, 1)
@@ -58,9 +69,9 @@ class SimpleChunker:
             
             chunk_data = data_flat[start_idx:end_idx]
             
-            # Add header to chunk: [chunk_index, chunk_size, checksum]
+            # Add header to chunk: [chunk_index, chunk_size, checksum, frame_id]
             # Force consistent dtype
-            header = np.array([i, len(chunk_data), np.sum(chunk_data)], dtype='<f4')
+            header = np.array([i, len(chunk_data), np.sum(chunk_data), frame_id], dtype='<f4')
             chunk_with_header = np.concatenate([header, chunk_data])
             
             # Ensure C-contiguous
@@ -79,30 +90,94 @@ class SimpleChunker:
         
         magic = int(meta_flat[0])
         if magic != SimpleChunker.MAGIC_NUMBER:
-            print(f"[Chunker] WARNING: Magic number mismatch: {magic} != {SimpleChunker.MAGIC_NUMBER}")
+            log.warning("Magic number mismatch: %s != %s", magic, SimpleChunker.MAGIC_NUMBER)
         
         return {
             'num_chunks': int(meta_flat[1]),
             'shape': (int(meta_flat[2]), int(meta_flat[3]), int(meta_flat[4])),
-            'total_elements': int(meta_flat[5])
+            'total_elements': int(meta_flat[5]),
+            'frame_id': int(meta_flat[6]),
+            'elements_per_chunk': int(meta_flat[7]) or SimpleChunker.CHUNK_SIZE // 4
         }
     
+    HEADER_SIZE = 4  # chunk_index, chunk_size, checksum, frame_id
+    
     @staticmethod
     def parse_chunk(chunk_array):
-        """Parse a data chunk and return (index, data, checksum)"""
-        chunk_flat = chunk_array.flatten()
+        """
+        Parse a data chunk and return (frame_id, index, data, checksum)
+        data is a view into chunk_array
+        """
+        chunk_flat = chunk_array.ravel()
         
         chunk_index = int(chunk_flat[0])
         chunk_size = int(chunk_flat[1])
         checksum = chunk_flat[2]
-        data = chunk_flat[3:3+chunk_size]
+        frame_id = int(chunk_flat[3])
+        header_size = SimpleChunker.HEADER_SIZE
+        data = chunk_flat[header_size:header_size+chunk_size]
         
         # Verify checksum
         actual_checksum = np.sum(data)
         if not np.isclose(checksum, actual_checksum, rtol=1e-5):
-            print(f"[Chunker] WARNING: Checksum mismatch for chunk {chunk_index}")
+            log.warning("Checksum mismatch for chunk %d", chunk_index)
         
-        return chunk_index, data, checksum
+        return frame_id, chunk_index, data, checksum
+    
+    @staticmethod
+    def format_ranges(indices):
+        """Encode chunk indices as inclusive ranges, e.g. 0-15,17-20"""
+        ranges = []
+        for idx in sorted(indices):
+            if ranges and idx == ranges[-1][1] + 1:
+                ranges[-1][1] = idx
+            else:
+                ranges.append([idx, idx])
+        return ",".join(f"{start}-{end}" for start, end in ranges)
+    
+    @staticmethod
+    def parse_ranges_message(text, prefix):
+        """Parse "<prefix>:<frame_id>:<ranges>", returns (frame_id, [(start, end), ...]) or None"""
+        parts = text.strip().split(":")
+        if len(parts) != 3 or parts[0] != prefix:
+            return None
+        try:
+            frame_id = int(parts[1])
+            ranges = []
+            for item in parts[2].split(","):
+                if item:
+                    start, end = item.split("-")
+                    ranges.append((int(start), int(end)))
+        except ValueError:
+            return None
+        return frame_id, ranges
+    
+    @staticmethod
+    def format_ack(frame_id, indices):
+        """
+        Encode received chunk indices as a cumulative ack string
+        e.g. "ACK:12:0-15,17-20" - ranges are inclusive
+        """
+        return f"{SimpleChunker.ACK_PREFIX}:{frame_id}:{SimpleChunker.format_ranges(indices)}"
+    
+    @staticmethod
+    def parse_ack(text):
+        """Parse an ack string, returns (frame_id, [(start, end), ...]) or None"""
+        return SimpleChunker.parse_ranges_message(text, SimpleChunker.ACK_PREFIX)
+    
+    @staticmethod
+    def format_nack(frame_id, indices):
+        """Encode a repair request for missing chunks, e.g. NACK:12:16-16,21-23"""
+        return f"{SimpleChunker.NACK_PREFIX}:{frame_id}:{SimpleChunker.format_ranges(indices)}"
+    
+    @staticmethod
+    def parse_nack(text):
+        """Parse a repair request, returns (frame_id, [chunk_index, ...]) or None"""
+        nack = SimpleChunker.parse_ranges_message(text, SimpleChunker.NACK_PREFIX)
+        if nack is None:
+            return None
+        frame_id, ranges = nack
+        return frame_id, [idx for start, end in ranges for idx in range(start, end + 1)]
     
     @staticmethod
     def reassemble(chunks_list, expected_shape):
@@ -122,7 +197,7 @@ class SimpleChunker:
         # Reshape to original shape
         total_expected = np.prod(expected_shape)
         if len(all_data) != total_expected:
-            print(f"[Chunker] WARNING: Size mismatch - got {len(all_data)}, expected {total_expected}")
+            log.warning("Size mismatch - got %d, expected %d", len(all_data), total_expected)
             all_data = all_data[:total_expected]  # Trim to expected size
         
         result = all_data.reshape(expected_shape)
@@ -130,68 +205,341 @@ class SimpleChunker:
         # Convert back to native float32 for Slicer
         result = np.asarray(result, dtype=np.float32)
         
-        print(f"[Chunker] Reassembled to shape {result.shape}")
+        log.debug("Reassembled to shape %s", result.shape)
         
         return result
 
 
+class FrameRing:
+    """
+    Sender-side ring buffer of the last few serialised frames, keyed by frame id
+    Lets the server answer repair requests without re-running inference
+    """
+    
+    CAPACITY = 4  # frames kept for retransmission
+    
+    def __init__(self, capacity=None):
+        self.capacity = capacity or FrameRing.CAPACITY
+        self.frames = OrderedDict()
+    
+    def put(self, frame_id, data_chunks):
+        """Store the data chunks of a frame, evicting the oldest frame if full"""
+        self.frames[frame_id] = data_chunks
+        while len(self.frames) > self.capacity:
+            self.frames.popitem(last=False)
+    
+    def get(self, frame_id, indices):
+        """Return [(chunk_index, chunk_data), ...] still available for a frame"""
+        data_chunks = self.frames.get(frame_id)
+        if data_chunks is None:
+            return []
+        return [(idx, data_chunks[idx]) for idx in indices if 0 <= idx < len(data_chunks)]
+
+
+class FlowController:
+    """
+    AIMD send window for chunked frames, driven by the receiver's acks
+    
+    The receiver acks the chunk ranges it has processed over the text channel.
+    Clean acks grow the window by about one chunk per window acked, a gap
+    below the highest acked chunk or an ack timeout halves it. Until the peer
+    has acked anything the sender falls back to fixed pacing, so receivers
+    that never ack still work. Retransmitted chunks go out after higher ones,
+    so a gap says nothing about them; only the ack timeout counts them lost.
+    """
+    
+    INITIAL_WINDOW = 16  # chunks in flight
+    MIN_WINDOW = 2
+    MAX_WINDOW = 512
+    ACK_TIMEOUT = 0.25  # seconds without ack progress before shrinking
+    LEGACY_PACING = 0.01  # seconds between chunks for receivers that never ack
+    
+    def __init__(self, initial_window=None, min_window=None, max_window=None, ack_timeout=None):
+        self.min_window = min_window or FlowController.MIN_WINDOW
+        self.max_window = max_window or FlowController.MAX_WINDOW
+        self.ack_timeout = ack_timeout or FlowController.ACK_TIMEOUT
+        self.window = float(initial_window or FlowController.INITIAL_WINDOW)
+        self.peer_acks = False
+        self.start_frame(None, 0, 0)
+    
+    def start_frame(self, frame_id, num_chunks, num_bytes):
+        """Reset per-frame state, the window carries over between frames"""
+        self.frame_id = frame_id
+        self.num_chunks = num_chunks
+        self.num_bytes = num_bytes
+        self.in_flight = set()
+        self.retransmitted = set()  # in flight again after a repair request
+        self.acked = set()
+        self.lost = 0
+        self.start_time = time.time()
+        self.last_progress = self.start_time
+    
+    def can_send(self):
+        """True if another chunk may be put on the wire"""
+        if not self.peer_acks:
+            return True
+        return len(self.in_flight) < int(self.window)
+    
+    def on_sent(self, chunk_index, retransmit=False):
+        if not self.in_flight:
+            self.last_progress = time.time()
+        self.in_flight.add(chunk_index)
+        if retransmit:
+            self.retransmitted.add(chunk_index)
+    
+    def on_ack(self, frame_id, ranges):
+        """Process a cumulative ack, returns number of newly acked chunks"""
+        if frame_id != self.frame_id:
+            return 0  # stale ack from an earlier frame
+        self.peer_acks = True
+        
+        newly_acked = 0
+        highest = -1
+        for start, end in ranges:
+            for idx in range(start, end + 1):
+                if idx in self.in_flight:
+                    self.in_flight.discard(idx)
+                    self.retransmitted.discard(idx)
+                    self.acked.add(idx)
+                    newly_acked += 1
+            highest = max(highest, end)
+        
+        # Chunks travel in order, so anything sent once below the highest ack is gone
+        gaps = [idx for idx in self.in_flight if idx < highest and idx not in self.retransmitted]
+        if gaps:
+            self.in_flight.difference_update(gaps)
+            self.lost += len(gaps)
+            self._decrease()
+        elif newly_acked:
+            self.window = min(self.max_window, self.window + newly_acked / self.window)
+        
+        if newly_acked:
+            self.last_progress = time.time()
+        return newly_acked
+    
+    def check_timeout(self):
+        """Treat in-flight chunks as lost if no ack progress for ack_timeout"""
+        if not self.peer_acks or not self.in_flight:
+            return False
+        now = time.time()
+        if now - self.last_progress < self.ack_timeout:
+            return False
+        self.lost += len(self.in_flight)
+        self.in_flight.clear()
+        self.retransmitted.clear()
+        self._decrease()
+        self.last_progress = now
+        return True
+    
+    def _decrease(self):
+        self.window = max(self.min_window, self.window / 2.0)
+    
+    def frame_done(self, num_sent):
+        """True once every chunk was sent and nothing is awaiting an ack"""
+        if num_sent < self.num_chunks:
+            return False
+        return not self.peer_acks or not self.in_flight
+    
+    def frame_stats(self):
+        """Effective throughput of the current frame"""
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        return {
+            'frame_id': self.frame_id,
+            'elapsed': elapsed,
+            'megabytes': self.num_bytes / 1e6,
+            'throughput_mbps': self.num_bytes / 1e6 / elapsed,
+            'window': int(self.window),
+            'lost': self.lost
+        }
+
+
+class FrameAssembly:
+    """
+    Reassembly state of one frame
+    One output buffer is allocated from the metadata and every chunk is
+    copied straight into its slot. A bitmap tracks which chunks arrived.
+    """
+    
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.frame_id = metadata['frame_id']
+        self.buffer = np.empty(metadata['total_elements'], dtype='<f4')
+        self.received = np.zeros(metadata['num_chunks'], dtype=bool)  # bitmap of received chunks
+        self.num_received = 0
+        self.highest_index = -1
+        self.nacked = {}  # chunk index -> time of last repair request
+        self.repair_rounds = 0
+    
+    def add(self, chunk_idx, data):
+        """Copy a chunk into its slot, returns False for duplicates and bad chunks"""
+        if not 0 <= chunk_idx < len(self.received):
+            log.error("Chunk index %d out of range", chunk_idx)
+            return False
+        if self.received[chunk_idx]:
+            # Silently ignore duplicates (common with network retransmission)
+            return False
+        
+        start = chunk_idx * self.metadata['elements_per_chunk']
+        end = start + data.size
+        if end > self.buffer.size:
+            log.error("Chunk %d overruns the frame buffer", chunk_idx)
+            return False
+        self.buffer[start:end] = data
+        self.received[chunk_idx] = True
+        self.num_received += 1
+        self.highest_index = max(self.highest_index, chunk_idx)
+        return True
+    
+    def is_complete(self):
+        return self.num_received == self.metadata['num_chunks']
+    
+    def missing_indices(self):
+        return np.flatnonzero(~self.received).tolist()
+    
+    def result(self):
+        """The reassembled frame, a view of the buffer (no copy)"""
+        return self.buffer.reshape(self.metadata['shape'])
+
+
 class SimpleReceiver:
-    """Simple receiver state machine"""
+    """
+    Simple receiver state machine
+    Keeps up to MAX_FRAMES_IN_FLIGHT frames in reassembly at once, keyed by
+    the frame id carried in metadata and chunks, so interleaved or slow
+    frames are never mixed. When a frame completes, older incomplete frames
+    are abandoned and counted.
+    """
     
-    def __init__(self):
+    ACK_EVERY = 8  # chunks between acks sent back to the sender
+    REPAIR_TIMEOUT = 0.2  # seconds of silence before requesting missing chunks
+    MAX_REPAIR_ROUNDS = 5  # give up on a frame after this many timed out requests
+    MAX_FRAMES_IN_FLIGHT = 3
+    
+    def __init__(self, max_frames_in_flight=None):
+        self.max_frames_in_flight = max_frames_in_flight or SimpleReceiver.MAX_FRAMES_IN_FLIGHT
+        self.completed_frames = 0
+        self.abandoned_frames = 0
         self.reset()
     
     def reset(self):
-        self.metadata = None
-        self.chunks = []
-        self.received_indices = set()
-        self.last_metadata_time = 0
+        self.frames = OrderedDict()  # frame id -> FrameAssembly, oldest first
+        self.current = None  # frame that received the latest chunk
+        self.ready = None  # completed frame waiting for get_result
+        self.last_completed_id = -1
+    
+    def _abandon(self, frame_id, reason):
+        frame = self.frames.pop(frame_id)
+        self.abandoned_frames += 1
+        log.warning("Abandoned frame %d (%d/%d chunks): %s", frame_id, frame.num_received, frame.metadata['num_chunks'], reason)
     
     def add_metadata(self, meta_array):
-        """Process metadata - resets state for new transmission"""
-        import time
-        current_time = time.time()
-        
-        # If we get new metadata, it means a new transmission started
-        # Reset everything
-        if self.metadata is not None and (current_time - self.last_metadata_time) > 0.1:
-            print(f"[Receiver] New transmission detected, resetting...")
-            self.reset()
+        """Process metadata - opens a reassembly slot for its frame"""
+        metadata = SimpleChunker.parse_metadata(meta_array)
+        frame_id = metadata['frame_id']
+        if frame_id <= self.last_completed_id or frame_id in self.frames:
+            return  # stale or repeated metadata
         
-        self.metadata = SimpleChunker.parse_metadata(meta_array)
-        self.last_metadata_time = current_time
-        print(f"[Receiver] Metadata: {self.metadata['num_chunks']} chunks, shape {self.metadata['shape']}")
+        self.frames[frame_id] = FrameAssembly(metadata)
+        while len(self.frames) > self.max_frames_in_flight:
+            self._abandon(next(iter(self.frames)), "too many frames in flight")
+        log.debug("Metadata: frame %d, %d chunks, shape %s", frame_id, metadata['num_chunks'], metadata['shape'])
     
     def add_chunk(self, chunk_array):
         """Process data chunk"""
-        if self.metadata is None:
-            print("[Receiver] ERROR: Received chunk before metadata")
-            return False
+        frame_id, chunk_idx, data, checksum = SimpleChunker.parse_chunk(chunk_array)
         
-        chunk_idx, data, checksum = SimpleChunker.parse_chunk(chunk_array)
+        frame = self.frames.get(frame_id)
+        if frame is None:
+            if frame_id > self.last_completed_id:
+                log.error("Received chunk of frame %d before metadata", frame_id)
+            return False  # late chunk of a completed or abandoned frame
         
-        if chunk_idx in self.received_indices:
-            # Silently ignore duplicates (common with network retransmission)
+        if not frame.add(chunk_idx, data):
             return False
+        self.current = frame
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Frame %d: chunk %d/%d received (%d total)", frame_id, chunk_idx + 1, frame.metadata['num_chunks'], frame.num_received)
         
-        self.chunks.append((chunk_idx, data))
-        self.received_indices.add(chunk_idx)
-        
-        print(f"[Receiver] Chunk {chunk_idx + 1}/{self.metadata['num_chunks']} received ({len(self.chunks)} total)")
+        if frame.is_complete():
+            del self.frames[frame_id]
+            for older_id in [fid for fid in self.frames if fid < frame_id]:
+                self._abandon(older_id, f"frame {frame_id} completed first")
+            self.ready = frame
+            self.last_completed_id = frame_id
+            self.completed_frames += 1
         return True
     
-    def is_complete(self):
-        """Check if all chunks received"""
-        if self.metadata is None:
+    def should_ack(self):
+        """Ack every ACK_EVERY chunks of a frame and once the frame is complete"""
+        if self.current is None or self.current.num_received == 0:
             return False
-        return len(self.chunks) == self.metadata['num_chunks']
+        return self.current.num_received % SimpleReceiver.ACK_EVERY == 0 or self.current.is_complete()
+    
+    def ack_message(self):
+        """Cumulative ack for the frame that received the latest chunk"""
+        return SimpleChunker.format_ack(self.current.frame_id, np.flatnonzero(self.current.received).tolist())
+    
+    def missing_indices(self):
+        """Chunk indices of the newest incomplete frame not received yet"""
+        frame = self._newest_incomplete()
+        if frame is None:
+            return []
+        return frame.missing_indices()
+    
+    def _newest_incomplete(self):
+        if not self.frames:
+            return None
+        return self.frames[next(reversed(self.frames))]
+    
+    def repair_request(self, timed_out=False):
+        """
+        NACK string for lost chunks, or None
+        Chunks arrive in order, so a gap below the highest received index of
+        the current frame is a loss. On timeout (no chunk for REPAIR_TIMEOUT)
+        the missing tail of the newest incomplete frame is requested as well.
+        Gap requests skip chunks already requested within REPAIR_TIMEOUT.
+        """
+        frame = self._newest_incomplete() if timed_out else self.current
+        if frame is None or frame.is_complete() or frame.frame_id not in self.frames:
+            return None
+        if timed_out:
+            if frame.repair_rounds >= SimpleReceiver.MAX_REPAIR_ROUNDS:
+                return None
+            frame.repair_rounds += 1
+        
+        now = time.time()
+        missing = [idx for idx in frame.missing_indices()
+                   if timed_out or (idx < frame.highest_index
+                                    and now - frame.nacked.get(idx, 0) >= SimpleReceiver.REPAIR_TIMEOUT)]
+        if not missing:
+            return None
+        for idx in missing:
+            frame.nacked[idx] = now
+        log.info("Requesting %d missing chunks of frame %d", len(missing), frame.frame_id)
+        return SimpleChunker.format_nack(frame.frame_id, missing)
+    
+    def is_complete(self):
+        """Check if a completed frame is waiting for get_result"""
+        return self.ready is not None
+    
+    def pending(self):
+        """True while any frame is still being reassembled"""
+        return bool(self.frames)
+    
+    def stats(self):
+        return {
+            'completed_frames': self.completed_frames,
+            'abandoned_frames': self.abandoned_frames,
+            'frames_in_flight': len(self.frames)
+        }
     
     def get_result(self):
-        """Reassemble and return result"""
-        if not self.is_complete():
-            print(f"[Receiver] ERROR: Incomplete - {len(self.chunks)}/{self.metadata['num_chunks']} chunks")
+        """Hand over the newest completed frame buffer (no copy)"""
+        if self.ready is None:
+            log.error("No complete frame - %d frames in flight", len(self.frames))
             return None
         
-        result = SimpleChunker.reassemble(self.chunks, self.metadata['shape'])
-        self.reset()  # Reset for next transmission
+        result = self.ready.result()
+        log.debug("Reassembled frame %d to shape %s", self.ready.frame_id, result.shape)
+        self.ready = None  # the buffer now belongs to the caller
         return result
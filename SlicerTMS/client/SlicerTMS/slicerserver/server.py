@@ -1,5 +1,13 @@
 #import os
+import asyncio
+import collections
+import logging
+import os
+import queue
 import socket, ssl
+import threading
+import time
+import numpy as np
 from __main__ import qt
 
 from tornado.httpserver import HTTPServer
@@ -9,22 +17,45 @@ from tornado.web import StaticFileHandler
 
 from requesthandlers import SlicerWebSocketHandler
 
+log = logging.getLogger(__name__)
+
 
 class Server:
+    """
+    Tornado web server next to the Qt event loop of Slicer, without a busy
+    loop. Two ways to run the two loops (loopMode, or TMS_WEB_LOOP):
+      - 'timer': a QTimer runs one non-blocking iteration of the Tornado
+        loop every POLL_INTERVAL ms on the main thread
+      - 'thread': Tornado runs on its own thread with its own asyncio loop
+        and a QTimer on the main thread drains what it queued
+    Either way handlers touch the scene from the main thread only: they
+    queue scene work with dispatch(), where a burst of poses from a client
+    collapses into the latest one, and write to the client with reply(),
+    which goes back through IOLoop.add_callback.
+    """
+
+    LOOP_MODES = ('timer', 'thread')
+    POLL_INTERVAL = 10  # ms, Tornado iterations (timer) or queue drains (thread)
+    WINDOW = 200  # dispatched calls kept for the latency percentiles
+
     def __init__(self, server_address=("0.0.0.0", 2016), docroot=b'.', logFile=None,
-                 logMessage=None, certfile=None, keyfile=None, app=None):
+                 logMessage=None, certfile=None, keyfile=None, app=None, loopMode=None):
         self.address, self.port = server_address
         self.docroot = docroot
         self.timeout = 1.
         self.logFile = logFile
         if logMessage:
             self.logMessage = logMessage
+        self.loopMode = loopMode or os.environ.get('TMS_WEB_LOOP', 'timer')
+        if self.loopMode not in Server.LOOP_MODES:
+            raise ValueError(f"Unknown web server loop mode {self.loopMode!r}, expected one of {Server.LOOP_MODES}")
         print("WebServer Connected!")
 
         if app is None:
             # the StaticFileHandler only takes the path arg as a string, so we have to decode the byte string
             app = Application([(r"/websocket", SlicerWebSocketHandler),
-                               (r"/(.*)", StaticFileHandler, {"path": docroot, "default_filename": "index.html"})])
+                               (r"/(.*)", StaticFileHandler, {"path": docroot, "default_filename": "index.html"})],
+                              server=self)
             #app = Application(handlers=[(r"/",SlicerWebSocketHandler)])
 
         if certfile is not None and keyfile is not None:
@@ -37,27 +68,128 @@ class Server:
             print("Running in Non Secure Mode")
             self.server = HTTPServer(app)
 
-        self.running = True
+        self.loop = None  # the Tornado IOLoop, main thread (timer) or server thread (thread)
+        self.thread = None
+        self.listenError = None
+        self.queue = queue.Queue()  # (received, key, function, args) for the main thread
+        self.timer = qt.QTimer()
+        self.timer.setInterval(Server.POLL_INTERVAL)
+        self.latencies = collections.deque(maxlen=Server.WINDOW)
+        self.dispatched = 0
+        self.coalesced = 0
+        self.running = False
 
     def start(self, app=None):
+        """Listen and return; the Tornado loop then runs from the Qt loop or its own thread"""
         if app:
             self.server = HTTPServer(app)
-        self.server.listen(self.port, self.address)
-        #self.server.start()
-
-        # runs the two event loops on the same thread
-        while self.running:
-            # stop then start runs the loop once
-            IOLoop.current().stop()
-            IOLoop.current().start()
-            if __name__ != "__main__" and qt.QCoreApplication.hasPendingEvents():
-                qt.QCoreApplication.processEvents()
+        self.running = True
+        if self.loopMode == 'thread':
+            ready = threading.Event()
+            self.thread = threading.Thread(target=self.runThread, args=(ready,), name='TMSWebServer', daemon=True)
+            self.thread.start()
+            ready.wait()
+            if self.listenError is not None:
+                self.running = False
+                raise self.listenError
+            self.timer.connect('timeout()', self.drain)
         else:
-            self.server.stop()
+            self.loop = IOLoop.current()
+            self.server.listen(self.port, self.address)
+            self.timer.connect('timeout()', self.runOnce)
+        self.timer.start()
+        log.info("Web server on port %d, %s loop", self.port, self.loopMode)
+
+    def runOnce(self):
+        """Timer callback (timer mode): one iteration of the Tornado loop, then the calls it queued"""
+        # with the stop pending the loop polls its sockets without blocking
+        self.loop.stop()
+        self.loop.start()
+        self.drain()
+
+    def runThread(self, ready):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.loop = IOLoop.current()
+        try:
+            self.server.listen(self.port, self.address)
+        except OSError as e:
+            self.listenError = e
+            self.loop.close(all_fds=True)
+            return
+        finally:
+            ready.set()
+        self.loop.start()
+        # stopped by stop()
+        self.server.stop()
+        self.loop.close(all_fds=True)
+
+    def dispatch(self, function, *args, key=None):
+        """
+        Run function(*args) on the main thread, called by the handlers on the
+        Tornado loop. Queued calls with the same key are coalesced: only the
+        latest one runs, e.g. one pose per drain and client.
+        """
+        self.queue.put((time.perf_counter(), key, function, args))
+
+    def drain(self):
+        """Run on the main thread what the handlers queued since the last drain"""
+        calls = []
+        latest = {}
+        while True:
+            try:
+                call = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            key = call[1]
+            if key is not None and key in latest:
+                calls[latest[key]] = None
+                self.coalesced += 1
+            if key is not None:
+                latest[key] = len(calls)
+            calls.append(call)
+        for call in calls:
+            if call is not None:
+                received, key, function, args = call
+                self.call(received, function, args)
+
+    def call(self, received, function, args):
+        try:
+            function(*args)
+        except Exception as e:
+            log.error("Web request %s failed: %s", getattr(function, '__name__', function), e)
+        self.latencies.append(time.perf_counter() - received)
+        self.dispatched += 1
+
+    def reply(self, handler, message, binary=False):
+        """Write to a websocket from the main thread, on the thread of the Tornado loop"""
+        def write():
+            if handler.ws_connection is not None:
+                handler.write_message(message, binary)
+        if self.running:
+            self.loop.add_callback(write)
+
+    def stats(self):
+        """Dispatched calls, coalesced poses and the received-to-done p50/p95 in ms"""
+        stats = {'loop': self.loopMode, 'dispatched': self.dispatched, 'coalesced': self.coalesced}
+        if self.latencies:
+            p50, p95 = np.percentile(np.fromiter(self.latencies, dtype=np.float64), (50, 95)) * 1000.0
+            stats.update({'p50 ms': round(float(p50), 2), 'p95 ms': round(float(p95), 2)})
+        return stats
 
     def stop(self):
         self.logMessage("Stopping Server")
+        if not self.running:
+            return
         self.running = False
+        self.timer.stop()
+        if self.loopMode == 'thread':
+            self.timer.disconnect('timeout()', self.drain)
+            self.loop.add_callback(self.loop.stop)
+            self.thread.join(timeout=5.0)
+        else:
+            self.timer.disconnect('timeout()', self.runOnce)
+            self.server.stop()
+        log.info("Web server stopped: %s", self.stats())
 
     def logMessage(self, message):
         if self.logFile:
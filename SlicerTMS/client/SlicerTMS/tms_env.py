@@ -80,6 +80,7 @@ def get_tms_config(defaults: Optional[Dict[str, str]] = None) -> Dict[str, str]:
         'TMS_SERVER_HOST': 'localhost',
         'TMS_SERVER_PORT_1': '18944',
         'TMS_SERVER_PORT_2': '18945',
+        'TMS_SHM_PATH': '/dev/shm/slicertms/efield_ring',
         'TMS_DATA_DIR': '/root/slicer/packages/Slicer-*/lib/Slicer-5.8/qt-scripted-modules/data'
     }
     
@@ -102,7 +103,7 @@ def get_tms_config(defaults: Optional[Dict[str, str]] = None) -> Dict[str, str]:
     config.update(file_env)
     
     # Source 2: Docker environment variables passed at runtime
-    for key in ['TMS_SERVER_HOST', 'TMS_SERVER_PORT_1', 'TMS_SERVER_PORT_2']:
+    for key in ['TMS_SERVER_HOST', 'TMS_SERVER_PORT_1', 'TMS_SERVER_PORT_2', 'TMS_SHM_PATH']:
         env_value = os.environ.get(key)
         if env_value:
             config[key] = env_value
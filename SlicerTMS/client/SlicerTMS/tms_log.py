@@ -0,0 +1,117 @@
+"""
+Logging setup for the TMS server and the Slicer module. The modules log through
+the standard library, each with its own logger:
+
+    import logging
+    log = logging.getLogger(__name__)
+    log.debug('Chunk %d/%d', i, n)            # formatted only when it is emitted
+    if log.isEnabledFor(logging.DEBUG):       # hot paths: skip building the arguments
+        log.debug('Field diff: %s', summary())
+
+The entry points (SlicerTMS.py, server_chunky.py) call setup_logging() once.
+The level of the TMS loggers comes from TMS_LOG_LEVEL (INFO), per-module
+levels from TMS_LOG_MODULES, e.g. "Mapper=DEBUG,simple_chunker=OFF".
+TMS_LOG_RING=N keeps the last N records (from TMS_LOG_RING_LEVEL, DEBUG by
+default) unformatted in memory, whatever the console shows; dump_ring()
+formats them after a problem.
+"""
+
+import collections
+import logging
+import os
+
+# Top-level loggers of the TMS modules, a package covers its submodules
+TMS_LOGGERS = ('Assets', 'FiberDownsample', 'Loader', 'Loader_chunky', 'Mapper', 'MeshLOD', 'RegionStats',
+               'Scheduler', 'Tracer', 'server_chunky', 'simple_chunker', 'requesthandlers', 'slicerserver')
+
+OFF = logging.CRITICAL + 1
+
+FORMAT = '[%(name)s] %(levelname)s: %(message)s'
+RING_FORMAT = '%(asctime)s ' + FORMAT
+
+_ring = None
+
+
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    level = str(level).strip().upper()
+    return OFF if level == 'OFF' else logging.getLevelName(level)
+
+
+class RingHandler(logging.Handler):
+    """The last records in a deque, formatted only when dumped"""
+
+    def __init__(self, size, level=logging.DEBUG):
+        super().__init__(level)
+        self.records = collections.deque(maxlen=size)
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _ConsoleHandler(logging.Handler):
+    """
+    With the ring on, the TMS loggers pass lower levels than the console shows;
+    this hands a record to the root handlers only from its module's level on
+    """
+
+    def __init__(self, levels):
+        super().__init__()
+        self.levels = levels  # logger name -> console level
+
+    def emit(self, record):
+        name = record.name
+        while name not in self.levels and '.' in name:
+            name = name.rpartition('.')[0]
+        if record.levelno >= self.levels.get(name, logging.NOTSET):
+            logging.getLogger().handle(record)
+
+
+def setup_logging(level=None, modules=None, ring=None, ring_level=None):
+    """
+    Console handler on the root logger unless the host already installed one
+    (Slicer does), then the level of the TMS loggers and per-module overrides
+    from "Mapper=DEBUG,simple_chunker=OFF". ring > 0 keeps that many records
+    from ring_level on in memory, see dump_ring(); 0 turns the ring off.
+    """
+    global _ring
+    logging.basicConfig(format=FORMAT)
+    level = parse_level(level or os.environ.get('TMS_LOG_LEVEL', 'INFO'))
+    levels = dict.fromkeys(TMS_LOGGERS, level)
+    spec = modules if modules is not None else os.environ.get('TMS_LOG_MODULES', '')
+    for item in filter(None, (s.strip() for s in spec.split(','))):
+        name, _, moduleLevel = item.rpartition('=')
+        if name:
+            levels[name.strip()] = parse_level(moduleLevel)
+
+    size = int(ring if ring is not None else os.environ.get('TMS_LOG_RING', '0') or 0)
+    ringLevel = parse_level(ring_level or os.environ.get('TMS_LOG_RING_LEVEL', 'DEBUG'))
+    old = _ring
+    _ring = RingHandler(size, ringLevel) if size > 0 else None
+    if _ring is not None and old is not None:
+        _ring.records.extend(old.records)
+    console = _ConsoleHandler(levels)
+    for name in TMS_LOGGERS:
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, (RingHandler, _ConsoleHandler)):
+                logger.removeHandler(handler)
+        logger.propagate = _ring is None
+        if _ring is not None:
+            logger.addHandler(_ring)
+            logger.addHandler(console)
+    for name, consoleLevel in levels.items():
+        logging.getLogger(name).setLevel(consoleLevel if _ring is None else min(consoleLevel, ringLevel))
+
+
+def dump_ring(path=None):
+    """Format the records in the ring; printed, or written to path. Returns the lines"""
+    formatter = logging.Formatter(RING_FORMAT)
+    lines = [formatter.format(record) for record in list(_ring.records if _ring is not None else ())]
+    if path is None:
+        print('\n'.join(lines))
+    else:
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return lines
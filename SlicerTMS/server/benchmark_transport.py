@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Loopback benchmark for the E-field transports.
+Starts a sender (pyigtl server, like server_chunky.py) and a receiver (pyigtl
+client standing in for Slicer) in separate processes and sends the same volume
+with each transport:
+
+    plain    one pyigtl ImageMessage per frame (server.py)
+    simple   SimpleChunker chunks with ack-driven flow control and NACK repair
+    chunked  ChunkedTransmission chunks with the per-frame digest table
+
+The chunker classes are imported, not copied, so changes to them are measured
+automatically. Each frame is sent once the receiver has reported the previous
+one, so latency is per frame. Reports MB/s, frame latency percentiles and CPU
+time of each process.
+
+Usage:
+    python3 benchmark_transport.py --sizes 64,128,200 --chunk-sizes 32768,51200,65536 --pacing 0,0.001
+    sudo python3 benchmark_transport.py --netem "delay 2ms loss 0.5%"   # needs tc and root
+"""
+
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+
+import numpy as np
+import pyigtl  # pylint: disable=import-error
+
+from simple_chunker import SimpleChunker, SimpleReceiver, FlowController, FrameRing
+from chunked_transmission import ChunkedTransmission, ChunkReceiver
+
+MODES = ('plain', 'simple', 'chunked')
+DONE_PREFIX = 'DONE:'
+CONNECT_TIMEOUT = 10.0
+
+
+class QueueingClient(pyigtl.OpenIGTLinkClient):
+    """
+    pyigtl client that keeps every incoming message, not only the latest per
+    device - Slicer's OpenIGTLinkIF handles each message as well
+    """
+
+    class _Incoming(dict):
+        def __init__(self):
+            super().__init__()
+            self.queue = collections.deque()
+
+        def __setitem__(self, device_name, message):
+            self.queue.append(message)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, start_now=False, **kwargs)
+        self.incoming_messages = QueueingClient._Incoming()
+        self.start()
+
+    def drain(self):
+        with self.lock_incoming_messages:
+            queue = self.incoming_messages.queue
+            messages = list(queue)
+            queue.clear()
+        return messages
+
+
+def wait_connected(node, timeout=CONNECT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not node.is_connected():
+        if time.monotonic() > deadline:
+            raise TimeoutError('no connection')
+        time.sleep(0.01)
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """The chunkers print per chunk like in production; hide it unless asked"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+class Sender:
+    """Sending side, mirrors the send paths of server.py and server_chunky.py"""
+
+    def __init__(self, server, pacing):
+        self.server = server
+        self.pacing = pacing
+        self.done = set()
+        self.flow = FlowController()
+        self.ring = FrameRing()
+
+    def poll(self):
+        for msg in self.server.get_latest_messages():
+            if not hasattr(msg, 'string'):
+                continue
+            ack = SimpleChunker.parse_ack(msg.string)
+            nack = SimpleChunker.parse_nack(msg.string)
+            if ack is not None:
+                self.flow.on_ack(*ack)
+            elif nack is not None:
+                frame_id, indices = nack
+                for idx, chunk_data in self.ring.get(frame_id, indices):
+                    self.server.send_message(pyigtl.ImageMessage(chunk_data, device_name="pyigtl_chunk"))
+                    if frame_id == self.flow.frame_id:
+                        self.flow.on_sent(idx, retransmit=True)
+            elif msg.string.startswith(DONE_PREFIX):
+                self.done.add(int(msg.string[len(DONE_PREFIX):]))
+
+    def pace(self):
+        if self.pacing > 0:
+            time.sleep(self.pacing)
+
+    def send_plain(self, frame_id, data):
+        self.server.send_message(pyigtl.ImageMessage(data, device_name="pyigtl_data"))
+
+    def send_simple(self, frame_id, data):
+        chunks, _ = SimpleChunker.create_chunks(data, frame_id=frame_id)
+        data_chunks = [chunk_data for is_metadata, chunk_data in chunks[1:]]
+        self.ring.put(frame_id, data_chunks)
+        self.server.send_message(pyigtl.ImageMessage(chunks[0][1], device_name="pyigtl_meta"))
+        self.flow.start_frame(frame_id, len(data_chunks), data.nbytes)
+
+        num_sent = 0
+        while not self.flow.frame_done(num_sent):
+            while num_sent < len(data_chunks) and self.flow.can_send():
+                self.server.send_message(pyigtl.ImageMessage(data_chunks[num_sent], device_name="pyigtl_chunk"))
+                self.flow.on_sent(num_sent)
+                num_sent += 1
+                self.pace()
+            self.poll()
+            self.flow.check_timeout()
+            if not self.flow.can_send() or num_sent == len(data_chunks):
+                time.sleep(0.001)
+
+    def send_chunked(self, frame_id, data):
+        metadata, chunks, _, _ = ChunkedTransmission.split_array_for_transmission(data)
+        self.server.send_message(pyigtl.ImageMessage(metadata, device_name="pyigtl_meta"))
+        for chunk in chunks:
+            self.server.send_message(pyigtl.ImageMessage(chunk, device_name="pyigtl_chunk"))
+            self.pace()
+
+
+def run_sender(mode, port, shape, chunk_size, pacing, frames, results, verbose):
+    SimpleChunker.CHUNK_SIZE = chunk_size
+    ChunkedTransmission.CHUNK_SIZE = chunk_size
+    data = np.random.default_rng(0).random(shape, dtype=np.float32)
+    server = pyigtl.OpenIGTLinkServer(port=port, local_server=True)
+    sender = Sender(server, pacing)
+    send = getattr(sender, 'send_' + mode)
+    starts = {}
+    try:
+        wait_connected(server)
+        cpu, wall = time.process_time(), time.monotonic()
+        with quiet(verbose):
+            for frame_id in range(1, frames + 1):
+                starts[frame_id] = time.monotonic()
+                send(frame_id, data)
+                deadline = time.monotonic() + CONNECT_TIMEOUT
+                while frame_id not in sender.done and time.monotonic() < deadline:
+                    sender.poll()
+                    time.sleep(0.0005)
+        results.put({'role': 'sender', 'starts': starts, 'nbytes': data.nbytes,
+                     'cpu': time.process_time() - cpu, 'wall': time.monotonic() - wall})
+    except Exception as e:
+        results.put({'role': 'sender', 'error': str(e)})
+    finally:
+        server.stop()
+
+
+def run_receiver(mode, port, frames, results, verbose):
+    client = QueueingClient(port=port)
+    finished = {}
+    simple = SimpleReceiver()
+    chunked = ChunkReceiver()
+    last_chunk = time.monotonic()
+    plain_frames = 0
+
+    def done(frame_id):
+        finished[frame_id] = time.monotonic()
+        client.send_message(pyigtl.StringMessage(DONE_PREFIX + str(frame_id), device_name="BenchDone"), wait=False)
+
+    try:
+        wait_connected(client)
+        cpu = time.process_time()
+        deadline = time.monotonic() + CONNECT_TIMEOUT * frames
+        with quiet(verbose):
+            while len(finished) < frames and time.monotonic() < deadline:
+                messages = client.drain()
+                if not messages:
+                    if mode == 'simple' and simple.pending() and time.monotonic() - last_chunk > SimpleReceiver.REPAIR_TIMEOUT:
+                        nack = simple.repair_request(timed_out=True)
+                        if nack:
+                            client.send_message(pyigtl.StringMessage(nack, device_name="RepairMessage"), wait=False)
+                        last_chunk = time.monotonic()
+                    time.sleep(0.0005)
+                    continue
+                for msg in messages:
+                    if msg.device_name == 'pyigtl_data':
+                        plain_frames += 1
+                        done(plain_frames)
+                    elif mode == 'simple':
+                        last_chunk = time.monotonic()
+                        if msg.device_name == 'pyigtl_meta':
+                            simple.add_metadata(msg.image)
+                            continue
+                        simple.add_chunk(msg.image)
+                        if simple.should_ack():
+                            client.send_message(pyigtl.StringMessage(simple.ack_message(), device_name="CommandMessage"), wait=False)
+                        nack = simple.repair_request()
+                        if nack:
+                            client.send_message(pyigtl.StringMessage(nack, device_name="RepairMessage"), wait=False)
+                        if simple.is_complete():
+                            frame_id = simple.ready.frame_id
+                            simple.get_result()
+                            done(frame_id)
+                    elif mode == 'chunked':
+                        if msg.device_name == 'pyigtl_meta':
+                            chunked.process_metadata(msg.image)
+                            continue
+                        chunked.add_chunk(msg.image)
+                        if chunked.is_complete() and chunked.reassemble() is not None:
+                            done(len(finished) + 1)
+        results.put({'role': 'receiver', 'finished': finished, 'cpu': time.process_time() - cpu})
+        time.sleep(0.1)  # let the last DONE go out
+    except Exception as e:
+        results.put({'role': 'receiver', 'error': str(e)})
+    finally:
+        client.stop()
+
+
+def run_case(mode, port, shape, chunk_size, pacing, frames, verbose=False):
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    sender = ctx.Process(target=run_sender, args=(mode, port, shape, chunk_size, pacing, frames, results, verbose))
+    receiver = ctx.Process(target=run_receiver, args=(mode, port, frames, results, verbose))
+    sender.start()
+    time.sleep(0.2)  # server socket up before the client connects
+    receiver.start()
+    reports = {}
+    for _ in range(2):
+        report = results.get(timeout=CONNECT_TIMEOUT * (frames + 2))
+        reports[report['role']] = report
+    sender.join()
+    receiver.join()
+
+    case = {'mode': mode, 'shape': list(shape), 'chunk_size': chunk_size, 'pacing': pacing, 'frames': frames}
+    errors = [f"{role}: {r['error']}" for role, r in reports.items() if 'error' in r]
+    if errors:
+        case['error'] = '; '.join(errors)
+        return case
+
+    snd, rcv = reports['sender'], reports['receiver']
+    latencies = np.array([rcv['finished'][i] - snd['starts'][i] for i in rcv['finished'] if i in snd['starts']])
+    case['received'] = len(rcv['finished'])
+    case['megabytes_per_s'] = snd['nbytes'] * len(rcv['finished']) / 1e6 / snd['wall']
+    if latencies.size:
+        p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+        case.update(latency_p50_ms=p50, latency_p95_ms=p95, latency_p99_ms=p99)
+    case['sender_cpu_s'] = snd['cpu']
+    case['receiver_cpu_s'] = rcv['cpu']
+    case['wall_s'] = snd['wall']
+    return case
+
+
+@contextlib.contextmanager
+def netem(spec, dev='lo'):
+    """Delay/loss emulation on the loopback device with tc netem, if available"""
+    if not spec:
+        yield False
+        return
+    tc = shutil.which('tc')
+    if tc is None:
+        print('tc not found, running without netem')
+        yield False
+        return
+    add = subprocess.run([tc, 'qdisc', 'add', 'dev', dev, 'root', 'netem'] + spec.split(),
+                         capture_output=True, text=True)
+    if add.returncode != 0:
+        print(f'Could not enable netem ({add.stderr.strip()}), running without it')
+        yield False
+        return
+    print(f'netem on {dev}: {spec}')
+    try:
+        yield True
+    finally:
+        subprocess.run([tc, 'qdisc', 'del', 'dev', dev, 'root'], capture_output=True)
+
+
+def sweep(modes, sizes, chunk_sizes, pacings):
+    """All cases; plain sends ignore chunk size and pacing so they run once per size"""
+    for mode, size in itertools.product(modes, sizes):
+        if mode == 'plain':
+            yield mode, size, 0, 0.0
+            continue
+        for chunk_size, pacing in itertools.product(chunk_sizes, pacings):
+            yield mode, size, chunk_size, pacing
+
+
+def print_case(case):
+    label = f"{case['mode']:<8} {case['shape'][0]:>4}^3 {case['chunk_size']:>7} {case['pacing']:>7.4f}"
+    if 'error' in case:
+        print(f"{label}  ERROR {case['error']}")
+        return
+    print(f"{label} {case['megabytes_per_s']:>8.1f} {case.get('latency_p50_ms', float('nan')):>8.1f} "
+          f"{case.get('latency_p95_ms', float('nan')):>8.1f} {case.get('latency_p99_ms', float('nan')):>8.1f} "
+          f"{case['sender_cpu_s']:>8.2f} {case['receiver_cpu_s']:>8.2f} {case['received']:>3}/{case['frames']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--sizes', default='64,128', help='volume edge lengths, comma separated')
+    parser.add_argument('--chunk-sizes', default='51200,65536', help='chunk sizes in bytes')
+    parser.add_argument('--pacing', default='0', help='extra sleep between chunks in seconds')
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--port', type=int, default=19944, help='first port, one per case')
+    parser.add_argument('--netem', default='', help='tc netem arguments, e.g. "delay 2ms loss 0.5%%"')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the chunkers\' own output')
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(',') if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f'unknown modes {sorted(unknown)}')
+    sizes = [int(s) for s in args.sizes.split(',')]
+    chunk_sizes = [int(s) for s in args.chunk_sizes.split(',')]
+    pacings = [float(s) for s in args.pacing.split(',')]
+
+    cases = []
+    with netem(args.netem) as emulated:
+        print(f"{'mode':<8} {'size':>6} {'chunk':>7} {'pacing':>7} {'MB/s':>8} {'p50 ms':>8} "
+              f"{'p95 ms':>8} {'p99 ms':>8} {'cpu snd':>8} {'cpu rcv':>8} frames")
+        for port, (mode, size, chunk_size, pacing) in enumerate(sweep(modes, sizes, chunk_sizes, pacings), args.port):
+            case = run_case(mode, port, (size, size, size), chunk_size, pacing, args.frames, args.verbose)
+            case['netem'] = args.netem if emulated else ''
+            print_case(case)
+            cases.append(case)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(cases, f, indent=2)
+        print(f'Results written to {args.json}')
+    return cases
+
+
+if __name__ == "__main__":
+    main()
@@ -1,250 +1,302 @@
 """
 Chunked data transmission utilities for large numpy arrays over pyigtl
 Includes checksums and error detection for network transmission
+
+Protocol: one frame metadata array per transmitted array (shape, dtype,
+chunk layout and a compact per-chunk digest table), followed by data chunks
+that only carry a two value header [chunk_index, num_elements].
 """
 
 import numpy as np
 import hashlib
 import struct
+import time
+import contextlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 
 class ChunkedTransmission:
     """
     Handles breaking up large numpy arrays into chunks with metadata and checksums
     """
-    
+
     # Maximum size per chunk (in bytes) - adjust based on your network MTU
     # Using 64KB as a safe default (well under typical MTU issues)
     CHUNK_SIZE = 65536  # 64KB
-    
+
+    # Digest per chunk: first 8 bytes of the MD5, stored as four 16-bit words
+    # so every value is exactly representable in the float32 metadata array
+    DIGEST_WORDS = 4
+    METADATA_HEADER = 8  # shape (3), dtype, total_chunks, elements_per_chunk, digest_words, reserved
+    CHUNK_HEADER = 2  # chunk_index, num_elements
+
+    DTYPE_MAP = {
+        'float32': 1.0, 'float64': 2.0, 'int32': 3.0,
+        'int64': 4.0, 'uint8': 5.0, 'uint16': 6.0
+    }
+    DTYPE_MAP_INV = {
+        1.0: np.float32, 2.0: np.float64, 3.0: np.int32,
+        4.0: np.int64, 5.0: np.uint8, 6.0: np.uint16
+    }
+
     @staticmethod
     def compute_checksum(data):
         """Compute MD5 checksum of numpy array"""
         return hashlib.md5(data.tobytes()).hexdigest()
-    
+
     @staticmethod
-    def create_metadata_array(original_shape, original_dtype, total_chunks, chunk_index, checksum):
+    def compute_digest(data):
+        """
+        Compact chunk digest: truncated MD5 as DIGEST_WORDS uint16 values
+        Hashes the array buffer directly (no tobytes copy); hashlib releases
+        the GIL for large buffers, so this scales across threads
         """
-        Create a metadata array that can be sent as an image
-        Stores: shape, dtype, total_chunks, chunk_index, checksum
-        
-        Returns a small 3D array (10x10x10) with metadata encoded
+        digest = hashlib.md5(np.ascontiguousarray(data)).digest()
+        return np.frombuffer(digest[:2 * ChunkedTransmission.DIGEST_WORDS], dtype='<u2')
+
+    @staticmethod
+    def create_frame_metadata(original_shape, original_dtype, total_chunks, elements_per_chunk, digests):
         """
-        # Create a small 3D array to hold metadata
-        metadata = np.zeros((10, 10, 10), dtype=np.float32)
-        
-        # Encode shape (first 3 values)
+        Create the per-frame metadata array that is sent once before the chunks
+        Stores: shape, dtype, total_chunks, elements_per_chunk and the digest table
+
+        Returns a small 3D float32 array (N x 1 x 1)
+        """
+        header = np.zeros(ChunkedTransmission.METADATA_HEADER, dtype=np.float32)
         for i, dim in enumerate(original_shape[:3]):
-            metadata[0, 0, i] = float(dim)
-        
-        # Encode dtype as string -> int mapping
-        dtype_map = {
-            'float32': 1.0, 'float64': 2.0, 'int32': 3.0, 
-            'int64': 4.0, 'uint8': 5.0, 'uint16': 6.0
-        }
-        metadata[0, 1, 0] = dtype_map.get(str(original_dtype), 1.0)
-        
-        # Encode chunk info
-        metadata[0, 1, 1] = float(total_chunks)
-        metadata[0, 1, 2] = float(chunk_index)
-        
-        # Encode checksum (convert hex to floats)
-        # Store first 16 chars of checksum as floats
-        for i, char in enumerate(checksum[:16]):
-            if i < 10:
-                metadata[0, 2, i] = float(ord(char))
-        
-        return metadata
-    
+            header[i] = float(dim)
+        header[3] = ChunkedTransmission.DTYPE_MAP.get(str(original_dtype), 1.0)
+        header[4] = float(total_chunks)
+        header[5] = float(elements_per_chunk)
+        header[6] = float(ChunkedTransmission.DIGEST_WORDS)
+
+        table = np.asarray(digests, dtype=np.float32).ravel()
+        return np.concatenate([header, table]).reshape(-1, 1, 1)
+
     @staticmethod
-    def parse_metadata_array(metadata_array):
-        """Parse metadata from received array"""
-        shape = tuple(int(metadata_array[0, 0, i]) for i in range(3))
-        
-        dtype_map_inv = {
-            1.0: np.float32, 2.0: np.float64, 3.0: np.int32,
-            4.0: np.int64, 5.0: np.uint8, 6.0: np.uint16
-        }
-        dtype = dtype_map_inv.get(metadata_array[0, 1, 0], np.float32)
-        
-        total_chunks = int(metadata_array[0, 1, 1])
-        chunk_index = int(metadata_array[0, 1, 2])
-        
-        # Reconstruct checksum
-        checksum = ''.join(chr(int(metadata_array[0, 2, i])) for i in range(10))
-        
+    def parse_frame_metadata(metadata_array):
+        """Parse the per-frame metadata array"""
+        meta_flat = np.ravel(metadata_array)
+        header = meta_flat[:ChunkedTransmission.METADATA_HEADER]
+
+        shape = tuple(int(header[i]) for i in range(3))
+        dtype = ChunkedTransmission.DTYPE_MAP_INV.get(float(header[3]), np.float32)
+        total_chunks = int(header[4])
+        elements_per_chunk = int(header[5])
+        digest_words = int(header[6])
+
+        table_end = ChunkedTransmission.METADATA_HEADER + total_chunks * digest_words
+        digests = meta_flat[ChunkedTransmission.METADATA_HEADER:table_end].astype('<u2')
+
         return {
             'shape': shape,
             'dtype': dtype,
             'total_chunks': total_chunks,
-            'chunk_index': chunk_index,
-            'checksum': checksum
+            'elements_per_chunk': elements_per_chunk,
+            'digests': digests.reshape(total_chunks, digest_words)
         }
-    
+
     @staticmethod
     def split_array_for_transmission(data):
         """
         Split a large numpy array into chunks suitable for transmission
-        
+
         Args:
             data: numpy array to transmit
-            
+
         Returns:
-            List of tuples: [(metadata_array, data_chunk), ...]
+            metadata_array: per-frame metadata with the chunk digest table
+            chunks: list of 3D chunk arrays [chunk_index, num_elements, data...]
+            original_shape, original_dtype
         """
         # Ensure data is contiguous and float32
-        data_flat = data.flatten().astype(np.float32)
+        data_flat = np.ascontiguousarray(data, dtype=np.float32).ravel()
         original_shape = data.shape
         original_dtype = data.dtype
-        
+
         # Calculate number of elements per chunk
         elements_per_chunk = ChunkedTransmission.CHUNK_SIZE // 4  # 4 bytes per float32
-        
+
         # Calculate total chunks needed
         total_elements = data_flat.size
         total_chunks = int(np.ceil(total_elements / elements_per_chunk))
-        
+
         print(f"Splitting array: shape={original_shape}, size={total_elements} elements, chunks={total_chunks}")
-        
+
         chunks = []
+        digests = np.zeros((total_chunks, ChunkedTransmission.DIGEST_WORDS), dtype='<u2')
         for chunk_idx in range(total_chunks):
             start_idx = chunk_idx * elements_per_chunk
             end_idx = min((chunk_idx + 1) * elements_per_chunk, total_elements)
-            
+
             # Extract chunk
             chunk_data = data_flat[start_idx:end_idx]
-            
-            # Pad chunk to fixed size for easier transmission (optional)
-            # This makes all chunks the same size except possibly the last one
-            chunk_data_3d = chunk_data.reshape(-1, 1, 1)  # Make it 3D for pyigtl
-            
-            # Compute checksum for this chunk
-            chunk_checksum = ChunkedTransmission.compute_checksum(chunk_data)
-            
-            # Create metadata
-            metadata = ChunkedTransmission.create_metadata_array(
-                original_shape, original_dtype, total_chunks, chunk_idx, chunk_checksum
-            )
-            
-            chunks.append((metadata, chunk_data_3d, chunk_checksum))
-            
-        return chunks, original_shape, original_dtype
-    
+            digests[chunk_idx] = ChunkedTransmission.compute_digest(chunk_data)
+
+            header = np.array([chunk_idx, chunk_data.size], dtype=np.float32)
+            chunks.append(np.concatenate([header, chunk_data]).reshape(-1, 1, 1))  # Make it 3D for pyigtl
+
+        metadata = ChunkedTransmission.create_frame_metadata(
+            original_shape, original_dtype, total_chunks, elements_per_chunk, digests
+        )
+        return metadata, chunks, original_shape, original_dtype
+
     @staticmethod
-    def reassemble_array(chunks_data, expected_shape, expected_dtype):
-        """
-        Reassemble chunks back into original array
-        
-        Args:
-            chunks_data: List of (chunk_index, chunk_data, checksum) tuples
-            expected_shape: Original array shape
-            expected_dtype: Original array dtype
-            
-        Returns:
-            Reassembled numpy array or None if error
-        """
-        if not chunks_data:
-            print("ERROR: No chunks to reassemble")
-            return None
-        
-        # Sort chunks by index
-        chunks_data.sort(key=lambda x: x[0])
-        
-        # Verify we have all chunks
-        expected_indices = set(range(len(chunks_data)))
-        received_indices = set(chunk[0] for chunk in chunks_data)
-        
-        if expected_indices != received_indices:
-            missing = expected_indices - received_indices
-            print(f"ERROR: Missing chunks: {missing}")
-            return None
-        
-        # Concatenate all chunk data
-        all_data = []
-        for chunk_idx, chunk_data, expected_checksum in chunks_data:
-            # Verify checksum
-            actual_checksum = ChunkedTransmission.compute_checksum(chunk_data)
-            if actual_checksum != expected_checksum:
-                print(f"ERROR: Checksum mismatch for chunk {chunk_idx}")
-                print(f"  Expected: {expected_checksum}")
-                print(f"  Got: {actual_checksum}")
-                return None
-            
-            all_data.append(chunk_data.flatten())
-        
-        # Concatenate and reshape
-        try:
-            full_data = np.concatenate(all_data)
-            total_elements = np.prod(expected_shape)
-            
-            # Trim to exact size (remove any padding)
-            full_data = full_data[:total_elements]
-            
-            # Reshape to original shape
-            result = full_data.reshape(expected_shape).astype(expected_dtype)
-            
-            print(f"Successfully reassembled array: shape={result.shape}, dtype={result.dtype}")
-            return result
-            
-        except Exception as e:
-            print(f"ERROR: Failed to reassemble array: {e}")
-            return None
+    def parse_chunk(chunk_array):
+        """Parse a data chunk, returns (chunk_index, data) - data is a view into chunk_array"""
+        chunk_flat = np.ravel(chunk_array)
+        chunk_index = int(chunk_flat[0])
+        num_elements = int(chunk_flat[1])
+        header_size = ChunkedTransmission.CHUNK_HEADER
+        return chunk_index, chunk_flat[header_size:header_size + num_elements]
 
 
 class ChunkReceiver:
     """
     Helper class to manage receiving chunks and reassembling them
+    Chunks are copied straight into one preallocated output buffer,
+    a bitmap tracks which chunk slots are filled. Each chunk's digest is
+    verified in a thread pool as soon as it arrives.
     """
-    
-    def __init__(self):
+
+    VERIFY_WORKERS = 4
+
+    def __init__(self, verify_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=verify_workers or ChunkReceiver.VERIFY_WORKERS)
         self.reset()
-    
+
     def reset(self):
         """Reset receiver state"""
-        self.chunks = []
+        self.buffer = None
+        self.received = None  # bitmap of received chunk indices
+        self.digests = None
+        self.verifications = {}  # chunk index -> Future[bool]
+        self.num_received = 0
         self.expected_total_chunks = None
         self.expected_shape = None
         self.expected_dtype = None
+        self.elements_per_chunk = None
         self.metadata_complete = False
-    
+
     def process_metadata(self, metadata_array):
-        """Process received metadata"""
+        """Process the per-frame metadata, starts a new frame"""
         try:
-            metadata = ChunkedTransmission.parse_metadata_array(metadata_array)
-            
-            if not self.metadata_complete:
-                self.expected_shape = metadata['shape']
-                self.expected_dtype = metadata['dtype']
-                self.expected_total_chunks = metadata['total_chunks']
-                self.metadata_complete = True
-                print(f"Metadata received: {metadata}")
-            
+            metadata = ChunkedTransmission.parse_frame_metadata(metadata_array)
+
+            self.reset()
+            self.expected_shape = metadata['shape']
+            self.expected_dtype = metadata['dtype']
+            self.expected_total_chunks = metadata['total_chunks']
+            self.elements_per_chunk = metadata['elements_per_chunk']
+            self.digests = metadata['digests']
+            # Chunks are always sent as float32, see split_array_for_transmission
+            self.buffer = np.empty(int(np.prod(self.expected_shape)), dtype=np.float32)
+            self.received = np.zeros(self.expected_total_chunks, dtype=bool)
+            self.metadata_complete = True
+            print(f"Metadata received: shape={self.expected_shape}, dtype={self.expected_dtype}, chunks={self.expected_total_chunks}")
+
             return metadata
         except Exception as e:
             print(f"ERROR: Failed to parse metadata: {e}")
             return None
-    
-    def add_chunk(self, chunk_index, chunk_data, checksum):
-        """Add a received chunk"""
-        self.chunks.append((chunk_index, chunk_data, checksum))
+
+    @staticmethod
+    def _verify(chunk_data, expected_digest):
+        return np.array_equal(ChunkedTransmission.compute_digest(chunk_data), expected_digest)
+
+    def add_chunk(self, chunk_array):
+        """Copy a received chunk into its slot and queue its digest check"""
+        if not self.metadata_complete:
+            print("ERROR: Received chunk before metadata")
+            return False
+        chunk_index, chunk_data = ChunkedTransmission.parse_chunk(chunk_array)
+        if not 0 <= chunk_index < self.expected_total_chunks:
+            print(f"ERROR: Chunk index {chunk_index} out of range")
+            return False
+        if self.received[chunk_index]:
+            return False  # duplicate
+
+        start = chunk_index * self.elements_per_chunk
+        end = start + chunk_data.size
+        if end > self.buffer.size:
+            print(f"ERROR: Chunk {chunk_index} overruns the output buffer")
+            return False
+        self.buffer[start:end] = chunk_data
+        # Verify the copy in the buffer, the incoming array may be reused by the caller
+        self.verifications[chunk_index] = self.executor.submit(
+            ChunkReceiver._verify, self.buffer[start:end], self.digests[chunk_index])
+        self.received[chunk_index] = True
+        self.num_received += 1
         print(f"Chunk {chunk_index + 1}/{self.expected_total_chunks} received")
-    
+        return True
+
     def is_complete(self):
         """Check if all chunks have been received"""
-        return (self.metadata_complete and 
+        return (self.metadata_complete and
                 self.expected_total_chunks is not None and
-                len(self.chunks) == self.expected_total_chunks)
-    
+                self.num_received == self.expected_total_chunks)
+
     def reassemble(self):
-        """Reassemble received chunks"""
+        """Wait for outstanding digest checks and hand over the buffer without copying"""
         if not self.is_complete():
-            print(f"ERROR: Cannot reassemble - only {len(self.chunks)}/{self.expected_total_chunks} chunks received")
+            print(f"ERROR: Cannot reassemble - only {self.num_received}/{self.expected_total_chunks} chunks received")
             return None
-        
-        result = ChunkedTransmission.reassemble_array(
-            self.chunks, self.expected_shape, self.expected_dtype
-        )
-        
-        if result is not None:
-            self.reset()  # Reset for next transmission
-        
+
+        bad_chunks = [idx for idx, verified in sorted(self.verifications.items()) if not verified.result()]
+        if bad_chunks:
+            print(f"ERROR: Checksum mismatch for chunks {bad_chunks}")
+            return None
+
+        result = self.buffer.reshape(self.expected_shape).astype(self.expected_dtype, copy=False)
+        print(f"Successfully reassembled array: shape={result.shape}, dtype={result.dtype}")
+        self.reset()  # Reset for next transmission, the buffer now belongs to the caller
         return result
+
+
+def benchmark(shape=(200, 200, 200), repeats=3):
+    """
+    Compare receive-side verification on a volume: the old per-chunk 4 KB
+    metadata with serial hashing at the end, versus one frame metadata and
+    digests checked in the thread pool while chunks arrive
+    """
+    data = np.random.default_rng(0).random(shape, dtype=np.float32)
+    metadata, chunks, _, _ = ChunkedTransmission.split_array_for_transmission(data)
+    payload = data.nbytes
+
+    old_wire = payload + len(chunks) * 10 * 10 * 10 * 4
+    new_wire = payload + metadata.nbytes + len(chunks) * ChunkedTransmission.CHUNK_HEADER * 4
+    print(f"Wire bytes: old {old_wire / 1e6:.2f} MB ({(old_wire / payload - 1) * 100:.1f}% overhead), "
+          f"new {new_wire / 1e6:.2f} MB ({(new_wire / payload - 1) * 100:.2f}% overhead)")
+
+    def serial_receive():
+        parts = []
+        for chunk in chunks:
+            parts.append((int(chunk[0, 0, 0]), chunk.ravel()[ChunkedTransmission.CHUNK_HEADER:].copy()))
+        parts.sort(key=lambda x: x[0])
+        for idx, part in parts:
+            hashlib.md5(part.tobytes()).hexdigest()
+        return np.concatenate([part for idx, part in parts]).reshape(shape)
+
+    def pooled_receive(receiver):
+        receiver.process_metadata(metadata)
+        for chunk in chunks:
+            receiver.add_chunk(chunk)
+        return receiver.reassemble()
+
+    receiver = ChunkReceiver()
+    timings = {}
+    for name, run in (('serial', serial_receive), ('pooled', lambda: pooled_receive(receiver))):
+        best = float('inf')
+        for _ in range(repeats):
+            with contextlib.redirect_stdout(io.StringIO()):
+                st = time.perf_counter()
+                result = run()
+                best = min(best, time.perf_counter() - st)
+            assert np.array_equal(result, data)
+        timings[name] = best
+        print(f"{name}: {best * 1000:.1f} ms ({payload / 1e6 / best:.0f} MB/s)")
+    return timings
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -28,6 +28,8 @@ from model import Modified3DUNet
 from numpy import linalg as LA
 import time
 import asyncio
+from tms_trace import attach_trace
+
 
 
 class ServerTMS():
@@ -153,6 +155,7 @@ class ServerTMS():
                 continue
 
             messages = servertms.get_latest_messages()
+            received = time.time()
             if len(messages) > 0:
                 print(f"got a message of length:{len(messages)}")
                 
@@ -161,6 +164,8 @@ class ServerTMS():
                     print("Model not loaded yet, skipping message")
                     continue
                     
+                # Correlation id of the coil move, set by Mapper.map
+                trace_id = message.metadata.get('TraceId') if message.metadata else None
                 magvec = message.image
                 magvec = np.transpose(magvec, axes=(2, 1, 0, 3))
                 mask = np.concatenate((self.cond_data, self.cond_data, self.cond_data), axis=3)
@@ -180,6 +185,7 @@ class ServerTMS():
                 
                 outputData = self.net(inputData_gpu.float())
                 outputData = outputData.cpu()
+                infer_end = time.time()
                 outputData = outputData.detach().numpy()
                 outputData = outputData.transpose(2, 3, 4, 1, 0)
                 outputData = np.reshape(outputData,([self.xyz[0], self.xyz[1], self.xyz[2], 3]))
@@ -187,6 +193,7 @@ class ServerTMS():
                 outputData = LA.norm(outputData, axis = 3)
 
                 image_message = pyigtl.ImageMessage(outputData, device_name="pyigtl_data")
+                attach_trace(image_message, trace_id, received, st, infer_end)
                 servertms.send_message(image_message)
 
                 et = time.time()
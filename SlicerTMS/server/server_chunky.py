@@ -27,9 +27,17 @@ from collections import OrderedDict
 from model import Modified3DUNet
 from numpy import linalg as LA
 import time
+import logging
 
 # ADDED: Simple chunker for reliable network transmission
-from simple_chunker import SimpleChunker
+from simple_chunker import SimpleChunker, FlowController, FrameRing
+# ADDED: Shared-memory frame ring when Slicer runs on the same host
+from shm_transport import SharedMemoryRing
+from tms_log import setup_logging
+from tms_trace import attach_trace
+
+# run as a script, so named explicitly instead of __main__ to come under setup_logging
+log = logging.getLogger('server_chunky')
 
 
 class ServerTMS():
@@ -37,6 +45,96 @@ class ServerTMS():
         self.setFile(f)
         self.getF(self)
         self.stop_server = False
+        self.frame_id = 0
+        self.flow = FlowController()
+        self.ring = FrameRing()
+        self.shm = None
+        self.shm_peer = False  # client has mapped the shared-memory ring
+
+    def poll_feedback(self, servertms, text_server):
+        """Handle chunk acks and repair requests from the text channel"""
+        for msg in text_server.get_latest_messages():
+            if not hasattr(msg, 'string'):
+                continue
+            ack = SimpleChunker.parse_ack(msg.string)
+            nack = SimpleChunker.parse_nack(msg.string)
+            if ack is not None:
+                self.flow.on_ack(*ack)
+            elif nack is not None:
+                self.resend_chunks(servertms, *nack)
+            elif msg.string == SharedMemoryRing.READY_MESSAGE:
+                self.shm_peer = self.shm is not None
+                log.info("Client mapped the shared memory ring, using %s", 'shared memory' if self.shm_peer else 'TCP')
+            elif msg.string == SharedMemoryRing.FAIL_MESSAGE:
+                self.shm_peer = False
+                log.warning("Client could not read the shared memory ring, falling back to TCP")
+            else:
+                log.info("Received command: %s", msg.string)
+
+    def resend_chunks(self, servertms, frame_id, indices):
+        """Selective retransmission of chunks from the frame ring buffer"""
+        chunks = self.ring.get(frame_id, indices)
+        if not chunks:
+            log.warning("Repair request for frame %d ignored, frame no longer buffered", frame_id)
+            return
+        log.info("Resending %d chunks of frame %d", len(chunks), frame_id)
+        for idx, chunk_data in chunks:
+            servertms.send_message(pyigtl.ImageMessage(chunk_data, device_name="pyigtl_chunk"))
+            if frame_id == self.flow.frame_id:
+                self.flow.on_sent(idx, retransmit=True)
+
+    async def send_frame(self, servertms, text_server, outputData, trace=None):
+        """Send one frame as chunks, keeping at most the flow window in flight"""
+        self.frame_id += 1
+        chunks, original_shape = SimpleChunker.create_chunks(outputData, frame_id=self.frame_id)
+        meta = chunks[0][1]
+        data_chunks = [chunk_data for is_metadata, chunk_data in chunks[1:]]
+        self.ring.put(self.frame_id, data_chunks)
+
+        meta_message = pyigtl.ImageMessage(meta, device_name="pyigtl_meta")
+        if trace:
+            attach_trace(meta_message, *trace)
+        servertms.send_message(meta_message)
+        self.flow.start_frame(self.frame_id, len(data_chunks), outputData.nbytes)
+        log.debug("Sending frame %d: %d chunks, window %d", self.frame_id, len(data_chunks), self.flow.window)
+
+        num_sent = 0
+        while not self.flow.frame_done(num_sent):
+            while num_sent < len(data_chunks) and self.flow.can_send():
+                image_message = pyigtl.ImageMessage(data_chunks[num_sent], device_name="pyigtl_chunk")
+                servertms.send_message(image_message)
+                self.flow.on_sent(num_sent)
+                num_sent += 1
+                if not self.flow.peer_acks:
+                    # Receiver has not acked yet - pace like the legacy sender
+                    await asyncio.sleep(FlowController.LEGACY_PACING)
+                    break
+
+            self.poll_feedback(servertms, text_server)
+            if self.flow.check_timeout():
+                log.info("Ack timeout, window shrunk to %d", self.flow.window)
+            if not self.flow.can_send() or num_sent == len(data_chunks):
+                await asyncio.sleep(0.001)
+
+        stats = self.flow.frame_stats()
+        log.info("Frame %d sent: %.2f MB in %.3f s (%.1f MB/s), window %d, lost %d", stats['frame_id'], stats['megabytes'],
+                 stats['elapsed'], stats['throughput_mbps'], stats['window'], stats['lost'])
+        return stats
+
+    def send_frame_shm(self, servertms, outputData, trace=None):
+        """Write the frame into the shared-memory ring and only send a notice, returns False to fall back to TCP"""
+        st = time.time()
+        slot = self.shm.write(self.frame_id + 1, outputData)
+        if slot is None:
+            return False
+        self.frame_id += 1
+        notice = SharedMemoryRing.format_notice(self.frame_id, slot)
+        message = pyigtl.StringMessage(notice, device_name="pyigtl_shm")
+        if trace:
+            attach_trace(message, *trace)
+        servertms.send_message(message)
+        log.debug("Frame %d written to shared memory slot %d in %.3f s", self.frame_id, slot, time.time() - st)
+        return True
 
     async def run_server(self):
         print('Starting TMS server...')
@@ -102,17 +200,28 @@ class ServerTMS():
         cond_data = np.reshape(cond_data,([xyz[0], xyz[1], xyz[2], 1]))
         print('Image shape:', cond_data.shape)
 
+        # E-field norm frames are float32 volumes of the conductivity shape
+        self.shm = SharedMemoryRing.create(int(np.prod(xyz)) * 4)
+
 
         while not self.stop_server:
             if not servertms.is_connected():
-                # Wait for client to connect
+                # Wait for client to connect, a new client has to map the ring again
+                self.shm_peer = False
                 sleep(0.01)
                 print('not connected')
                 continue
 
+            # Late repair requests for frames that already went out
+            self.poll_feedback(servertms, text_server)
+
             messages = servertms.get_latest_messages()
-            print(f"got a message of lenghth:{len(messages)}")
+            received = time.time()
+            if len(messages) > 0:
+                print(f"got a message of lenghth:{len(messages)}")
             for message in messages:
+                # Correlation id of the coil move, set by Mapper.map
+                trace_id = message.metadata.get('TraceId') if message.metadata else None
                 magvec = message.image
                 magvec = np.transpose(magvec, axes=(2, 1, 0, 3))
                 mask = np.concatenate((cond_data, cond_data, cond_data), axis=3)
@@ -132,6 +241,7 @@ class ServerTMS():
                 
                 outputData = net(inputData_gpu.float())
                 outputData = outputData.cpu()
+                infer_end = time.time()
                 outputData = outputData.detach().numpy()
                 outputData = outputData.transpose(2, 3, 4, 1, 0)
                 outputData = np.reshape(outputData,([xyz[0], xyz[1], xyz[2], 3]))
@@ -146,26 +256,11 @@ class ServerTMS():
                 
                 print(f"Output shape: {outputData.shape}, dtype: {outputData.dtype}, range: [{np.min(outputData):.6e}, {np.max(outputData):.6e}]")
                 
-                # ADDED: Use chunked transmission for reliability
-                chunks, original_shape = SimpleChunker.create_chunks(outputData)
-                
-                print(f"Sending {len(chunks)} chunks...")
-                for i, (is_metadata, chunk_data) in enumerate(chunks):
-                    if is_metadata:
-                        device_name = "pyigtl_meta"
-                        print(f"  Sent metadata")
-                    else:
-                        # Use base name without index - let PyIGTL handle it
-                        device_name = "pyigtl_chunk"
-                        print(f"  Sent chunk {i}/{len(chunks)-1}")
-                    
-                    image_message = pyigtl.ImageMessage(chunk_data, device_name=device_name)
-                    servertms.send_message(image_message)
-                    
-                    # Small delay to prevent overwhelming the network
-                    await asyncio.sleep(0.01)  # Increased from 0.005 to 0.01
-                
-                print("All chunks sent")
+                # ADDED: Shared memory when the client mapped the ring, otherwise
+                # chunked transmission with ack-driven flow control
+                trace = (trace_id, received, st, infer_end) if trace_id else None
+                if not (self.shm_peer and self.send_frame_shm(servertms, outputData, trace)):
+                    await self.send_frame(servertms, text_server, outputData, trace)
                 # END MODIFICATIONS
 
                 et = time.time()
@@ -198,6 +293,7 @@ async def main():
     await tmsserver.run_server()
 
 if __name__ == "__main__":
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
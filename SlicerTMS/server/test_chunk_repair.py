@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Loss-injection tests for the chunk repair path (NACK + server frame ring).
+Runs without pyigtl or Slicer: LossyLink stands in for the 18944 socket and
+drops chosen chunks, the receiver requests them back over the "text channel".
+
+Usage: python3 test_chunk_repair.py   (or pytest test_chunk_repair.py)
+"""
+
+import numpy as np
+
+from simple_chunker import SimpleChunker, SimpleReceiver, FrameRing, FlowController
+
+
+class LossyLink:
+    """Local socket stand-in that drops the n-th data chunk sends it is told to"""
+
+    def __init__(self, drop_sends=()):
+        self.drop_sends = set(drop_sends)
+        self.sends = 0
+        self.delivered = []
+
+    def send(self, chunk_data):
+        send_no = self.sends
+        self.sends += 1
+        if send_no in self.drop_sends:
+            return
+        self.delivered.append(chunk_data)
+
+    def drain(self):
+        delivered, self.delivered = self.delivered, []
+        return delivered
+
+
+def send_frame(link, ring, data, frame_id):
+    chunks, _ = SimpleChunker.create_chunks(data, frame_id=frame_id)
+    data_chunks = [chunk_data for is_metadata, chunk_data in chunks[1:]]
+    ring.put(frame_id, data_chunks)
+    for chunk_data in data_chunks:
+        link.send(chunk_data)
+    return chunks[0][1], data_chunks
+
+
+def serve_nack(link, ring, nack):
+    frame_id, indices = SimpleChunker.parse_nack(nack)
+    for idx, chunk_data in ring.get(frame_id, indices):
+        link.send(chunk_data)
+
+
+def receive(receiver, link, ring):
+    """Deliver chunks and answer gap-triggered NACKs, like Loader_chunky.newImage"""
+    pending = link.drain()
+    while pending:
+        for chunk_data in pending:
+            receiver.add_chunk(chunk_data)
+            nack = receiver.repair_request()
+            if nack:
+                serve_nack(link, ring, nack)
+        pending = link.drain()
+
+
+def make_volume(shape=(60, 60, 60)):
+    return np.random.default_rng(0).random(shape, dtype=np.float32)
+
+
+def num_chunks(data):
+    return int(np.ceil(data.size / (SimpleChunker.CHUNK_SIZE // 4)))
+
+
+def test_gap_is_repaired():
+    data = make_volume()
+    link, ring, receiver = LossyLink(drop_sends={2, 5, 6}), FrameRing(), SimpleReceiver()
+    meta, data_chunks = send_frame(link, ring, data, frame_id=1)
+    receiver.add_metadata(meta)
+    receive(receiver, link, ring)
+
+    assert receiver.is_complete()
+    assert np.array_equal(receiver.get_result(), data)
+
+
+def test_lost_tail_is_repaired_on_timeout():
+    data = make_volume()
+    last = num_chunks(data) - 1
+    link, ring, receiver = LossyLink(drop_sends={last - 1, last}), FrameRing(), SimpleReceiver()
+    meta, data_chunks = send_frame(link, ring, data, frame_id=1)
+    receiver.add_metadata(meta)
+    receive(receiver, link, ring)
+    assert not receiver.is_complete()
+    assert receiver.repair_request() is None  # no gap below the highest index
+
+    serve_nack(link, ring, receiver.repair_request(timed_out=True))
+    receive(receiver, link, ring)
+    assert receiver.is_complete()
+    assert np.array_equal(receiver.get_result(), data)
+
+
+def test_repeated_loss_of_retransmission():
+    data = make_volume()
+    # chunk 3 is lost, and so is its first retransmission (send number n)
+    n = num_chunks(data)
+    link, ring, receiver = LossyLink(drop_sends={3, n}), FrameRing(), SimpleReceiver()
+    meta, data_chunks = send_frame(link, ring, data, frame_id=1)
+    receiver.add_metadata(meta)
+    receive(receiver, link, ring)
+    assert not receiver.is_complete()
+
+    serve_nack(link, ring, receiver.repair_request(timed_out=True))
+    receive(receiver, link, ring)
+    assert receiver.is_complete()
+    assert np.array_equal(receiver.get_result(), data)
+
+
+def test_duplicate_chunks_are_ignored():
+    data = make_volume()
+    link, ring, receiver = LossyLink(), FrameRing(), SimpleReceiver()
+    meta, data_chunks = send_frame(link, ring, data, frame_id=1)
+    receiver.add_metadata(meta)
+    for chunk_data in link.drain()[::-1]:
+        assert receiver.add_chunk(chunk_data)
+        assert not receiver.add_chunk(chunk_data)
+    assert receiver.is_complete()
+    assert np.array_equal(receiver.get_result(), data)
+
+
+def test_interleaved_frames_are_not_mixed():
+    first, second = make_volume(), make_volume() * 2
+    link, ring, receiver = LossyLink(), FrameRing(), SimpleReceiver()
+    meta1, chunks1 = send_frame(link, ring, first, frame_id=1)
+    meta2, chunks2 = send_frame(link, ring, second, frame_id=2)
+    link.drain()
+    receiver.add_metadata(meta1)
+    receiver.add_metadata(meta2)
+    results = []
+    for chunk1, chunk2 in zip(chunks1, chunks2):
+        for chunk_data in (chunk1, chunk2):
+            receiver.add_chunk(chunk_data)
+            if receiver.is_complete():
+                results.append(receiver.get_result())
+    assert len(results) == 2
+    assert np.array_equal(results[0], first)
+    assert np.array_equal(results[1], second)
+    assert receiver.stats()['abandoned_frames'] == 0
+
+
+def test_older_incomplete_frame_is_abandoned():
+    first, second = make_volume(), make_volume() * 2
+    link, ring, receiver = LossyLink(), FrameRing(), SimpleReceiver()
+    meta1, chunks1 = send_frame(link, ring, first, frame_id=1)
+    meta2, chunks2 = send_frame(link, ring, second, frame_id=2)
+    receiver.add_metadata(meta1)
+    receiver.add_metadata(meta2)
+    for chunk_data in chunks1[:-1] + chunks2:
+        receiver.add_chunk(chunk_data)
+    assert np.array_equal(receiver.get_result(), second)
+    assert receiver.stats() == {'completed_frames': 1, 'abandoned_frames': 1, 'frames_in_flight': 0}
+    assert not receiver.add_chunk(chunks1[-1])  # late chunk of the abandoned frame
+    assert not receiver.is_complete()
+
+
+def test_evicted_frame_is_not_resent():
+    ring = FrameRing(capacity=2)
+    for frame_id in range(1, 4):
+        ring.put(frame_id, [np.zeros(4, dtype='<f4')])
+    assert ring.get(1, [0]) == []
+    assert len(ring.get(3, [0])) == 1
+
+
+def test_flow_window_shrinks_on_gap():
+    flow = FlowController(initial_window=16)
+    flow.start_frame(1, 32, 0)
+    for idx in range(16):
+        flow.on_sent(idx)
+    flow.on_ack(1, [(0, 4), (6, 15)])  # chunk 5 lost
+    assert flow.window == 8
+    assert flow.lost == 1
+    flow.on_ack(2, [(0, 31)])  # ack for another frame is ignored
+    assert flow.window == 8
+
+
+def test_retransmit_is_not_counted_lost():
+    flow = FlowController(initial_window=16)
+    flow.start_frame(1, 32, 0)
+    for idx in range(16):
+        flow.on_sent(idx)
+    flow.on_ack(1, [(0, 4), (6, 15)])  # chunk 5 lost
+    flow.on_sent(5, retransmit=True)
+    for idx in range(16, 20):
+        flow.on_sent(idx)
+    flow.on_ack(1, [(0, 4), (6, 19)])  # the repair is still on its way
+    assert flow.lost == 1
+    assert 5 in flow.in_flight
+    flow.on_ack(1, [(0, 19)])
+    assert not flow.in_flight
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"PASS {name}")
@@ -0,0 +1,23 @@
+"""
+Latency tracing on the server side of an E-field request. The client sends
+the correlation id of a coil move as TraceId IGTL metadata; the reply carries
+it back with the server's receive, inference and send timestamps, which the
+Slicer module's LatencyTracer turns into spans.
+"""
+
+import time
+
+
+def attach_trace(message, trace_id, received, infer_start, infer_end):
+    """Echo the client's correlation id with the server hop timestamps as IGTL metadata"""
+    if not trace_id:
+        return message
+    message.header_version = 2  # metadata needs the version 2 header
+    message.metadata = {
+        'TraceId': trace_id,
+        'ServerReceive': f"{received:.6f}",
+        'InferStart': f"{infer_start:.6f}",
+        'InferEnd': f"{infer_end:.6f}",
+        'SendStart': f"{time.time():.6f}",
+    }
+    return message
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Append-only JSON Lines journal for simulation events.
+
+Slicer appends one line per start/end event (Mapper.record_simulation_event),
+update.py appends Docker stats for those events to a second journal. Nothing
+is ever rewritten; results.csv is materialised from both journals on demand:
+
+    python3 event_journal.py export [results.csv]
+    python3 event_journal.py export-regions [results.csv]    # -> results.regions.csv
+
+Records:
+    {"event": "start", "id": ..., "time": iso, "matrix": "m00;m01;..."}
+    {"event": "end",   "id": ..., "time": iso, "matrix": "..."}
+    {"event": "regions", "id": ..., "time": iso, "regions": [{"name": ..., "label": ...,
+     "voxels": ..., "mean": ..., "max": ..., "p50": ..., ...}, ...]}
+    {"event": "stats", "id": ..., "phase": "start"|"end", "stats_timestamp": iso,
+     "actual_timestamp": iso, "stats": {...}}                (stats journal)
+"""
+
+import atexit
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import uuid
+from datetime import datetime
+
+
+BASE_FIELDS = ['event_id', 'timestamp', 'start_time', 'end_time', 'start_matrix', 'end_matrix',
+               'execution_time_sec', 'start_stats_timestamp', 'end_stats_timestamp',
+               'start_stats_actual_timestamp', 'end_stats_actual_timestamp']
+
+
+def journal_path_for(csv_path):
+    """Event journal next to the CSV view: results.csv -> results.jsonl"""
+    return os.path.splitext(csv_path)[0] + '.jsonl'
+
+
+def regions_csv_path_for(csv_path):
+    """Per-region statistics view: results.csv -> results.regions.csv"""
+    return os.path.splitext(csv_path)[0] + '.regions.csv'
+
+
+def stats_journal_path_for(csv_path):
+    """Stats journal written by update.py: results.csv -> results.stats.jsonl"""
+    return os.path.splitext(csv_path)[0] + '.stats.jsonl'
+
+
+def new_event_id():
+    return uuid.uuid4().hex
+
+
+class EventJournal:
+    """
+    Appends records to a JSON Lines file from a background thread.
+    append() only puts the record on a queue, so it is O(1) and never touches
+    the disk on the caller's (GUI) thread.
+    """
+
+    FLUSH_INTERVAL = 0.5  # seconds a record may wait before it is written
+
+    _journals = {}
+    _journals_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path):
+        """One journal (and writer thread) per path and process"""
+        path = os.path.abspath(path)
+        with cls._journals_lock:
+            if path not in cls._journals:
+                cls._journals[path] = cls(path)
+            return cls._journals[path]
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.last_start_id = None  # id of the most recent start event from this process
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def append(self, record):
+        if record.get('event') == 'start':
+            self.last_start_id = record.get('id')
+        self.queue.put(record)
+
+    def flush(self, timeout=2.0):
+        """Block until everything appended so far is on disk, False if that took longer than timeout"""
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            # Collect whatever else arrives shortly after, one write per batch;
+            # a flush() marker ends the batch right away
+            while not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self.queue.get(timeout=self.FLUSH_INTERVAL if len(batch) < 2 else 0))
+                except queue.Empty:
+                    break
+            lines = ''.join(json.dumps(r, separators=(',', ':')) + '\n'
+                            for r in batch if not isinstance(r, threading.Event))
+            if lines:
+                try:
+                    self._write(lines)
+                except Exception as e:
+                    print(f"✗ Could not write journal {self.path}: {e}")
+            for r in batch:
+                if isinstance(r, threading.Event):
+                    r.set()
+
+    def _write(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, mode=0o777, exist_ok=True)
+        created = not os.path.exists(self.path)
+        # O_APPEND: every write lands at the current end, no lock needed
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        if created:
+            try:
+                os.chmod(self.path, 0o666)
+            except OSError:
+                pass
+
+
+def read_journal(path, offset=0):
+    """
+    Read complete records from byte offset on
+    Returns (records, new_offset); a partially written last line is left for the next read
+    """
+    if not os.path.exists(path):
+        return [], offset
+    records = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            line_start = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping corrupt journal line at byte {line_start}")
+    return records, offset
+
+
+def build_rows(events, stats_records):
+    """One row per start event, in journal order, joined with its end and stats records"""
+    rows = {}
+    for record in events:
+        event_id = record.get('id')
+        if record.get('event') == 'start':
+            rows[event_id] = {
+                'event_id': event_id,
+                'timestamp': record['time'],
+                'start_time': record['time'],
+                'start_matrix': record.get('matrix', ''),
+            }
+        elif record.get('event') == 'end' and event_id in rows:
+            row = rows[event_id]
+            row['end_time'] = record['time']
+            row['end_matrix'] = record.get('matrix', '')
+            try:
+                duration = datetime.fromisoformat(row['end_time']) - datetime.fromisoformat(row['start_time'])
+                row['execution_time_sec'] = f"{duration.total_seconds():.3f}"
+            except ValueError:
+                row['execution_time_sec'] = "0.000"
+
+    stats_fields = []
+    for record in stats_records:
+        row = rows.get(record.get('id'))
+        if row is None:
+            continue
+        phase = record.get('phase')
+        prefix = 'end_' if phase == 'end' else ''
+        row[f'{phase}_stats_timestamp'] = record.get('stats_timestamp', '')
+        row[f'{phase}_stats_actual_timestamp'] = record.get('actual_timestamp', '')
+        for key, value in (record.get('stats') or {}).items():
+            row[prefix + key] = value
+            if key not in stats_fields:
+                stats_fields.append(key)
+
+    fieldnames = list(BASE_FIELDS)
+    for key in stats_fields:
+        fieldnames += [key, f'end_{key}']
+    return list(rows.values()), fieldnames
+
+
+def materialize_csv(csv_path, journal_path=None, stats_path=None):
+    """Write the CSV view of the journals, atomically; a legacy CSV is kept as .legacy"""
+    journal_path = journal_path or journal_path_for(csv_path)
+    stats_path = stats_path or stats_journal_path_for(csv_path)
+    events, _ = read_journal(journal_path)
+    stats_records, _ = read_journal(stats_path)
+    rows, fieldnames = build_rows(events, stats_records)
+
+    if os.path.exists(csv_path) and os.path.getsize(csv_path) > 0:
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            header = next(csv.reader(f), [])
+        if 'event_id' not in header:
+            # Written by the old whole-file rewrite code, do not clobber it
+            os.replace(csv_path, csv_path + '.legacy')
+            print(f"Kept previous CSV as {csv_path}.legacy")
+
+    tmp_path = csv_path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
+    try:
+        os.chmod(csv_path, 0o666)
+    except OSError:
+        pass
+    print(f"✅ Wrote {len(rows)} rows to {csv_path}")
+    return rows
+
+
+def materialize_regions_csv(csv_path, journal_path=None):
+    """One row per region and E-field from the "regions" records, in journal order"""
+    journal_path = journal_path or journal_path_for(csv_path)
+    events, _ = read_journal(journal_path)
+    rows, fieldnames = [], ['event_id', 'time']
+    for record in events:
+        if record.get('event') != 'regions':
+            continue
+        for region in record.get('regions') or []:
+            rows.append(dict(region, event_id=record.get('id'), time=record.get('time')))
+            for key in region:
+                if key not in fieldnames:
+                    fieldnames.append(key)
+
+    regions_path = regions_csv_path_for(csv_path)
+    tmp_path = regions_path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, regions_path)
+    print(f"✅ Wrote {len(rows)} region rows to {regions_path}")
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('export', 'export-regions'):
+        print(__doc__)
+        sys.exit(1)
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else os.environ.get('RESULTS_CSV_PATH', './results.csv')
+    if sys.argv[1] == 'export':
+        materialize_csv(csv_path)
+    else:
+        materialize_regions_csv(csv_path)
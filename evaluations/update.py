@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 """
-Monitor results.csv and append Docker container statistics to each simulation event row.
+Monitor the simulation event journal and record Docker container statistics for each event.
 Stores last 20 seconds of stats at 0.1s intervals for accurate start/end matching.
+
+Usage: python update.py [results.csv]            watch results.jsonl, append to results.stats.jsonl
+       python update.py --export [results.csv]   write the CSV view of both journals
 """
 
-import csv
 import json
 import time
 import os
@@ -14,6 +16,8 @@ from datetime import datetime
 from collections import deque
 import docker
 
+from event_journal import EventJournal, journal_path_for, stats_journal_path_for, read_journal, materialize_csv
+
 
 class DockerStatsBuffer:
     """
@@ -136,139 +140,90 @@ class DockerStatsBuffer:
 
 
 class ResultsCSVUpdater:
-    """Update the results.csv file with Docker stats"""
+    """
+    Attach Docker stats to the simulation events in the event journal.
+    Reads the journal written by Slicer incrementally from a saved byte offset
+    and appends one stats record per start/end event to the stats journal;
+    results.csv is materialised from both on demand (--export).
+    """
     
     def __init__(self, csv_path='./evaluations/results.csv'):
         self.csv_path = csv_path
-        self.lock_path = csv_path + '.lock'
+        self.journal_path = journal_path_for(csv_path)
+        self.stats_path = stats_journal_path_for(csv_path)
+        self.offset_path = self.stats_path + '.offset'
+        self.offset = 0  # next unread byte of the event journal
+        self.pending = []  # events still waiting for a stats sample
+        self.stats_journal = EventJournal.get(self.stats_path)
         self.watch_active = False
         self.stats_buffer = DockerStatsBuffer(max_age_seconds=20, sample_interval=0.1)
     
     def ensure_csv_initialized(self):
-        """Ensure CSV file exists"""
-        if not os.path.exists(self.csv_path):
-            os.makedirs(os.path.dirname(self.csv_path), exist_ok=True)
-            open(self.csv_path, 'a').close()
-            os.chmod(self.csv_path, 0o666)
-    
-    def acquire_lock(self, timeout=5):
-        """Acquire a lock on the CSV file"""
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                if os.path.exists(self.lock_path):
-                    lock_age = time.time() - os.path.getmtime(self.lock_path)
-                    if lock_age > 30:
-                        try:
-                            os.remove(self.lock_path)
-                        except:
-                            pass
-                
-                with open(self.lock_path, 'x') as f:
-                    f.write(str(os.getpid()))
-                return True
-            except FileExistsError:
-                time.sleep(0.05)
-            except:
-                time.sleep(0.05)
-        return False
+        """Ensure the journal directory exists and resume from the saved offset"""
+        directory = os.path.dirname(self.journal_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.offset = self.load_offset()
     
-    def release_lock(self):
+    def load_offset(self):
         try:
-            if os.path.exists(self.lock_path):
-                os.remove(self.lock_path)
-        except:
-            pass
+            with open(self.offset_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
     
-    def read_csv_rows_safe(self, max_retries=3):
-        """Read CSV rows"""
-        if not os.path.exists(self.csv_path):
-            return [], []
-        
-        for attempt in range(max_retries):
-            try:
-                time.sleep(0.1)
-                with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
-                    reader = csv.DictReader(f)
-                    fieldnames = reader.fieldnames or []
-                    rows = list(reader)
-                    return rows, fieldnames
-            except:
-                if attempt < max_retries - 1:
-                    time.sleep(0.2)
-        return [], []
+    def save_offset(self, offset):
+        tmp_path = self.offset_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(str(offset))
+            os.replace(tmp_path, self.offset_path)
+        except OSError as e:
+            print(f"WARNING: Could not save journal offset: {e}")
     
     def update_pending_rows(self):
-        """Update rows with historically accurate docker stats"""
-        if not self.acquire_lock(timeout=10):
-            print("WARNING: Could not acquire lock")
-            return
+        """Read new journal events and record historically accurate docker stats for them"""
+        records, self.offset = read_journal(self.journal_path, self.offset)
+        self.pending.extend(r for r in records if r.get('event') in ('start', 'end'))
+        
+        still_pending = []
+        for record in self.pending:
+            event_time = record.get('time', '')
+            if self._age(event_time) > self.stats_buffer.max_age_seconds:
+                # Unparseable, or older than anything the buffer holds (e.g. re-read after a
+                # restart): no sample will ever match, journal it without stats so the offset moves on
+                print(f"  [{record.get('id', '')[:8]}] No stats available for {record['event']} time {event_time[:19]}, "
+                      f"outside the {self.stats_buffer.max_age_seconds}s stats buffer")
+                stats, actual_ts = None, ''
+            else:
+                stats, actual_ts = self.stats_buffer.get_stats_for_timestamp(event_time)
+                if not stats:
+                    still_pending.append(record)  # the buffer has no samples yet
+                    continue
+            self.stats_journal.append({
+                'event': 'stats',
+                'id': record.get('id'),
+                'phase': record['event'],
+                'stats_timestamp': datetime.now().isoformat(),
+                'actual_timestamp': actual_ts,
+                'stats': stats,
+            })
+            if stats:
+                print(f"  [{record.get('id', '')[:8]}] Added {record['event'].upper()} stats "
+                      f"(matched to {actual_ts}, diff: {self._time_diff(event_time, actual_ts):.3f}s)")
+        self.pending = still_pending
         
+        # Only move the saved offset past events that are journalled and on disk, a restart
+        # re-reads the rest (a repeated stats record simply replaces the earlier one)
+        if not self.pending and self.stats_journal.flush():
+            self.save_offset(self.offset)
+    
+    def _age(self, timestamp):
+        """Seconds since an ISO timestamp, infinite if it cannot be parsed"""
         try:
-            rows, fieldnames = self.read_csv_rows_safe(max_retries=3)
-            if not rows:
-                return
-            
-            # Build complete fieldnames
-            all_fieldnames = list(fieldnames) if fieldnames else []
-            
-            # Ensure base fields exist
-            base_fields = ['timestamp', 'start_time', 'end_time', 'start_matrix', 'end_matrix', 
-                          'execution_time_sec', 'start_stats_timestamp', 'end_stats_timestamp',
-                          'start_stats_actual_timestamp', 'end_stats_actual_timestamp']
-            for bf in base_fields:
-                if bf not in all_fieldnames:
-                    all_fieldnames.append(bf)
-            
-            # Add stats fields (both start and end versions)
-            sample_stats = self.stats_buffer.get_stats_for_timestamp(datetime.now().isoformat())[0] or {}
-            for key in sample_stats.keys():
-                if key not in all_fieldnames:
-                    all_fieldnames.append(key)
-                end_key = f'end_{key}'
-                if end_key not in all_fieldnames:
-                    all_fieldnames.append(end_key)
-            
-            updated = False
-            
-            for i, row in enumerate(rows):
-                start_time = row.get('start_time', '')
-                end_time = row.get('end_time', '')
-                start_stats_ts = row.get('start_stats_timestamp', '')
-                end_stats_ts = row.get('end_stats_timestamp', '')
-                
-                # Case 1: Has start, needs start stats
-                if start_time and not start_stats_ts:
-                    stats, actual_ts = self.stats_buffer.get_stats_for_timestamp(start_time)
-                    if stats:
-                        for key, value in stats.items():
-                            rows[i][key] = value
-                        rows[i]['start_stats_timestamp'] = datetime.now().isoformat()
-                        rows[i]['start_stats_actual_timestamp'] = actual_ts
-                        updated = True
-                        print(f"  [{i}] Added START stats (matched to {actual_ts}, diff: {self._time_diff(start_time, actual_ts):.3f}s)")
-                    else:
-                        print(f"  [{i}] No stats available for start time {start_time[:19]}")
-                
-                # Case 2: Has end, needs end stats
-                elif start_time and end_time and not end_stats_ts:
-                    stats, actual_ts = self.stats_buffer.get_stats_for_timestamp(end_time)
-                    if stats:
-                        for key, value in stats.items():
-                            end_key = f'end_{key}'
-                            rows[i][end_key] = value
-                        rows[i]['end_stats_timestamp'] = datetime.now().isoformat()
-                        rows[i]['end_stats_actual_timestamp'] = actual_ts
-                        updated = True
-                        print(f"  [{i}] Added END stats (matched to {actual_ts}, diff: {self._time_diff(end_time, actual_ts):.3f}s)")
-                    else:
-                        print(f"  [{i}] No stats available for end time {end_time[:19]}")
-            
-            if updated:
-                self.write_csv_rows_atomic(rows, all_fieldnames)
-                
-        finally:
-            self.release_lock()
+            return (datetime.now() - datetime.fromisoformat(timestamp)).total_seconds()
+        except (TypeError, ValueError):
+            return float('inf')
     
     def _time_diff(self, ts1, ts2):
         """Calculate time difference in seconds between two ISO timestamps"""
@@ -279,26 +234,8 @@ class ResultsCSVUpdater:
         except:
             return float('inf')
     
-    def write_csv_rows_atomic(self, rows, fieldnames, max_retries=3):
-        """Write rows to CSV"""
-        for attempt in range(max_retries):
-            try:
-                with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(rows)
-                time.sleep(0.05)
-                os.chmod(self.csv_path, 0o666)
-                print(f"✅ Wrote {len(rows)} rows")
-                return True
-            except Exception as e:
-                print(f"  Write attempt {attempt+1} failed: {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(0.3)
-        return False
-    
     def watch_for_changes(self, check_interval=0.5, max_wait_time=10):
-        """Watch CSV for changes"""
+        """Watch the event journal for new events"""
         self.ensure_csv_initialized()
         
         # Start stats collection in background
@@ -307,10 +244,9 @@ class ResultsCSVUpdater:
         
         self.watch_active = True
         last_check_time = time.time()
-        last_file_size = 0
-        last_mod_time = 0
+        last_file_size = -1
         
-        print(f"Watching {self.csv_path}...")
+        print(f"Watching {self.journal_path} from offset {self.offset}...")
         print("-" * 60)
         
         try:
@@ -319,18 +255,16 @@ class ResultsCSVUpdater:
                     current_time = time.time()
                     time_since_check = current_time - last_check_time
                     
-                    if os.path.exists(self.csv_path):
+                    if os.path.exists(self.journal_path):
                         try:
-                            current_size = os.path.getsize(self.csv_path)
-                            current_mod_time = os.path.getmtime(self.csv_path)
+                            current_size = os.path.getsize(self.journal_path)
                             
                             if (current_size != last_file_size or 
-                                current_mod_time != last_mod_time or 
+                                self.pending or
                                 time_since_check >= max_wait_time):
                                 
                                 self.update_pending_rows()
                                 last_file_size = current_size
-                                last_mod_time = current_mod_time
                                 last_check_time = current_time
                         except OSError:
                             pass
@@ -346,7 +280,7 @@ class ResultsCSVUpdater:
         finally:
             self.watch_active = False
             self.stats_buffer.stop_collection()
-            self.release_lock()
+            self.stats_journal.flush()
             print("Watch stopped, stats buffer shutdown")
     
     def stop_watching(self):
@@ -356,11 +290,16 @@ class ResultsCSVUpdater:
 def main():
     csv_path = os.environ.get('RESULTS_CSV_PATH', './evaluations/results.csv')
     
-    if len(sys.argv) > 1:
-        csv_path = sys.argv[1]
+    args = [a for a in sys.argv[1:] if a != '--export']
+    if args:
+        csv_path = args[0]
+    
+    if '--export' in sys.argv[1:]:
+        materialize_csv(csv_path)
+        return
     
-    print(f"Results CSV Monitor with Historical Stats")
-    print(f"CSV Path: {csv_path}")
+    print(f"Results Journal Monitor with Historical Stats")
+    print(f"Journal Path: {journal_path_for(csv_path)}")
     print(f"Timestamp: {datetime.now().isoformat()}")
     print("-" * 60)
     